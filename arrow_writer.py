@@ -0,0 +1,219 @@
+"""
+Columnar dataset writer: Parquet or Arrow output for the final dataset.
+
+Trainers (Axolotl, Hugging Face datasets) memory-map Parquet and Arrow
+files instead of parsing JSONL. ArrowDatasetWriter takes the same rendered
+JSONL records as DatasetWriter and stores each record as a row, with the
+columns of its dialogue format (see RECORD_SCHEMAS):
+
+    sharegpt:      conversations: list<struct<from: string, value: string>>
+    chat_template: messages: list<struct<role: string, content: string>>
+    alpaca:        instruction: string, input: string, output: string
+
+Rows are buffered and written one row group (Parquet) or record batch
+(Arrow) at a time, so memory is bounded by the row group size. Shards roll
+over at row group boundaries. On close, a sidecar <output>.schema.json
+describes the schema, the shards and their row counts.
+
+Requires the optional 'pyarrow' package.
+
+Usage:
+    from arrow_writer import ArrowDatasetWriter
+
+    with ArrowDatasetWriter("out/sharegpt.parquet") as writer:
+        writer.write(json_codec.dumpb({"conversations": conversation}) + b"\\n")
+
+    # On the trainer side (zero-copy, memory-mapped):
+    datasets.load_dataset("parquet", data_files="out/sharegpt.parquet")
+    datasets.Dataset.from_file("out/sharegpt.arrow")
+"""
+
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import json_codec
+
+CONTAINERS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# Columns of each record format: name -> string, or list of (field, string) structs
+RECORD_SCHEMAS = {
+    "sharegpt": {"conversations": [("from", "string"), ("value", "string")]},
+    "chat_template": {"messages": [("role", "string"), ("content", "string")]},
+    "alpaca": {"instruction": "string", "input": "string", "output": "string"},
+}
+
+# Compression codecs supported by each container (None: uncompressed)
+COMPRESSIONS = {
+    "parquet": (None, "snappy", "gzip", "zstd", "lz4", "brotli"),
+    "arrow": (None, "zstd", "lz4"),
+}
+
+
+class ArrowDatasetWriter:
+    """Buffered, optionally sharded Parquet or Arrow writer of conversations."""
+
+    def __init__(self, output_file: str, container: str = "parquet", row_group_size: int = 1024,
+                 row_group_bytes: int = 64 * 1024 * 1024, shard_max_bytes: Optional[int] = None,
+                 shard_max_records: Optional[int] = None, compression: Optional[str] = None,
+                 buffer_size: Optional[int] = None, write_index: bool = True, record_format: str = "sharegpt"):
+        """
+        Args:
+            output_file: Path of the output file. Shards are named after it
+                with a _00001 style counter before the extension.
+            container: 'parquet' or 'arrow' (Arrow IPC stream, as used by
+                datasets.Dataset.from_file)
+            row_group_size: Maximum rows per row group / record batch
+            row_group_bytes: Write a row group once its rows reach this many
+                bytes of JSON, whatever their number
+            shard_max_bytes: Start a new shard once a shard reaches this many
+                bytes of JSON. Default: no size limit
+            shard_max_records: Start a new shard after this many records.
+                Default: no record limit
+            compression: Compression codec, see COMPRESSIONS. Default: snappy
+                for Parquet, none for Arrow
+            buffer_size: Unused, accepted for DatasetWriter compatibility
+            write_index: Write the <output>.schema.json sidecar on close
+            record_format: Dialogue format of the records, see RECORD_SCHEMAS
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet and Arrow output require the 'pyarrow' package: pip3 install pyarrow")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+
+        if container not in CONTAINERS:
+            raise ValueError(f"Unsupported container: {container}")
+        if compression is None and container == "parquet":
+            compression = "snappy"
+        if compression not in COMPRESSIONS[container]:
+            raise ValueError(f"Unsupported {container} compression: {compression}")
+        if record_format not in RECORD_SCHEMAS:
+            raise ValueError(f"Unsupported record format: {record_format}")
+
+        self.output_file = output_file
+        self.container = container
+        self.compression = compression
+        self.record_format = record_format
+        self.shard_max_bytes = shard_max_bytes
+        self.shard_max_records = shard_max_records
+        self.row_group_size = min(row_group_size, shard_max_records) if shard_max_records else row_group_size
+        self.row_group_bytes = row_group_bytes
+        self.write_index = write_index
+        self.sharded = bool(shard_max_bytes or shard_max_records)
+
+        self._root = os.path.splitext(output_file)[0]
+        self.index_file = f"{self._root}.schema.json"
+
+        fields = []
+        for name, column in RECORD_SCHEMAS[record_format].items():
+            if isinstance(column, str):
+                fields.append(pyarrow.field(name, pyarrow.type_for_alias(column)))
+            else:
+                item = pyarrow.struct([(key, pyarrow.type_for_alias(alias)) for key, alias in column])
+                fields.append(pyarrow.field(name, pyarrow.list_(item)))
+        self.schema = pyarrow.schema(fields, metadata={"format": record_format, "source": "Tavern-Logs-Converter"})
+
+        self.shards: List[Dict[str, Any]] = []
+        self._rows: List[Any] = []
+        self._rows_bytes = 0
+        self._writer = None
+        self._shard: Optional[Dict[str, Any]] = None
+        self._closed = False
+
+    def __enter__(self) -> "ArrowDatasetWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def output_files(self) -> List[str]:
+        return [shard["path"] for shard in self.shards]
+
+    @property
+    def records(self) -> int:
+        return sum(shard["records"] for shard in self.shards) + len(self._rows)
+
+    def _shard_path(self, number: int) -> str:
+        suffix = f"_{number:05d}" if self.sharded else ""
+        return f"{self._root}{suffix}{CONTAINERS[self.container]}"
+
+    def _open_shard(self) -> None:
+        path = self._shard_path(len(self.shards) + 1)
+        if self.container == "parquet":
+            self._writer = self._pq.ParquetWriter(path, self.schema, compression=self.compression)
+        else:
+            options = self._pa.ipc.IpcWriteOptions(compression=self.compression)
+            self._writer = self._pa.ipc.new_stream(path, self.schema, options=options)
+        self._shard = {"path": path, "records": 0, "bytes": 0, "row_groups": 0}
+        self.shards.append(self._shard)
+
+    def _close_shard(self) -> None:
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = self._shard = None
+
+    def _flush(self) -> None:
+        """Write the buffered rows as one row group."""
+        if not self._rows:
+            return
+        shard = self._shard
+        if shard is not None and (
+            (self.shard_max_records and shard["records"] + len(self._rows) > self.shard_max_records)
+            or (self.shard_max_bytes and shard["bytes"] + self._rows_bytes > self.shard_max_bytes)
+        ):
+            self._close_shard()
+        if self._writer is None:
+            self._open_shard()
+
+        table = self._pa.Table.from_pylist(self._rows, schema=self.schema)
+        self._writer.write_table(table)
+        self._shard["records"] += len(self._rows)
+        self._shard["bytes"] += self._rows_bytes
+        self._shard["row_groups"] += 1
+        self._rows = []
+        self._rows_bytes = 0
+
+    def write(self, line: Union[str, bytes]) -> None:
+        """Write one record, a rendered JSON line."""
+        self._rows.append(json_codec.loads(line))
+        self._rows_bytes += len(line)
+        if len(self._rows) >= self.row_group_size or self._rows_bytes >= self.row_group_bytes:
+            self._flush()
+
+    def write_chunks(self, chunks: Iterable[bytes]) -> int:
+        """Write one record given as consecutive pieces of a JSON line."""
+        line = b"".join(chunks)
+        self.write(line)
+        return len(line)
+
+    def close(self) -> None:
+        """Write the remaining rows, close the current shard and write the sidecar."""
+        if self._closed:
+            return
+        self._closed = True
+
+        self._flush()
+        if not self.shards:
+            # Nothing was written; still produce an (empty) output file
+            self._open_shard()
+        self._close_shard()
+
+        if self.write_index:
+            sidecar = {
+                "container": self.container,
+                "compression": self.compression,
+                "records": self.records,
+                "schema": {field.name: str(field.type) for field in self.schema},
+                "arrow_schema": self.schema.to_string(show_schema_metadata=False),
+                "metadata": {key.decode(): value.decode() for key, value in self.schema.metadata.items()},
+                "shards": [
+                    {**shard, "path": os.path.basename(shard["path"])} for shard in self.shards
+                ],
+            }
+            with open(self.index_file, "w", encoding="utf-8") as f:
+                json.dump(sidecar, f, indent=2)
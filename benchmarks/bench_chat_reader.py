@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark for reading chat logs.
+
+Compares the old read path of LogPreprocessor.process_file (readlines(),
+two search_metadata() scans, then json.loads() on every line again) with
+ChatReader on one large synthetic chat. Reports json.loads calls, wall time
+and peak traced memory.
+
+Usage:
+    python3 benchmarks/bench_chat_reader.py --messages 50000 --length 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_reader import ChatReader
+
+WORDS = ["the", "rain", "against", "window", "she", "smiled", "quietly", "*walks over*", "\"Hello.\""]
+
+
+class CountingLoads:
+    """json.loads wrapper that counts calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, line):
+        self.calls += 1
+        return json.loads(line)
+
+
+def write_chat(path: str, messages: int, length: int, rng: random.Random) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"user_name": "John", "character_name": "Alice", "chat_metadata": {}}) + "\n")
+        for i in range(messages):
+            words = []
+            while sum(len(w) + 1 for w in words) < length:
+                words.append(rng.choice(WORDS))
+            mes = " ".join(words)
+            f.write(json.dumps({
+                "name": "John" if i % 2 == 0 else "Alice",
+                "is_user": i % 2 == 0,
+                "send_date": "2024-01-01",
+                "mes": mes,
+                "swipes": [mes],
+                "extra": {},
+            }) + "\n")
+
+
+def legacy_read(path: str, loads) -> int:
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+
+    def search_metadata(field):
+        for line in lines:
+            jobj = loads(line)
+            if field in jobj:
+                return jobj[field]
+
+    search_metadata("user_name")
+    search_metadata("character_name")
+
+    entries = []
+    for line in lines:
+        entries.append({k: v for k, v in loads(line).items() if k in ("name", "mes", "is_user", "extra")})
+    return len(entries)
+
+
+def reader_read(path: str) -> int:
+    with ChatReader(path) as reader:
+        entries = []
+        for record in reader.records():
+            entries.append({k: v for k, v in record.items() if k in ("name", "mes", "is_user", "extra")})
+        reader_read.parse_calls = reader.parse_calls
+    return len(entries)
+
+
+def reader_stream(path: str) -> int:
+    with ChatReader(path) as reader:
+        return sum(1 for _ in reader.records())
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat log reading")
+    parser.add_argument("--messages", type=int, default=20_000, help="Messages in the chat")
+    parser.add_argument("--length", type=int, default=1_000, help="Characters per message")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "chat.jsonl")
+        write_chat(path, args.messages, args.length, random.Random(args.seed))
+        size_mb = os.path.getsize(path) / 1024 / 1024
+
+        loads = CountingLoads()
+        legacy_count, legacy_time, legacy_peak = measure(lambda: legacy_read(path, loads))
+        reader_count, reader_time, reader_peak = measure(lambda: reader_read(path))
+        stream_count, stream_time, stream_peak = measure(lambda: reader_stream(path))
+        assert legacy_count == reader_count == stream_count
+
+        print(f"chat: {args.messages} messages, {size_mb:.1f} MB")
+        print(f"legacy : {loads.calls:8d} json.loads | {legacy_time * 1000:8.1f} ms | peak {legacy_peak / 1024 / 1024:8.1f} MB")
+        print(f"reader : {reader_read.parse_calls:8d} json.loads | {reader_time * 1000:8.1f} ms | peak {reader_peak / 1024 / 1024:8.1f} MB")
+        print(f"stream : {reader_read.parse_calls:8d} json.loads | {stream_time * 1000:8.1f} ms | peak {stream_peak / 1024 / 1024:8.1f} MB")
+        print("(legacy and reader keep the cleaned entries, stream only iterates over them)")
+
+
+if __name__ == "__main__":
+    main()
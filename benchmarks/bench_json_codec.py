@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the JSON codec backends.
+
+Times every installed backend (orjson, ujson, stdlib json) on the JSON work
+each stage does, using realistic SillyTavern message records:
+- stage 1 decode: raw chat lines (bytes) -> dicts
+- stage 1 encode: cleaned entries -> JSONL lines
+- stage 2 encode: ShareGPT records -> JSONL lines
+and checks that every backend produces the same output.
+
+Usage:
+    python3 benchmarks/bench_json_codec.py --messages 20000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_codec
+
+WORDS = [
+    "the", "rain", "against", "window", "she", "smiled", "quietly", "*walks over*", "\"Hello.\"",
+    "café", "naïve", "—", "…", "😊", "Привет", "こんにちは",
+]
+
+
+def make_records(messages: int, rng: random.Random) -> list:
+    records = []
+    for i in range(messages):
+        is_user = i % 2 == 0
+        mes = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 400)))
+        record = {
+            "name": "John" if is_user else "Alice",
+            "is_user": is_user,
+            "is_system": False,
+            "send_date": "June 1, 2024 10:15pm",
+            "mes": mes,
+            "extra": {},
+        }
+        if not is_user:
+            record["extra"] = {
+                "api": "openai",
+                "model": "some-model",
+                "reasoning": " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 200))),
+                "token_count": rng.randint(10, 2000),
+            }
+            record["gen_started"] = "2024-06-01T22:15:00.000Z"
+            record["swipe_id"] = 0
+            record["swipes"] = [mes, " ".join(rng.choice(WORDS) for _ in range(50))]
+            record["swipe_info"] = [{"send_date": "June 1, 2024 10:15pm", "extra": {}}]
+        records.append(record)
+    return records
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON codec backends")
+    parser.add_argument("--messages", type=int, default=10_000, help="Number of message records")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions, best time is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    records = make_records(args.messages, random.Random(args.seed))
+    raw_lines = [json.dumps(record).encode("utf-8") for record in records]
+    entries = [{k: v for k, v in r.items() if k in ("name", "mes", "is_user", "extra")} for r in records]
+    sharegpt = [{"conversations": [{"from": "human" if e["is_user"] else "gpt", "value": e["mes"]}
+                                   for e in entries[i:i + 50]]} for i in range(0, len(entries), 50)]
+    size_mb = sum(len(line) for line in raw_lines) / 1024 / 1024
+    print(f"{args.messages} records, {size_mb:.1f} MB of raw chat lines")
+
+    outputs = {}
+    baseline = None
+    for backend in json_codec.available_backends():
+        json_codec.set_backend(backend)
+        loads, dumps = json_codec.loads, json_codec.dumpb
+
+        timings = {
+            "stage1 decode": best_of(lambda: [loads(line) for line in raw_lines], args.repeat),
+            "stage1 encode": best_of(lambda: [dumps(entry) for entry in entries], args.repeat),
+            "stage2 encode": best_of(lambda: [dumps(record) for record in sharegpt], args.repeat),
+        }
+        outputs[backend] = ([dumps(entry) for entry in entries], [dumps(record) for record in sharegpt])
+        assert [loads(line) for line in raw_lines] == records
+
+        baseline = baseline or timings
+        line = " | ".join(f"{stage} {t * 1000:8.1f} ms" for stage, t in timings.items())
+        total = sum(timings.values())
+        print(f"{backend:>7}: {line} | total {total * 1000:8.1f} ms")
+
+    reference = outputs.get("json")
+    for backend, output in outputs.items():
+        if reference is not None and output != reference:
+            print(f"MISMATCH: {backend} output differs from stdlib json")
+            sys.exit(1)
+    print(f"Output identical across: {', '.join(outputs)}. Default backend: {json_codec.available_backends()[0]}")
+
+
+if __name__ == "__main__":
+    main()
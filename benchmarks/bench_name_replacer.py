@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for user name obfuscation.
+
+Compares the sequential replacement chain (192 str.replace passes per name)
+with the compiled NameReplacer on long synthetic messages, and checks that
+both produce the same output.
+
+Usage:
+    python3 benchmarks/bench_name_replacer.py --length 200000 --repeat 5
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from name_replacer import fuzzy_replace_sequential, get_name_replacer, split_name
+
+WORDS = [
+    "the", "a", "she", "smiled", "quietly", "at", "door", "*walks", "over*", "said",
+    "\"Hello", "there.\"", "—", "rain", "against", "window", "and", "then", "looked",
+]
+
+
+def make_message(length: int, name: str, rng: random.Random) -> str:
+    """Build a message of roughly `length` characters mentioning `name` often."""
+    parts = []
+    size = 0
+    variants = split_name(name) + [name.upper(), name.lower(), f"*{name}*", f"\"{name},"]
+    while size < length:
+        word = rng.choice(variants) if rng.random() < 0.05 else rng.choice(WORDS)
+        parts.append(word)
+        size += len(word) + 1
+    return " ".join(parts)
+
+
+def sequential_replace_name(message: str, original_name: str, new_name: str) -> str:
+    for name in split_name(original_name):
+        message = fuzzy_replace_sequential(message, name, new_name)
+    return message
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark name replacement")
+    parser.add_argument("--length", type=int, default=100_000, help="Message length in characters")
+    parser.add_argument("--messages", type=int, default=20, help="Number of messages")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions, best time is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = [("John Smith", "Avery"), ("Alice", "Quinn"), ("Bob", "Kai")]
+
+    for original_name, new_name in cases:
+        messages = [make_message(args.length, original_name, rng) for _ in range(args.messages)]
+        replacer = get_name_replacer(original_name, new_name)
+
+        for message in messages:
+            if replacer.replace(message) != sequential_replace_name(message, original_name, new_name):
+                print(f"MISMATCH for {original_name!r} -> {new_name!r}")
+                sys.exit(1)
+
+        sequential = best_of(
+            lambda: [sequential_replace_name(m, original_name, new_name) for m in messages], args.repeat
+        )
+        compiled = best_of(lambda: [replacer.replace(m) for m in messages], args.repeat)
+        strategy = replacer.strategy
+
+        print(
+            f"{original_name!r:>14} -> {new_name!r:<8} [{strategy:>10}] "
+            f"sequential {sequential * 1000:9.2f} ms | compiled {compiled * 1000:9.2f} ms | "
+            f"speedup x{sequential / compiled:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite.
+
+Generates (or reuses) a synthetic SillyTavern directory and times the hot
+paths separately and end to end:
+- card_parse:    v2_card.parse on every card
+- name_replace:  LogPreprocessor.replace_name on every message
+- stage1:        LogPreprocessor.process_all_files
+- stage2:        AxolotlConverter.process_all_files on the stage 1 output
+- end_to_end:    streamed stage 1 -> stage 2 (the default main.py pipeline)
+
+Results are written as JSON so hot path regressions can be tracked from run
+to run; --baseline prints the change against an earlier results file.
+
+Usage:
+    python3 benchmarks/bench_pipeline.py --characters 10 --chats 20 --messages 200 -o results.json
+    python3 benchmarks/bench_pipeline.py ... -o new.json --baseline results.json
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import json_codec
+import v2_card
+from stage1_preprocessor import LogPreprocessor
+from stage2_axolotl import AxolotlConverter
+from synthetic_corpus import CorpusSpec, generate_corpus
+
+
+def timed(fn, repeat: int) -> dict:
+    """Run fn repeat times with stdout silenced; report best wall and CPU time."""
+    best_wall = best_cpu = float("inf")
+    result = None
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        best_wall = min(best_wall, time.perf_counter() - wall)
+        best_cpu = min(best_cpu, time.process_time() - cpu)
+    return {"wall_s": round(best_wall, 6), "cpu_s": round(best_cpu, 6), "result": result}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(BENCH_DIR), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def bench_card_parse(st_dir: str, repeat: int) -> dict:
+    cards = sorted(glob.glob(os.path.join(st_dir, "data", "default-user", "characters", "*.png")))
+    return timed(lambda: len([v2_card.parse(card) for card in cards]), repeat)
+
+
+def bench_name_replace(st_dir: str, repeat: int) -> dict:
+    processor = LogPreprocessor(st_dir, None, obfuscate=True, seed=0)
+    jobs = []
+    for log_path in processor.list_log_files():
+        with open(log_path, "rb") as f:
+            records = [json_codec.loads(line) for line in f]
+        user_name = records[0].get("user_name")
+        jobs.extend((record["mes"], user_name) for record in records[1:] if "mes" in record)
+
+    def run():
+        for mes, user_name in jobs:
+            processor.replace_name(mes, user_name, "Avery")
+        return len(jobs)
+
+    return timed(run, repeat)
+
+
+def bench_stage1(st_dir: str, out_dir: str, repeat: int, workers: int) -> dict:
+    def run():
+        shutil.rmtree(out_dir, ignore_errors=True)
+        return LogPreprocessor(st_dir, out_dir, obfuscate=True, seed=0).process_all_files(workers=workers)
+
+    return timed(run, repeat)
+
+
+def bench_stage2(stage1_dir: str, output_file: str, repeat: int) -> dict:
+    return timed(lambda: AxolotlConverter("sharegpt", stage1_dir, output_file).process_all_files(True), repeat)
+
+
+def bench_end_to_end(st_dir: str, output_file: str, repeat: int, workers: int) -> dict:
+    def run():
+        processor = LogPreprocessor(st_dir, None, obfuscate=True, seed=0)
+        converter = AxolotlConverter("sharegpt", None, output_file)
+        conversations = (conversation for _, conversation in processor.iter_conversations(workers=workers))
+        return converter.process_conversations(conversations, True)
+
+    return timed(run, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark suite")
+    parser.add_argument("--input", type=str, help="Existing SillyTavern directory to benchmark instead of a synthetic one")
+    parser.add_argument("--characters", type=int, default=5)
+    parser.add_argument("--chats", type=int, default=10, help="Chats per character")
+    parser.add_argument("--messages", type=int, default=100, help="Messages per chat")
+    parser.add_argument("--words", type=int, default=60, help="Median message length in words")
+    parser.add_argument("--reasoning", type=float, default=0.3, help="Share of assistant messages with reasoning")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="Workers for stage 1 and end to end")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions, best time is reported")
+    parser.add_argument("-o", "--output", type=str, default="bench_results.json", help="Results file")
+    parser.add_argument("--baseline", type=str, help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        st_dir = args.input
+        corpus = None
+        if not st_dir:
+            st_dir = os.path.join(tmp, "st")
+            corpus = generate_corpus(st_dir, CorpusSpec(
+                characters=args.characters,
+                chats_per_character=args.chats,
+                messages_per_chat=args.messages,
+                message_words_median=args.words,
+                reasoning_ratio=args.reasoning,
+                seed=args.seed,
+            ))
+
+        stage1_dir = os.path.join(tmp, "stage1_out")
+        benchmarks = {
+            "card_parse": bench_card_parse(st_dir, args.repeat),
+            "name_replace": bench_name_replace(st_dir, args.repeat),
+            "stage1": bench_stage1(st_dir, stage1_dir, args.repeat, args.workers),
+            "stage2": bench_stage2(stage1_dir, os.path.join(tmp, "stage2.jsonl"), args.repeat),
+            "end_to_end": bench_end_to_end(st_dir, os.path.join(tmp, "fused.jsonl"), args.repeat, args.workers),
+        }
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "json_backend": json_codec.BACKEND,
+        "workers": args.workers,
+        "corpus": corpus or {"input": st_dir},
+        "benchmarks": benchmarks,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("benchmarks", {})
+
+    for name, result in benchmarks.items():
+        line = f"{name:>12}: wall {result['wall_s'] * 1000:9.1f} ms | cpu {result['cpu_s'] * 1000:9.1f} ms"
+        if name in baseline and baseline[name]["wall_s"]:
+            line += f" | x{result['wall_s'] / baseline[name]['wall_s']:.2f} vs baseline"
+        print(line)
+    print(f"Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the stage 1 intermediate formats.
+
+Generates a synthetic SillyTavern directory (or uses --input), writes the
+stage 1 logs in each format (see stage1_format) and reports, per format:
+- size:   total size of stage1_out
+- write:  LogPreprocessor.process_all_files
+- read:   stage1_format.read_log on every log (entries only)
+- stage2: AxolotlConverter.process_all_files on the stage 1 output
+
+Usage:
+    python3 benchmarks/bench_stage1_format.py --characters 10 --chats 20 --messages 200
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import json_codec
+import stage1_format
+from stage1_preprocessor import LogPreprocessor
+from stage2_axolotl import AxolotlConverter
+from synthetic_corpus import CorpusSpec, generate_corpus
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+def read_all(stage1_dir: str) -> int:
+    entries = 0
+    for file in os.listdir(stage1_dir):
+        for _ in stage1_format.read_log(os.path.join(stage1_dir, file)):
+            entries += 1
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage 1 format benchmark")
+    parser.add_argument("--input", type=str, help="Existing SillyTavern directory to benchmark instead of a synthetic one")
+    parser.add_argument("--characters", type=int, default=5)
+    parser.add_argument("--chats", type=int, default=20, help="Chats per character")
+    parser.add_argument("--messages", type=int, default=200, help="Messages per chat")
+    parser.add_argument("--words", type=int, default=60, help="Median message length in words")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions, best time is reported")
+    parser.add_argument("--json-backend", type=str, choices=list(json_codec.BACKENDS),
+                        help="JSON backend to compare against. Default: the fastest installed")
+    args = parser.parse_args()
+    if args.json_backend:
+        json_codec.set_backend(args.json_backend)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        st_dir = args.input
+        if not st_dir:
+            st_dir = os.path.join(tmp, "st")
+            corpus = generate_corpus(st_dir, CorpusSpec(
+                characters=args.characters,
+                chats_per_character=args.chats,
+                messages_per_chat=args.messages,
+                message_words_median=args.words,
+                seed=args.seed,
+            ))
+            print(f"Corpus: {corpus['chats']} chats, {corpus['chat_bytes'] / 1024 / 1024:.1f} MB")
+        print(f"JSON backend: {json_codec.BACKEND}")
+
+        results = {}
+        for log_format in stage1_format.FORMATS:
+            stage1_dir = os.path.join(tmp, f"stage1_{log_format}")
+
+            def write():
+                processor = LogPreprocessor(st_dir, stage1_dir, obfuscate=True, seed=0, output_format=log_format)
+                processor.process_all_files()
+
+            write_s = best_of(write, args.repeat)
+            read_s = best_of(lambda: read_all(stage1_dir), args.repeat)
+            output_file = os.path.join(tmp, f"stage2_{log_format}.jsonl")
+            stage2_s = best_of(lambda: AxolotlConverter("sharegpt", stage1_dir, output_file).process_all_files(True),
+                               args.repeat)
+            results[log_format] = {"size": dir_size(stage1_dir), "write": write_s, "read": read_s, "stage2": stage2_s}
+
+    jsonl = results["jsonl"]
+    for log_format, result in results.items():
+        print(f"{log_format:>7}: size {result['size'] / 1024 / 1024:8.2f} MB (x{result['size'] / jsonl['size']:.2f}) | "
+              f"write {result['write'] * 1000:8.1f} ms | read {result['read'] * 1000:8.1f} ms "
+              f"(x{jsonl['read'] / result['read']:.2f} faster) | stage2 {result['stage2'] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Synthetic SillyTavern directory generator.
+
+Builds a directory that looks like a real SillyTavern install:
+    <root>/public/
+    <root>/data/default-user/characters/<Character>.png   (V2 card in a 'chara' tEXt chunk)
+    <root>/data/default-user/chats/<Character>/<Character> - <date>.jsonl
+
+Usage as a script:
+    python3 benchmarks/synthetic_corpus.py /tmp/st --characters 20 --chats 50 --messages 200
+
+Usage as a library:
+    from synthetic_corpus import CorpusSpec, generate_corpus
+
+    generate_corpus("/tmp/st", CorpusSpec(characters=5, chats_per_character=10))
+"""
+
+import argparse
+import base64
+import json
+import math
+import os
+import random
+from dataclasses import asdict, dataclass, field
+from typing import List
+
+from PIL import Image, PngImagePlugin
+
+FIRST_NAMES = [
+    "Alice", "Bran", "Cordelia", "Dmitri", "Elara", "Faye", "Gideon", "Hana", "Ivo", "Juno",
+    "Kestrel", "Lysander", "Mira", "Nadia", "Orin", "Petra", "Quill", "Rhea", "Silas", "Talia",
+]
+LAST_NAMES = ["Ashford", "Blackwood", "Crane", "Dusk", "Everly", "Frost", "Grey", "Holloway"]
+USER_NAMES = ["John Smith", "Anon", "Sam", "Kit Walker", "Bob"]
+WORDS = [
+    "the", "a", "and", "then", "she", "he", "they", "smiled", "quietly", "looked", "at", "door",
+    "window", "rain", "against", "glass", "softly", "*walks over*", "*sighs*", "\"Hello.\"",
+    "\"Why?\"", "—", "heart", "sword", "tavern", "night", "cold", "warm", "laughs", "…", "café",
+]
+LOREBOOK_KEYS = ["tavern", "sword", "rain", "castle", "forest", "dragon", "river", "market"]
+
+
+@dataclass
+class CorpusSpec:
+    """Shape of the generated corpus."""
+    characters: int = 10
+    chats_per_character: int = 20
+    messages_per_chat: int = 100
+    # Message length in words follows a log-normal distribution
+    message_words_median: int = 60
+    message_words_sigma: float = 0.8
+    # Share of assistant messages carrying extra.reasoning
+    reasoning_ratio: float = 0.3
+    # Lorebook entries per character card
+    lorebook_entries: int = 8
+    card_size: int = 256
+    seed: int = 0
+    user_names: List[str] = field(default_factory=lambda: list(USER_NAMES))
+
+
+def _words(rng: random.Random, spec: CorpusSpec, names: List[str]) -> str:
+    count = max(1, int(rng.lognormvariate(math.log(spec.message_words_median), spec.message_words_sigma)))
+    vocabulary = WORDS + names
+    return " ".join(rng.choice(vocabulary) for _ in range(count))
+
+
+def _character_name(index: int) -> str:
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    if index < len(FIRST_NAMES):
+        return first
+    return f"{first} {LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)]}"
+
+
+def write_card(path: str, name: str, spec: CorpusSpec, rng: random.Random) -> None:
+    """Write a PNG with an embedded Character Card V2."""
+    entries = []
+    for i in range(spec.lorebook_entries):
+        key = LOREBOOK_KEYS[i % len(LOREBOOK_KEYS)]
+        entries.append({
+            "keys": [key],
+            "content": f"{{{{char}}}} knows about the {key}.",
+            "enabled": True,
+            "insertion_order": i,
+            "case_sensitive": False,
+            "constant": i == 0,
+        })
+
+    card = {
+        "spec": "chara_card_v2",
+        "spec_version": "2.0",
+        "data": {
+            "name": name,
+            "description": f"{{{{char}}}} is a traveler who met {{{{user}}}} in a tavern. "
+                           + " ".join(rng.choice(WORDS) for _ in range(80)),
+            "personality": "curious",
+            "scenario": "A rainy night.",
+            "first_mes": f"*{name} looks up.* Hello, {{{{user}}}}.",
+            "mes_example": "",
+            "tags": ["synthetic"],
+            "character_book": {"scan_depth": 4, "token_budget": 512, "entries": entries},
+        },
+    }
+
+    image = Image.new("RGB", (spec.card_size, spec.card_size), (rng.randrange(256), 64, 128))
+    info = PngImagePlugin.PngInfo()
+    info.add_text("chara", base64.b64encode(json.dumps(card).encode("utf-8")).decode("ascii"))
+    image.save(path, pnginfo=info)
+
+
+def write_chat(path: str, char_name: str, user_name: str, spec: CorpusSpec, rng: random.Random) -> None:
+    """Write one chat log: a metadata header and alternating messages."""
+    names = [user_name, user_name.split(" ")[0], user_name.upper(), char_name]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "user_name": user_name,
+            "character_name": char_name,
+            "create_date": "2024-06-01@22h15m00s",
+            "chat_metadata": {"note_prompt": "", "note_interval": 1},
+        }) + "\n")
+
+        for i in range(spec.messages_per_chat):
+            is_user = i % 2 == 1
+            mes = _words(rng, spec, names)
+            record = {
+                "name": user_name if is_user else char_name,
+                "is_user": is_user,
+                "is_system": False,
+                "send_date": "June 1, 2024 10:15pm",
+                "mes": mes,
+                "extra": {},
+            }
+            if not is_user:
+                record["swipe_id"] = 0
+                record["swipes"] = [mes, _words(rng, spec, names)]
+                record["extra"] = {"api": "openai", "model": "synthetic"}
+                if rng.random() < spec.reasoning_ratio:
+                    record["extra"]["reasoning"] = _words(rng, spec, names)
+            f.write(json.dumps(record) + "\n")
+
+
+def generate_corpus(root: str, spec: CorpusSpec) -> dict:
+    """
+    Generate a synthetic SillyTavern directory.
+
+    Returns:
+        Summary with the spec, file counts and total chat bytes
+    """
+    rng = random.Random(spec.seed)
+    characters_dir = os.path.join(root, "data", "default-user", "characters")
+    chats_dir = os.path.join(root, "data", "default-user", "chats")
+    os.makedirs(os.path.join(root, "public"), exist_ok=True)
+    os.makedirs(characters_dir, exist_ok=True)
+
+    chat_bytes = 0
+    chats = 0
+    for c in range(spec.characters):
+        char_name = _character_name(c)
+        write_card(os.path.join(characters_dir, f"{char_name}.png"), char_name, spec, rng)
+
+        char_chats_dir = os.path.join(chats_dir, char_name)
+        os.makedirs(char_chats_dir, exist_ok=True)
+        for k in range(spec.chats_per_character):
+            path = os.path.join(char_chats_dir, f"{char_name} - 2024-06-{1 + k % 28:02d}@{k:05d}.jsonl")
+            write_chat(path, char_name, rng.choice(spec.user_names), spec, rng)
+            chat_bytes += os.path.getsize(path)
+            chats += 1
+
+    return {"spec": asdict(spec), "chats": chats, "cards": spec.characters, "chat_bytes": chat_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic SillyTavern directory")
+    parser.add_argument("root", type=str, help="Directory to create")
+    parser.add_argument("--characters", type=int, default=10)
+    parser.add_argument("--chats", type=int, default=20, help="Chats per character")
+    parser.add_argument("--messages", type=int, default=100, help="Messages per chat")
+    parser.add_argument("--words", type=int, default=60, help="Median message length in words")
+    parser.add_argument("--sigma", type=float, default=0.8, help="Log-normal sigma of message length")
+    parser.add_argument("--reasoning", type=float, default=0.3, help="Share of assistant messages with reasoning")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    summary = generate_corpus(args.root, CorpusSpec(
+        characters=args.characters,
+        chats_per_character=args.chats,
+        messages_per_chat=args.messages,
+        message_words_median=args.words,
+        message_words_sigma=args.sigma,
+        reasoning_ratio=args.reasoning,
+        seed=args.seed,
+    ))
+    print(f"Generated {summary['chats']} chats ({summary['chat_bytes'] / 1024 / 1024:.1f} MB) "
+          f"and {summary['cards']} cards in {args.root}")
+
+
+if __name__ == "__main__":
+    main()
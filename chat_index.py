@@ -0,0 +1,216 @@
+"""
+Persistent SQLite index of the chats folder.
+
+One row per chat log: path (relative to the chats folder), character, user
+name, size, mtime, message count and whether any message carries
+reasoning. update() only stats the files and re-reads the ones that are
+new or changed, so after the first run it costs one directory walk.
+select() answers selection filters (character, user, message count,
+modified since, reasoning) from the index alone, without opening any chat.
+
+Usage:
+    from chat_index import ChatIndex
+
+    index = ChatIndex("out/.cache/chats.sqlite")
+    index.update(chats_folder)
+    log_paths = index.select(chats_folder, characters=["Alice"], min_messages=20)
+"""
+
+import os
+import sqlite3
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from chat_reader import ChatReader
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    path TEXT PRIMARY KEY,
+    character TEXT,
+    user_name TEXT,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    messages INTEGER NOT NULL,
+    has_reasoning INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chats_character ON chats (character);
+CREATE INDEX IF NOT EXISTS chats_mtime ON chats (mtime_ns);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def parse_date(date: str) -> float:
+    """Parse an ISO date or date-time ('2024-06-01', '2024-06-01T22:15') into a timestamp."""
+    return datetime.fromisoformat(date).timestamp()
+
+
+def scan_chat(log_path: str) -> Tuple[Optional[str], Optional[str], int, bool]:
+    """
+    Read the indexed fields of a chat log.
+
+    Returns:
+        (character name, user name, message count, has reasoning).
+        The character name falls back to the name of the chat's folder.
+    """
+    messages = 0
+    has_reasoning = False
+    with ChatReader(log_path) as reader:
+        for message in reader:
+            messages += 1
+            extra = message.get("extra")
+            if not has_reasoning and isinstance(extra, dict) and extra.get("reasoning"):
+                has_reasoning = True
+        character = reader.character_name or os.path.basename(os.path.dirname(log_path))
+        return character, reader.user_name, messages, has_reasoning
+
+
+class ChatIndex:
+    """SQLite index of the chat logs in a chats folder."""
+
+    VERSION = 1
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: Path of the SQLite database, created if missing
+        """
+        self.db_path = db_path
+        # A connection is opened per call, so the index can be passed to worker processes
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def _reset_if_stale(self, connection: sqlite3.Connection, chats_folder: str) -> None:
+        """Drop the rows if they were indexed by another version or from another folder."""
+        expected = {"version": str(self.VERSION), "chats_folder": os.path.abspath(chats_folder)}
+        stored = dict(connection.execute("SELECT key, value FROM meta"))
+        if stored != expected:
+            connection.execute("DELETE FROM chats")
+            connection.execute("DELETE FROM meta")
+            connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", expected.items())
+
+    def update(self, chats_folder: str) -> Counter:
+        """
+        Bring the index up to date with the chats folder. Only new and changed
+        files (by size and mtime) are read.
+
+        Returns:
+            Counts of added, updated, removed and unchanged chats, and of
+            chats that could not be read (errors)
+        """
+        counts = Counter()
+        connection = self._connect()
+        try:
+            with connection:
+                self._reset_if_stale(connection, chats_folder)
+                known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                         connection.execute("SELECT path, size, mtime_ns FROM chats")}
+
+                rows = []
+                failed = []
+                for root, _, files in os.walk(chats_folder):
+                    for file in files:
+                        if not file.endswith(".jsonl"):
+                            continue
+                        log_path = os.path.join(root, file)
+                        path = os.path.relpath(log_path, chats_folder)
+                        try:
+                            stat = os.stat(log_path)
+                        except OSError:
+                            # Deleted between the listing and the stat
+                            continue
+                        previous = known.pop(path, None)
+                        if previous == (stat.st_size, stat.st_mtime_ns):
+                            counts["unchanged"] += 1
+                            continue
+                        try:
+                            fields = scan_chat(log_path)
+                        except Exception:
+                            # Unreadable or malformed: left out of the index until it changes
+                            counts["errors"] += 1
+                            failed.append(path)
+                            continue
+                        counts["updated" if previous else "added"] += 1
+                        rows.append((path, *fields, stat.st_size, stat.st_mtime_ns))
+
+                connection.executemany(
+                    "INSERT OR REPLACE INTO chats (path, character, user_name, messages, has_reasoning, size, mtime_ns)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                connection.executemany("DELETE FROM chats WHERE path = ?", ((path,) for path in known))
+                connection.executemany("DELETE FROM chats WHERE path = ?", ((path,) for path in failed))
+                counts["removed"] += len(known)
+        finally:
+            connection.close()
+        return counts
+
+    def characters(self) -> Counter:
+        """Number of indexed chats of each character."""
+        connection = self._connect()
+        try:
+            return Counter(dict(connection.execute(
+                "SELECT character, COUNT(*) FROM chats WHERE character IS NOT NULL GROUP BY character")))
+        finally:
+            connection.close()
+
+    def select(self, chats_folder: str, characters: Optional[Iterable[str]] = None,
+               user_names: Optional[Iterable[str]] = None, min_messages: Optional[int] = None,
+               max_messages: Optional[int] = None, modified_since: Optional[float] = None,
+               has_reasoning: Optional[bool] = None) -> List[str]:
+        """
+        Select chat logs from the index. Filters left as None are not applied.
+
+        Args:
+            chats_folder: The indexed chats folder, joined to the returned paths
+            characters: Character names to keep
+            user_names: User names to keep
+            min_messages: Minimum number of messages
+            max_messages: Maximum number of messages
+            modified_since: Keep chats modified at or after this timestamp
+            has_reasoning: Keep only chats with (True) or without (False) reasoning
+
+        Returns:
+            Paths of the selected logs, sorted
+        """
+        conditions, params = [], []
+        if characters is not None:
+            characters = list(characters)
+            conditions.append(f"character IN ({', '.join('?' * len(characters))})")
+            params += characters
+        if user_names is not None:
+            user_names = list(user_names)
+            conditions.append(f"user_name IN ({', '.join('?' * len(user_names))})")
+            params += user_names
+        if min_messages is not None:
+            conditions.append("messages >= ?")
+            params.append(min_messages)
+        if max_messages is not None:
+            conditions.append("messages <= ?")
+            params.append(max_messages)
+        if modified_since is not None:
+            conditions.append("mtime_ns >= ?")
+            params.append(int(modified_since * 1_000_000_000))
+        if has_reasoning is not None:
+            conditions.append("has_reasoning = ?")
+            params.append(int(has_reasoning))
+
+        query = "SELECT path FROM chats"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        connection = self._connect()
+        try:
+            paths = [path for path, in connection.execute(query, params)]
+        finally:
+            connection.close()
+        return sorted(os.path.join(chats_folder, path) for path in paths)
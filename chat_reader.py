@@ -0,0 +1,129 @@
+"""
+Streaming reader for SillyTavern chat logs.
+
+A chat log is JSONL: a metadata header (user_name, character_name,
+chat_metadata, ...) followed by one message per line. ChatReader parses
+every line exactly once, reads the metadata up front and then yields the
+messages lazily, so memory does not grow with the size of the chat.
+
+Usage:
+    from chat_reader import ChatReader
+
+    with ChatReader("chat.jsonl") as reader:
+        user_name = reader.metadata.get("user_name")
+        for message in reader:
+            print(message["name"], message["mes"])
+"""
+
+from collections import deque
+from itertools import chain
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple, TypedDict
+
+import json_codec
+from line_index import LineIndex
+
+
+class ChatMessage(TypedDict, total=False):
+    """A chat message record, as stored by SillyTavern (unknown fields are kept)."""
+    name: str
+    mes: str
+    is_user: bool
+    is_system: bool
+    send_date: str
+    extra: Dict[str, Any]
+    swipes: list
+
+
+class ChatReader:
+    """Single-pass reader for a chat log file."""
+
+    # Header fields looked up before messages are yielded
+    METADATA_FIELDS = ("user_name", "character_name")
+
+    def __init__(self, log_path: str, line_range: Optional[Tuple[int, int]] = None):
+        """
+        Open a chat log and read its metadata.
+
+        Args:
+            log_path: Path to the chat log
+            line_range: Only read the metadata header and lines [start, stop),
+                seeking to them through the log's LineIndex
+        """
+        self.log_path = log_path
+        self.metadata: Dict[str, Any] = {}
+        # Number of JSON decode calls and bytes read so far
+        self.parse_calls = 0
+        self.bytes_read = 0
+
+        # Lines are decoded from bytes, skipping a separate UTF-8 decode pass
+        if line_range is None:
+            self._file = open(log_path, "rb")
+            self._lines = iter(self._file)
+        else:
+            self._file = LineIndex(log_path)
+            start, stop = max(1, line_range[0]), min(line_range[1], len(self._file))
+            self._lines = self._file.lines(chain([0], range(start, stop)) if len(self._file) else ())
+        # Records parsed while looking for metadata, yielded before the rest
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._read_metadata()
+
+    def __enter__(self) -> "ChatReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _parse(self, line: bytes) -> Optional[Dict[str, Any]]:
+        self.parse_calls += 1
+        self.bytes_read += len(line)
+        try:
+            record = json_codec.loads(line)
+        except json_codec.JSONDecodeError:
+            return None
+        return record if isinstance(record, dict) else None
+
+    def _read_metadata(self) -> None:
+        """
+        Read records until every metadata field has been seen. The first record
+        containing a field provides its value, as in
+        LogPreprocessor.search_metadata. Usually this is only the header line.
+        """
+        missing = set(self.METADATA_FIELDS)
+        for line in self._lines:
+            record = self._parse(line)
+            if record is None:
+                continue
+            self._pending.append(record)
+
+            for field in list(missing):
+                if field in record:
+                    self.metadata[field] = record[field]
+                    missing.discard(field)
+            if not missing:
+                break
+
+    @property
+    def user_name(self) -> Optional[str]:
+        return self.metadata.get("user_name")
+
+    @property
+    def character_name(self) -> Optional[str]:
+        return self.metadata.get("character_name")
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """Yield every parsed record, including the header, in file order."""
+        while self._pending:
+            yield self._pending.popleft()
+        for line in self._lines:
+            record = self._parse(line)
+            if record is not None:
+                yield record
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        """Yield message records (records with a 'mes' field) lazily."""
+        for record in self.records():
+            if "mes" in record:
+                yield record
@@ -0,0 +1,314 @@
+"""
+Watch mode: keep the dataset up to date while SillyTavern is running.
+
+ChatWatcher converts every chat once, keeping each chat's rendered record
+in a file of its own on disk, then polls the chats and characters folders
+for changes (size and mtime of every chat log and card). A changed file is
+only picked up once it has stayed unchanged for the debounce period, so
+chats that are still being written are not read half-way. Then
+- a new or changed chat is cleaned and rendered again, on its own,
+- a deleted chat's record is dropped,
+- a changed card re-renders the chats of its character.
+
+The dataset is published as `shards` files (<format>_live_00001.jsonl, ...);
+each chat belongs to one shard, by a hash of its path. Only the shards that
+hold a changed chat are rewritten from their records: into a staging folder
+first, then moved over the published files with os.replace(), so readers
+never see a partial shard. Memory does not grow with the size of the
+records, and the cost of an update with the size of a shard, not of the
+whole dataset.
+
+The latency from a file change (its mtime, or when a deletion was seen) to
+the updated dataset is recorded in RunStats as the 'watch' latency.
+
+Usage:
+    from chat_watcher import ChatWatcher
+
+    watcher = ChatWatcher(processor, converter, output_dir, interval=1.0, debounce=2.0)
+    watcher.run()
+"""
+
+import hashlib
+import os
+import shutil
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import stage1_format
+from run_stats import RunStats
+from stage1_preprocessor import LogPreprocessor
+from stage2_axolotl import AxolotlConverter
+
+# (size, mtime_ns) of a watched file
+Signature = Tuple[int, int]
+
+
+class ChatWatcher:
+    """Converts new and changed chats as they appear and republishes the dataset."""
+
+    def __init__(self, processor: LogPreprocessor, converter: AxolotlConverter, output_dir: str,
+                 include_reasoning: bool = False, write_output: bool = False, workers: int = 1,
+                 interval: float = 1.0, debounce: float = 2.0, shards: int = 16,
+                 stats: Optional[RunStats] = None):
+        """
+        Args:
+            processor: Stage 1 preprocessor
+            converter: Stage 2 converter, writing into a staging folder
+                (converter.output_file's folder) that holds nothing else. The
+                records and the shards being written are kept there.
+            output_dir: Folder the output files are published to
+            include_reasoning: Include reasoning in the output format
+            write_output: Also keep the stage 1 logs in processor.output_folder
+            workers: Number of worker processes for the initial conversion
+            interval: Seconds between two polls of the folders
+            debounce: Seconds a changed file must stay unchanged before it is read
+            shards: Number of files the dataset is published as. An update
+                rewrites the shards of the changed chats only
+            stats: Run statistics to record into. Default: the processor's
+        """
+        if shards < 1:
+            raise ValueError("shards must be positive")
+        self.processor = processor
+        self.converter = converter
+        self.output_dir = output_dir
+        self.staging_dir = os.path.dirname(converter.output_file)
+        self.records_dir = os.path.join(self.staging_dir, "records")
+        self.shards = shards
+        self.include_reasoning = include_reasoning
+        self.write_output = write_output
+        self.workers = workers
+        self.interval = interval
+        self.debounce = debounce
+        self.stats = stats if stats is not None else processor.stats
+
+        # Chat log -> conversation count of its record file, None if skipped
+        self.records: Dict[str, Optional[int]] = {}
+        # Shard -> its chat logs with a record
+        self.shard_chats: Dict[int, Set[str]] = {}
+        # Last seen signature of every watched file
+        self.snapshot: Dict[str, Signature] = {}
+        # Changed file -> [time of the first unprocessed change, time its signature last changed]
+        self.pending: Dict[str, List[float]] = {}
+        # Shard -> names of its files currently published in output_dir, its output files and conversations
+        self.published: Dict[int, Set[str]] = {}
+        self.shard_outputs: Dict[int, List[str]] = {}
+        self.shard_conversations: Dict[int, int] = {}
+        self.conversations = 0
+
+    def scan(self) -> Dict[str, Signature]:
+        """Signatures of the chat logs and character cards."""
+        signatures = {}
+        for folder, extension in ((self.processor.input_folder, ".jsonl"),
+                                  (self.processor.characters_folder, ".png")):
+            for root, _, files in os.walk(folder):
+                for file in files:
+                    if not file.endswith(extension):
+                        continue
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        # Deleted between the listing and the stat
+                        continue
+                    signatures[path] = (stat.st_size, stat.st_mtime_ns)
+        return signatures
+
+    def selected_chats(self, chats: Iterable[str]) -> Set[str]:
+        """The chats to convert: all of them, or those the chat index filters select."""
+        if self.processor.chat_index is not None:
+            return set(self.processor.list_log_files())
+        return set(chats)
+
+    def is_chat(self, path: str) -> bool:
+        return path.endswith(".jsonl") and path.startswith(self.processor.input_folder)
+
+    def build(self) -> None:
+        """Convert every chat and publish the first dataset."""
+        self.snapshot = self.scan()
+        log_paths = sorted(self.selected_chats(path for path in self.snapshot if self.is_chat(path)))
+        shutil.rmtree(self.records_dir, ignore_errors=True)
+        os.makedirs(self.records_dir)
+        with self.stats.timer("watch.build"):
+            conversations = self.processor.iter_conversations(self.workers, self.write_output,
+                                                              log_paths=log_paths, include_skipped=True)
+            for log_path, conversation in conversations:
+                self.store(log_path, conversation)
+            self.publish(range(self.shards))
+
+    def _digest(self, log_path: str) -> bytes:
+        rel_path = os.path.relpath(log_path, self.processor.input_folder)
+        return hashlib.blake2b(rel_path.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def shard_of(self, log_path: str) -> int:
+        return int.from_bytes(self._digest(log_path)[:8], "big") % self.shards
+
+    def record_path(self, log_path: str) -> str:
+        return os.path.join(self.records_dir, self._digest(log_path).hex() + ".jsonl")
+
+    def store(self, log_path: str, conversation) -> None:
+        """Render a chat into its record file; a skipped chat (None) has no record."""
+        if conversation is None:
+            self.drop(log_path)
+            self.records[log_path] = None
+            return
+        line, count = self.converter.render_record(conversation, self.include_reasoning)
+        with open(self.record_path(log_path), "wb") as f:
+            f.write(line)
+        self.records[log_path] = count
+        self.shard_chats.setdefault(self.shard_of(log_path), set()).add(log_path)
+
+    def drop(self, log_path: str) -> bool:
+        """
+        Forget a chat.
+
+        Returns:
+            Whether it was known (with a record or skipped)
+        """
+        if log_path not in self.records:
+            return False
+        if self.records.pop(log_path) is not None:
+            self.shard_chats[self.shard_of(log_path)].discard(log_path)
+            os.remove(self.record_path(log_path))
+        return True
+
+    def read_records(self, log_paths: Iterable[str]) -> Iterator[Tuple[bytes, int]]:
+        """The rendered (line, conversation count) records of chats, read one at a time."""
+        for log_path in log_paths:
+            with open(self.record_path(log_path), "rb") as f:
+                yield f.read(), self.records[log_path]
+
+    def poll(self) -> bool:
+        """
+        Scan the folders once and handle the changes that have settled.
+
+        Returns:
+            Whether the dataset was updated
+        """
+        now = time.time()
+        current = self.scan()
+        for path in current.keys() | self.snapshot.keys():
+            signature = current.get(path)
+            if signature == self.snapshot.get(path):
+                continue
+            # A change counts from the file's mtime; a deletion from when it is seen
+            changed_at = signature[1] / 1e9 if signature else now
+            entry = self.pending.setdefault(path, [min(changed_at, now), now])
+            entry[1] = now
+        self.snapshot = current
+
+        ready = [path for path, (_, last_change) in self.pending.items() if now - last_change >= self.debounce]
+        if not ready:
+            return False
+
+        with self.stats.timer("watch.update"):
+            changed = self.update(ready)
+            self.publish({self.shard_of(log_path) for log_path in changed})
+        published_at = time.time()
+        for path in ready:
+            first_change, _ = self.pending.pop(path)
+            self.stats.record_latency("watch", published_at - first_change)
+        self.stats.count("watch_updates")
+        return True
+
+    def update(self, paths: List[str]) -> Set[str]:
+        """
+        Reprocess changed chats, and the chats of changed cards.
+
+        Returns:
+            The chats whose record was updated or dropped
+        """
+        chats = {path for path in paths if self.is_chat(path)}
+        cards = {path for path in paths if not self.is_chat(path)}
+        if cards:
+            for log_path in self.snapshot:
+                if self.is_chat(log_path) and self.processor.get_card_path(log_path) in cards:
+                    chats.add(log_path)
+
+        selected = self.selected_chats(path for path in self.snapshot if self.is_chat(path))
+        for log_path in sorted(chats):
+            if log_path in self.snapshot and log_path in selected:
+                conversation = self.processor.clean_file(log_path)
+                if conversation is not None and self.write_output:
+                    self.processor.write_file(log_path, conversation)
+                self.store(log_path, conversation)
+                self.stats.count("watch_chats_processed")
+            elif self.drop(log_path):
+                self.remove_stage1(log_path)
+                self.stats.count("watch_chats_removed")
+        return chats
+
+    def remove_stage1(self, log_path: str) -> None:
+        if not self.write_output:
+            return
+        stage1_path = os.path.join(self.processor.output_folder,
+                                   stage1_format.output_name(log_path, self.processor.output_format))
+        if os.path.isfile(stage1_path):
+            os.remove(stage1_path)
+
+    def shard_converter(self, shard: int) -> AxolotlConverter:
+        """A converter writing a shard into a staging folder of its own."""
+        name = os.path.basename(self.converter.output_file)
+        if self.shards > 1:
+            root, extension = os.path.splitext(name)
+            name = f"{root}_{shard + 1:05d}{extension}"
+        output_file = os.path.join(self.staging_dir, f"shard_{shard}", name)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        # Each shard is shuffled with its own seed
+        return self.converter.with_output_file(output_file, shuffle_seed=f"{self.converter.shuffle_seed}:{shard}")
+
+    def publish(self, shards: Iterable[int]) -> None:
+        """Rewrite shards from the records of their chats and swap them in."""
+        for shard in sorted(shards):
+            log_paths = sorted(self.shard_chats.get(shard, ()))
+            names: Set[str] = set()
+            self.shard_outputs.pop(shard, None)
+            self.shard_conversations[shard] = 0
+            if log_paths:
+                converter = self.shard_converter(shard)
+                records = self.read_records(log_paths)
+                with self.stats.timer("watch.write"):
+                    if converter.token_budget is not None:
+                        self.shard_conversations[shard] = converter.write_samples(converter.budget_samples(records))
+                    else:
+                        self.shard_conversations[shard] = converter.write_records(records)
+
+                shard_dir = os.path.dirname(converter.output_file)
+                names = set(os.listdir(shard_dir))
+                for name in names:
+                    os.replace(os.path.join(shard_dir, name), os.path.join(self.output_dir, name))
+                self.shard_outputs[shard] = [os.path.join(self.output_dir, os.path.basename(path))
+                                             for path in converter.output_files]
+            # Files of a larger earlier shard, or of a shard that is empty now
+            for name in self.published.get(shard, set()) - names:
+                path = os.path.join(self.output_dir, name)
+                if os.path.isfile(path):
+                    os.remove(path)
+            self.published[shard] = names
+            self.stats.count("watch_shards_written")
+        self.conversations = sum(self.shard_conversations.values())
+
+    @property
+    def output_files(self) -> List[str]:
+        return [path for shard in sorted(self.shard_outputs) for path in self.shard_outputs[shard]]
+
+    def run(self, on_update: Optional[Callable[[], None]] = None, max_polls: Optional[int] = None) -> None:
+        """
+        Build the dataset, then poll until interrupted.
+
+        Args:
+            on_update: Called after the dataset is built and after every update
+            max_polls: Stop after this many polls. Default: poll forever
+        """
+        self.build()
+        if on_update is not None:
+            on_update()
+        polls = 0
+        while max_polls is None or polls < max_polls:
+            time.sleep(self.interval)
+            polls += 1
+            if self.poll() and on_update is not None:
+                on_update()
+
+    def close(self) -> None:
+        """Remove the staging folder."""
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
@@ -0,0 +1,196 @@
+"""
+Dataset writer for the final JSONL output.
+
+Writes records through one large buffer, optionally rolls them over into
+size- or count-limited shards (sharegpt_<timestamp>_00001.jsonl, ...),
+optionally compresses each shard with gzip or zstd, and writes an index
+file listing every shard with its record count and, for uncompressed
+output, the byte offset of each record, so consumers can load shards in
+parallel and seek straight to any record. A compressed stream cannot be
+seeked into, so compressed shards are indexed without offsets (their
+"bytes" is the uncompressed size).
+
+Usage:
+    from dataset_writer import DatasetWriter
+
+    with DatasetWriter("out/sharegpt.jsonl", shard_max_records=10000, compression="gzip") as writer:
+        writer.write(json.dumps(record) + "\n")
+"""
+
+import gzip
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def parse_size(size: str) -> int:
+    """Parse a size such as '512M', '2G' or '1000000' into bytes."""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+class DatasetWriter:
+    """Buffered, optionally sharded and compressed JSONL writer."""
+
+    def __init__(self, output_file: str, shard_max_bytes: Optional[int] = None,
+                 shard_max_records: Optional[int] = None, compression: Optional[str] = None,
+                 buffer_size: int = 8 * 1024 * 1024, write_index: bool = True):
+        """
+        Args:
+            output_file: Path of the output file. Shards are named after it
+                with a _00001 style counter before the extension.
+            shard_max_bytes: Start a new shard once a shard reaches this many
+                (uncompressed) bytes. Default: no size limit
+            shard_max_records: Start a new shard after this many records.
+                Default: no record limit
+            compression: None, 'gzip' or 'zstd'
+            buffer_size: Size of the write buffer in bytes
+            write_index: Write <output>.index.json on close
+        """
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"Unsupported compression: {compression}")
+
+        self._zstandard = None
+        if compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError("zstd compression requires the 'zstandard' package: pip3 install zstandard")
+            self._zstandard = zstandard
+
+        self.output_file = output_file
+        self.shard_max_bytes = shard_max_bytes
+        self.shard_max_records = shard_max_records
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.write_index = write_index
+        self.sharded = bool(shard_max_bytes or shard_max_records)
+
+        root, self._extension = os.path.splitext(output_file)
+        self._root = root
+        self.index_file = f"{root}.index.json"
+
+        self.shards: List[Dict[str, Any]] = []
+        self._raw = None
+        self._stream = None
+        self._shard: Optional[Dict[str, Any]] = None
+        self._closed = False
+
+    def __enter__(self) -> "DatasetWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def output_files(self) -> List[str]:
+        return [shard["path"] for shard in self.shards]
+
+    @property
+    def records(self) -> int:
+        return sum(shard["records"] for shard in self.shards)
+
+    def _shard_path(self, number: int) -> str:
+        suffix = f"_{number:05d}" if self.sharded else ""
+        return f"{self._root}{suffix}{self._extension}{COMPRESSION_EXTENSIONS[self.compression]}"
+
+    def _open_shard(self) -> None:
+        path = self._shard_path(len(self.shards) + 1)
+        self._raw = open(path, "wb", buffering=self.buffer_size)
+
+        if self.compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        elif self.compression == "zstd":
+            self._stream = self._zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+
+        self._shard = {"path": path, "records": 0, "bytes": 0}
+        if self.compression is None:
+            self._shard["offsets"] = []
+        self.shards.append(self._shard)
+
+    def _close_shard(self) -> None:
+        if self._stream is None:
+            return
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.close()
+        self._stream = self._raw = self._shard = None
+
+    def _start_record(self, size: int) -> Dict[str, Any]:
+        """
+        Roll over to a new shard if the next record does not fit in the current
+        one, and register the record's offset.
+
+        Args:
+            size: Size of the record in bytes, or 0 if it is not known yet
+        """
+        shard = self._shard
+        if shard is not None and shard["records"] and (
+            (self.shard_max_records and shard["records"] >= self.shard_max_records)
+            or (self.shard_max_bytes and shard["bytes"] + max(size, 1) > self.shard_max_bytes)
+        ):
+            self._close_shard()
+            shard = None
+        if shard is None:
+            self._open_shard()
+            shard = self._shard
+
+        if self.compression is None:
+            shard["offsets"].append(shard["bytes"])
+        shard["records"] += 1
+        return shard
+
+    def write(self, line: Union[str, bytes]) -> None:
+        """Write one record, a JSON line including its trailing newline."""
+        data = line.encode("utf-8") if isinstance(line, str) else line
+
+        shard = self._start_record(len(data))
+        shard["bytes"] += len(data)
+        self._stream.write(data)
+
+    def write_chunks(self, chunks: Iterable[bytes]) -> int:
+        """
+        Write one record given as consecutive pieces of a JSON line, the last
+        one ending with the newline. Only one piece is held in memory at a time.
+        The record's size is not known in advance, so it may take its shard
+        past shard_max_bytes.
+
+        Returns:
+            Size of the record in bytes
+        """
+        shard = self._start_record(0)
+        size = 0
+        for chunk in chunks:
+            self._stream.write(chunk)
+            size += len(chunk)
+        shard["bytes"] += size
+        return size
+
+    def close(self) -> None:
+        """Flush and close the current shard and write the index."""
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._stream is None and not self.shards:
+            # Nothing was written; still produce an (empty) output file
+            self._open_shard()
+        self._close_shard()
+
+        if self.write_index:
+            index = {
+                "compression": self.compression,
+                "records": self.records,
+                "shards": [
+                    {**shard, "path": os.path.basename(shard["path"])} for shard in self.shards
+                ],
+            }
+            with open(self.index_file, "w", encoding="utf-8") as f:
+                json.dump(index, f)
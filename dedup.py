@@ -0,0 +1,334 @@
+"""
+Deduplication of chat logs before conversion.
+
+SillyTavern branches and backups leave many chat files that are copies of
+each other, prefixes of each other (a backup taken mid-chat, a branch that
+was never continued) or near-copies (a few messages edited or regenerated).
+Deduplicator reads the raw messages of every chat once and finds, with
+rolling (chained) message hashes, the chats that another chat continues:
+chat A is a prefix of chat B when A's last chain hash appears in B's chain.
+Each prefix chat is dropped on its own, in favour of a chat that continues
+it. Prefixes are never grouped with each other's continuations: a chat
+holding only the greeting is a prefix of every chat of its character, which
+are not duplicates of each other. The other chats are grouped:
+- exact duplicates (the same chain)
+- branches sharing their first shared_prefix messages (optional)
+- near-duplicates, with MinHash signatures over word shingles of the
+  chat's messages and LSH banding, so candidates are found without comparing
+  every pair of chats
+One chat of each group is kept, according to the keep policy.
+
+Usage:
+    from dedup import Deduplicator
+
+    dedup = Deduplicator(keep="longest")
+    kept = dedup.select(log_paths)
+    print(dedup.summary())
+"""
+
+import hashlib
+import os
+import zlib
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from chat_reader import ChatReader
+
+# Keep policies: which chat of a duplicate group survives
+KEEP_POLICIES = ("longest", "newest", "first")
+
+_MASK64 = (1 << 64) - 1
+_EMPTY = _MASK64
+
+
+class ChatFingerprint:
+    """Hashes of one chat used for deduplication."""
+
+    __slots__ = ("path", "messages", "chars", "bytes", "mtime", "chain", "signature")
+
+    def __init__(self, path: str, messages: int, chars: int, size: int, mtime: float,
+                 chain: bytes, signature: Optional[array]):
+        self.path = path
+        self.messages = messages
+        self.chars = chars
+        self.bytes = size
+        self.mtime = mtime
+        # 8-byte rolling hash after each message, concatenated
+        self.chain = chain
+        self.signature = signature
+
+    def chain_hash(self, length: int) -> bytes:
+        """Rolling hash of the first length messages."""
+        return self.chain[8 * (length - 1):8 * length]
+
+
+def _shingles(texts: List[str], k: int) -> Set[int]:
+    """Hashes of the word k-grams of the texts (of all words, if there are fewer than k)."""
+    words = " ".join(texts).lower().encode("utf-8", "surrogatepass").split()
+    ids = list(map(zlib.crc32, words))
+    if len(ids) <= k:
+        return {hash(tuple(ids))} if ids else set()
+    # Tuples of integers hash the same in every process, unlike strings
+    return set(map(hash, zip(*(ids[i:] for i in range(k)))))
+
+
+def minhash_signature(texts: List[str], num_perm: int = 128, shingle_size: int = 5) -> Optional[array]:
+    """
+    MinHash signature of a set of texts using one permutation hashing: every
+    shingle is hashed once and kept as the minimum of one of num_perm buckets,
+    and empty buckets borrow from the next filled one. This costs one hash per
+    shingle instead of num_perm.
+
+    Returns:
+        The signature, or None if the texts have no words
+    """
+    signature = [_EMPTY] * num_perm
+    for h in _shingles(texts, shingle_size):
+        # Fibonacci hashing spreads the tuple hash over the buckets
+        h = (h * 0x9E3779B97F4A7C15) & _MASK64
+        bucket = h % num_perm
+        value = h // num_perm
+        if value < signature[bucket]:
+            signature[bucket] = value
+
+    filled = [i for i, value in enumerate(signature) if value != _EMPTY]
+    if not filled:
+        return None
+    if len(filled) < num_perm:
+        # Densification: an empty bucket takes the next filled bucket's value, offset by the distance
+        dense = list(signature)
+        next_filled = filled[0] + num_perm
+        for i in range(num_perm - 1, -1, -1):
+            if signature[i] != _EMPTY:
+                next_filled = i
+            else:
+                distance = next_filled - i
+                dense[i] = (signature[next_filled % num_perm] + distance * 0x9E3779B9) & _MASK64
+        signature = dense
+    return array("Q", signature)
+
+
+def estimate_jaccard(a: array, b: array) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def fingerprint_chat(log_path: str, num_perm: int = 128, shingle_size: int = 5) -> ChatFingerprint:
+    """
+    Read a chat log and compute its rolling message hashes and MinHash signature.
+    """
+    chain = bytearray()
+    previous = b""
+    texts = []
+    chars = 0
+    with ChatReader(log_path) as reader:
+        for message in reader:
+            text = message.get("mes")
+            text = text if isinstance(text, str) else ""
+            h = hashlib.blake2b(previous, digest_size=8)
+            h.update(b"\x01" if message.get("is_user") else b"\x00")
+            h.update(text.encode("utf-8", "surrogatepass"))
+            previous = h.digest()
+            chain += previous
+            texts.append(text)
+            chars += len(text)
+
+    signature = minhash_signature(texts, num_perm, shingle_size) if num_perm else None
+    stat = os.stat(log_path)
+    return ChatFingerprint(log_path, len(texts), chars, stat.st_size, stat.st_mtime,
+                           bytes(chain), signature)
+
+
+def _fingerprint_worker(args: Tuple[str, int, int]) -> ChatFingerprint:
+    return fingerprint_chat(*args)
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a: int, b: int) -> None:
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+class Deduplicator:
+    """Finds duplicate, prefix and near-duplicate chats and picks the ones to keep."""
+
+    def __init__(self, keep: str = "longest", shared_prefix: int = 0, near_threshold: Optional[float] = 0.8,
+                 num_perm: int = 128, bands: int = 16, shingle_size: int = 5):
+        """
+        Args:
+            keep: Which chat of a group is kept: 'longest' (most messages),
+                'newest' (last modified) or 'first' (first in path order).
+                Prefix chats are always dropped for a chat that continues them.
+            shared_prefix: Also group branches whose first shared_prefix
+                messages are identical. 0 disables this.
+            near_threshold: Estimated Jaccard similarity above which chats are
+                near-duplicates. None disables near-duplicate detection.
+            num_perm: MinHash signature size
+            bands: LSH bands; num_perm must be a multiple. More bands find
+                candidates at lower similarity, at the cost of more comparisons.
+            shingle_size: Words per shingle
+        """
+        if keep not in KEEP_POLICIES:
+            raise ValueError(f"Unsupported keep policy: {keep}")
+        if near_threshold is not None and num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.keep = keep
+        self.shared_prefix = shared_prefix
+        self.near_threshold = near_threshold
+        self.num_perm = num_perm if near_threshold is not None else 0
+        self.bands = bands
+        self.shingle_size = shingle_size
+
+        # Removed log path -> (reason, kept log path)
+        self.removed: Dict[str, Tuple[str, str]] = {}
+        self.counts: Counter = Counter()
+
+    def fingerprints(self, log_paths: List[str], workers: int = 1) -> List[ChatFingerprint]:
+        args = [(log_path, self.num_perm, self.shingle_size) for log_path in log_paths]
+        if workers <= 1:
+            return [_fingerprint_worker(a) for a in args]
+        chunksize = max(1, len(args) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_fingerprint_worker, args, chunksize=chunksize))
+
+    def _group(self, chats: List[ChatFingerprint]) -> Tuple[_UnionFind, Dict[int, int]]:
+        """
+        Group duplicate chats and find the prefix chats.
+
+        Returns:
+            The groups, and the root of every group of prefix chats -> a longer
+            chat that continues them. Groups of prefix chats hold only exact
+            duplicates of each other.
+        """
+        groups = _UnionFind(len(chats))
+
+        # Exact duplicates
+        finals: Dict[bytes, int] = {}
+        for i, chat in enumerate(chats):
+            if chat.messages:
+                final = chat.chain_hash(chat.messages)
+                if final in finals:
+                    groups.union(finals[final], i)
+                else:
+                    finals[final] = i
+
+        # Prefixes: look up every shorter chain hash among the final hashes
+        extensions: Dict[int, int] = {}
+        for i, chat in enumerate(chats):
+            for length in range(1, chat.messages):
+                j = finals.get(chat.chain_hash(length))
+                if j is not None:
+                    extensions.setdefault(groups.find(j), i)
+        # Prefix chats are dropped anyway, and must not join unrelated chats
+        grouped = [i for i in range(len(chats)) if groups.find(i) not in extensions]
+
+        # Branches with a common opening
+        if self.shared_prefix:
+            openings: Dict[bytes, int] = {}
+            for i in grouped:
+                chat = chats[i]
+                if chat.messages >= self.shared_prefix:
+                    groups.union(openings.setdefault(chat.chain_hash(self.shared_prefix), i), i)
+
+        # Near-duplicates: chats sharing an LSH band are compared with the band's first chat
+        if self.near_threshold is not None:
+            rows = self.num_perm // self.bands
+            for band in range(self.bands):
+                buckets: Dict[bytes, int] = {}
+                for i in grouped:
+                    chat = chats[i]
+                    if chat.signature is None:
+                        continue
+                    key = chat.signature[band * rows:(band + 1) * rows].tobytes()
+                    first = buckets.setdefault(key, i)
+                    if first != i and groups.find(first) != groups.find(i) and \
+                            estimate_jaccard(chats[first].signature, chat.signature) >= self.near_threshold:
+                        groups.union(first, i)
+        return groups, extensions
+
+    def _keep_key(self, index: int, chat: ChatFingerprint):
+        if self.keep == "longest":
+            return chat.messages, chat.chars, -index
+        if self.keep == "newest":
+            return chat.mtime, -index
+        return -index
+
+    def _reason(self, removed: ChatFingerprint, kept: ChatFingerprint) -> str:
+        if removed.messages and removed.chain == kept.chain:
+            return "exact"
+        if self.shared_prefix and min(removed.messages, kept.messages) >= self.shared_prefix and \
+                removed.chain_hash(self.shared_prefix) == kept.chain_hash(self.shared_prefix):
+            return "shared_prefix"
+        return "near"
+
+    def select(self, log_paths: List[str], workers: int = 1) -> List[str]:
+        """
+        Deduplicate chat logs.
+
+        Args:
+            log_paths: Chat logs, in a stable order
+            workers: Number of worker processes used to read and hash the chats
+
+        Returns:
+            The log paths to keep, in the given order
+        """
+        chats = self.fingerprints(log_paths, workers)
+        groups, extensions = self._group(chats)
+
+        members: Dict[int, List[int]] = {}
+        for i in range(len(chats)):
+            members.setdefault(groups.find(i), []).append(i)
+
+        # Group root -> kept chat
+        kept_chats: Dict[int, int] = {}
+        for root, indices in members.items():
+            if root in extensions:
+                continue
+            kept = max(indices, key=lambda i: self._keep_key(i, chats[i]))
+            kept_chats[root] = kept
+            for i in indices:
+                if i != kept:
+                    self._remove(chats[i], chats[kept], self._reason(chats[i], chats[kept]))
+
+        for root in extensions:
+            # Follow the continuations up to a chat that is not a prefix itself
+            extension = extensions[root]
+            while groups.find(extension) in extensions:
+                extension = extensions[groups.find(extension)]
+            kept = kept_chats[groups.find(extension)]
+            for i in members[root]:
+                self._remove(chats[i], chats[kept], "prefix")
+
+        kept_indices = set(kept_chats.values())
+        self.counts["chats"] += len(chats)
+        self.counts["removed"] += len(chats) - len(kept_indices)
+        self.counts["bytes"] += sum(chat.bytes for chat in chats)
+        return [chat.path for i, chat in enumerate(chats) if i in kept_indices]
+
+    def _remove(self, removed: ChatFingerprint, kept: ChatFingerprint, reason: str) -> None:
+        self.removed[removed.path] = (reason, kept.path)
+        self.counts[f"removed_{reason}"] += 1
+        self.counts["messages_removed"] += removed.messages
+        self.counts["bytes_removed"] += removed.bytes
+
+    def summary(self) -> str:
+        counts = self.counts
+        reasons = ", ".join(f"{counts[f'removed_{reason}']} {reason.replace('_', ' ')}"
+                            for reason in ("exact", "prefix", "shared_prefix", "near")
+                            if counts[f"removed_{reason}"])
+        share = counts["bytes_removed"] / counts["bytes"] * 100 if counts["bytes"] else 0.0
+        return (f"Deduplication removed {counts['removed']} of {counts['chats']} logs"
+                + (f" ({reasons})" if reasons else "")
+                + f", {counts['messages_removed']} messages, {share:.1f}% of the input bytes.")
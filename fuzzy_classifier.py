@@ -1,3 +1,8 @@
+import re
+from typing import Dict, Iterable, List
+
+from llm_client import LLMClient
+
 prompt_name_classifier = """The following is a conversation with an AI Large Language Model. The AI has been trained to answer questions, provide recommendations, and help with decision making. The AI follows user requests and gives concise, to-the-point answers.
 
 AI: How can I help you today?
@@ -36,3 +41,66 @@ User: Pick one of three answers below to the user's question, choose one number
 2. No
 3. Unsure
 AI: """
+
+
+# Answers of prompt_name_classifier and prompt_canon_classifier, by option number
+NAME_KINDS = {"1": "character", "2": "object", "3": "group", "4": "place", "5": "unsure"}
+CANON_KINDS = {"1": "canon", "2": "original", "3": "unsure"}
+
+# Parameters of the classification requests: one short, deterministic answer
+CLASSIFY_PARAMS = {"max_tokens": 4, "temperature": 0.0, "stop": ["\n"]}
+GUIDELINE_PARAMS = {"max_tokens": 400, "temperature": 1.0, "stop": ["\nUser:"]}
+
+
+def parse_choice(completion: str, kinds: Dict[str, str]) -> str:
+    """The kind picked by a classifier completion: its first option number, else 'unsure'."""
+    match = re.search(r"\d+", completion)
+    return kinds.get(match.group(), "unsure") if match else "unsure"
+
+
+def parse_guideline(completion: str) -> str:
+    """The guideline of a prompt_meta_generator completion, without its closing quote."""
+    guideline = completion.strip()
+    end = guideline.rfind("'")
+    if end > 0 and not guideline[end + 1:].strip():
+        guideline = guideline[:end]
+    return guideline.strip()
+
+
+async def classify_names(client: LLMClient, names: Iterable[str]) -> Dict[str, str]:
+    """
+    Classify character names with prompt_name_classifier.
+
+    Returns:
+        Name -> one of NAME_KINDS' values, for each distinct name
+    """
+    names = list(dict.fromkeys(names))
+    completions = await client.complete([prompt_name_classifier.format(name) for name in names],
+                                        **CLASSIFY_PARAMS)
+    return {name: parse_choice(completion, NAME_KINDS) for name, completion in zip(names, completions)}
+
+
+async def classify_canon(client: LLMClient, names: Iterable[str]) -> Dict[str, str]:
+    """
+    Classify character names as canon or original with prompt_canon_classifier.
+
+    Returns:
+        Name -> one of CANON_KINDS' values, for each distinct name
+    """
+    names = list(dict.fromkeys(names))
+    completions = await client.complete([prompt_canon_classifier.format(name) for name in names],
+                                        **CLASSIFY_PARAMS)
+    return {name: parse_choice(completion, CANON_KINDS) for name, completion in zip(names, completions)}
+
+
+async def generate_guidelines(client: LLMClient, count: int) -> List[str]:
+    """
+    Sample roleplay guidelines with prompt_meta_generator, for varied system
+    prompts. Each sample is cached separately, so later runs reuse the same ones.
+
+    Returns:
+        Up to count non-empty guidelines
+    """
+    completions = await client.complete([prompt_meta_generator] * count, variants=range(count),
+                                        **GUIDELINE_PARAMS)
+    return [guideline for guideline in map(parse_guideline, completions) if guideline]
@@ -0,0 +1,254 @@
+"""
+Incremental conversion cache.
+
+Keeps a manifest in the output directory that records, for every chat, its
+size, mtime and content hash along with a hash of the conversion options and
+of the character card. Chats whose key is unchanged reuse the cached stage 1
+and stage 2 results; only new or changed chats are processed again, and
+entries for chats that no longer exist are removed.
+
+Usage:
+    from incremental_cache import ChatCache
+
+    cache = ChatCache(os.path.join(output_dir, ".cache"), {"format": "sharegpt", ...})
+    conversations_processed = cache.convert(processor, converter, include_reasoning)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import stage1_format
+from stage1_preprocessor import LogPreprocessor
+from stage2_axolotl import AxolotlConverter
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ChatCache:
+    """Persistent per-chat cache of stage 1 and stage 2 results."""
+
+    # Bump when the cached formats or the conversion logic change
+    VERSION = 2
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, cache_dir: str, options: Dict[str, Any]):
+        """
+        Args:
+            cache_dir: Directory holding the manifest and cached results
+            options: Conversion options that affect the output (obfuscate,
+                include_reasoning, format, seed, ...)
+        """
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.manifest_path = os.path.join(cache_dir, self.MANIFEST_NAME)
+        self.options_hash = hashlib.sha256(
+            json.dumps({"version": self.VERSION, **options}, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+        # Card hashes are shared by all chats of a character
+        self._card_hashes: Dict[str, str] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.removed = 0
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.entries: Dict[str, Dict[str, Any]] = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+        if manifest.get("version") != self.VERSION:
+            return {}
+        return manifest.get("entries", {})
+
+    def save(self) -> None:
+        """Write the manifest atomically."""
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "entries": self.entries}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def card_hash(self, card_path: str) -> str:
+        if card_path not in self._card_hashes:
+            self._card_hashes[card_path] = hash_file(card_path) if os.path.isfile(card_path) else ""
+        return self._card_hashes[card_path]
+
+    def content_hash(self, chat_id: str, log_path: str, stat: os.stat_result) -> str:
+        """Content hash of a chat, reusing the recorded one if size and mtime are unchanged."""
+        entry = self.entries.get(chat_id)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        return hash_file(log_path)
+
+    @staticmethod
+    def chat_id(processor: LogPreprocessor, log_path: str) -> str:
+        """Manifest key of a chat: its path relative to the chats folder."""
+        return os.path.relpath(log_path, processor.input_folder).replace(os.sep, "/")
+
+    def chat_key(self, log_path: str, processor: LogPreprocessor) -> Tuple[str, Dict[str, Any]]:
+        """
+        Compute the cache key of a chat.
+
+        Returns:
+            The key and the manifest fields describing the chat
+        """
+        chat_id = self.chat_id(processor, log_path)
+        stat = os.stat(log_path)
+        content_hash = self.content_hash(chat_id, log_path, stat)
+        card_hash = self.card_hash(processor.get_card_path(log_path))
+        key = hashlib.sha256(
+            "\0".join([chat_id, content_hash, card_hash, self.options_hash]).encode("utf-8")
+        ).hexdigest()
+        return key, {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": content_hash}
+
+    def _object_path(self, key: str, stage: int) -> str:
+        extension = "jsonl" if stage == 1 else "json"
+        return os.path.join(self.objects_dir, f"{key}.stage{stage}.{extension}")
+
+    def lookup(self, chat_id: str, key: str) -> Optional[Dict[str, Any]]:
+        """Return the manifest entry for a chat if its cached results are still valid."""
+        entry = self.entries.get(chat_id)
+        if not entry or entry.get("key") != key:
+            return None
+        if entry["processed"] and not os.path.isfile(self._object_path(key, 2)):
+            return None
+        return entry
+
+    def store(self, chat_id: str, key: str, fields: Dict[str, Any],
+              conversation: Optional[List[Dict[str, Any]]], record: Optional[Tuple[bytes, int]]) -> None:
+        """
+        Record the results of a processed (or skipped) chat.
+
+        Args:
+            conversation: Cleaned stage 1 conversation, None if the chat was skipped
+            record: Rendered stage 2 line and conversation count, None if skipped
+        """
+        self._discard_objects(chat_id)
+
+        if conversation is not None:
+            with open(self._object_path(key, 1), "wb") as f:
+                stage1_format.write_log(f, conversation)
+            with open(self._object_path(key, 2), "wb") as f:
+                f.write(record[0])
+
+        self.entries[chat_id] = {
+            **fields,
+            "key": key,
+            "processed": conversation is not None,
+            "count": record[1] if record else 0,
+        }
+
+    def _discard_objects(self, chat_id: str) -> None:
+        entry = self.entries.get(chat_id)
+        if not entry:
+            return
+        for stage in (1, 2):
+            object_path = self._object_path(entry["key"], stage)
+            if os.path.isfile(object_path):
+                os.remove(object_path)
+
+    def prune(self, chat_ids: List[str]) -> None:
+        """Remove cached entries for chats that are no longer in chat_ids."""
+        current = set(chat_ids)
+        for chat_id in [known for known in self.entries if known not in current]:
+            self._discard_objects(chat_id)
+            del self.entries[chat_id]
+            self.removed += 1
+
+    def read_record(self, entry: Dict[str, Any]) -> Tuple[bytes, int]:
+        with open(self._object_path(entry["key"], 2), "rb") as f:
+            return f.read(), entry["count"]
+
+    def copy_stage1(self, entry: Dict[str, Any], log_path: str, output_folder: str,
+                    output_format: str = "jsonl") -> None:
+        """Copy a cached stage 1 log (stored as JSONL) to the output folder, in output_format."""
+        object_path = self._object_path(entry["key"], 1)
+        output_path = os.path.join(output_folder, stage1_format.output_name(log_path, output_format))
+        if output_format == "jsonl":
+            shutil.copyfile(object_path, output_path)
+            return
+        with open(output_path, "wb") as f:
+            stage1_format.write_log(f, stage1_format.read_log(object_path), output_format)
+
+    def convert(self, processor: LogPreprocessor, converter: AxolotlConverter,
+                include_reasoning: bool = False, workers: int = 1, write_output: bool = False,
+                log_paths: Optional[List[str]] = None) -> int:
+        """
+        Run the streamed conversion, reusing cached results for unchanged chats.
+
+        Args:
+            processor: Stage 1 preprocessor
+            converter: Stage 2 converter
+            include_reasoning: Include reasoning in the output format
+            workers: Number of worker processes for the chats that changed
+            write_output: Also write the stage 1 logs to processor.output_folder
+            log_paths: Chats to convert, e.g. one split of the dataset. Default:
+                processor.select_log_files(), and the entries of the other chats
+                are pruned
+
+        Returns:
+            Total number of conversations written
+        """
+        if log_paths is None:
+            log_paths = processor.select_log_files(workers)
+            self.prune([self.chat_id(processor, log_path) for log_path in log_paths])
+
+        plan = []
+        for log_path in log_paths:
+            chat_id = self.chat_id(processor, log_path)
+            key, fields = self.chat_key(log_path, processor)
+            plan.append((log_path, chat_id, key, fields, self.lookup(chat_id, key)))
+
+        changed = [log_path for log_path, _, _, _, entry in plan if entry is None]
+        fresh = processor.stats.timed_iter(
+            "stage1", processor.iter_conversations(workers, write_output, log_paths=changed, include_skipped=True))
+
+        records = self._records(plan, fresh, processor, converter, include_reasoning, write_output)
+        try:
+            if converter.token_budget is not None:
+                # Cached records are stored per chat; splitting and packing happen afterwards
+                return converter.write_samples(converter.budget_samples(records))
+            return converter.write_records(records)
+        finally:
+            self.save()
+
+    def _records(self, plan, fresh: Iterator, processor: LogPreprocessor, converter: AxolotlConverter,
+                 include_reasoning: bool, write_output: bool) -> Iterator[Tuple[bytes, int]]:
+        """Merge cached and freshly processed records, in log file order."""
+        for log_path, chat_id, key, fields, entry in plan:
+            if entry is not None:
+                self.hits += 1
+                if entry["processed"]:
+                    if write_output:
+                        self.copy_stage1(entry, log_path, processor.output_folder, processor.output_format)
+                    yield self.read_record(entry)
+                continue
+
+            self.misses += 1
+            errors_before = len(processor.errors)
+            fresh_path, conversation = next(fresh)
+            assert fresh_path == log_path
+
+            record = None
+            if conversation is not None:
+                record = converter.render_record(conversation, include_reasoning)
+                yield record
+
+            # Failures are retried on the next run rather than cached
+            if len(processor.errors) == errors_before:
+                self.store(chat_id, key, fields, conversation, record)
@@ -0,0 +1,163 @@
+"""
+JSON codec shared by both stages.
+
+Picks the fastest available backend at import time (orjson, then ujson,
+then the standard library) and exposes loads()/dumpb()/dumps() with the same
+behaviour for all of them:
+- loads() accepts str or bytes, so lines can be decoded straight from a
+  binary file. Integers beyond 64 bits decode to the same int with every
+  backend (orjson would turn them into floats, so lines holding long digit
+  runs are decoded by the standard library).
+- dumpb() returns compact JSON (no spaces after separators) as UTF-8
+  bytes, which is what orjson produces natively; dumps() returns the same
+  as str. Values the fast backends would render differently from the
+  standard library (floats, integers beyond 64 bits, lone surrogates) are
+  serialized by the standard library, so output is byte-identical
+  whichever backend is installed.
+
+Usage:
+    import json_codec
+
+    entry = json_codec.loads(line)
+    f.write(json_codec.dumpb(entry) + b"\n")
+"""
+
+import json
+import re
+from typing import Any, Callable, Dict, Union
+
+
+def _has_float(obj: Any) -> bool:
+    """
+    Whether obj contains a float. Floats (including NaN and infinity) are the
+    only JSON values whose text differs between backends. Strings are skipped
+    without being scanned, so the cost depends on the structure, not the text.
+    """
+    if isinstance(obj, dict):
+        values = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        values = obj
+    else:
+        return isinstance(obj, float)
+
+    for value in values:
+        if isinstance(value, (dict, list, tuple)):
+            if _has_float(value):
+                return True
+        elif isinstance(value, float):
+            return True
+    return False
+
+
+def _stdlib_dumps(obj: Any) -> str:
+    text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    if not text.isascii():
+        try:
+            text.encode("utf-8")
+        except UnicodeEncodeError:
+            # Lone surrogates cannot be written as UTF-8; escape everything instead
+            return json.dumps(obj, separators=(",", ":"))
+    return text
+
+
+def _stdlib_dumpb(obj: Any) -> bytes:
+    return _stdlib_dumps(obj).encode("utf-8")
+
+
+# A run of 19 digits: the shortest integer literal that may not fit in 64 bits
+_LONG_DIGITS = re.compile(r"\d{19}")
+_LONG_DIGITS_BYTES = re.compile(rb"\d{19}")
+
+
+def _make_orjson():
+    import orjson
+
+    def loads(data: Union[str, bytes]) -> Any:
+        try:
+            obj = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN/Infinity, which the standard library accepts
+            return json.loads(data)
+        # orjson decodes integers beyond 64 bits as floats, losing digits; the
+        # standard library keeps them. Digit runs inside strings only cost the
+        # slower decoder.
+        if _has_float(obj) and (_LONG_DIGITS_BYTES if isinstance(data, bytes) else _LONG_DIGITS).search(data):
+            return json.loads(data)
+        return obj
+
+    def dumpb(obj: Any) -> bytes:
+        if _has_float(obj):
+            return _stdlib_dumpb(obj)
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # Integers beyond 64 bits, lone surrogates
+            return _stdlib_dumpb(obj)
+
+    return loads, dumpb
+
+
+def _make_ujson():
+    import ujson
+
+    def loads(data: Union[str, bytes]) -> Any:
+        try:
+            return ujson.loads(data)
+        except ValueError:
+            return json.loads(data)
+
+    def dumpb(obj: Any) -> bytes:
+        if _has_float(obj):
+            return _stdlib_dumpb(obj)
+        try:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+        except (TypeError, OverflowError, ValueError):
+            # Includes UnicodeEncodeError for lone surrogates
+            return _stdlib_dumpb(obj)
+
+    return loads, dumpb
+
+
+def _make_stdlib():
+    return json.loads, _stdlib_dumpb
+
+
+BACKENDS: Dict[str, Callable] = {
+    "orjson": _make_orjson,
+    "ujson": _make_ujson,
+    "json": _make_stdlib,
+}
+
+# Decode errors raised by loads(), whichever backend is used
+JSONDecodeError = json.JSONDecodeError
+
+BACKEND = ""
+loads: Callable[[Union[str, bytes]], Any] = json.loads
+dumpb: Callable[[Any], bytes] = _stdlib_dumpb
+
+
+def dumps(obj: Any) -> str:
+    """Serialize obj to a str. Prefer dumpb() when the result is written to a binary file."""
+    return dumpb(obj).decode("utf-8")
+
+
+def available_backends() -> list:
+    """Names of the backends that can be imported, fastest first."""
+    names = []
+    for name, factory in BACKENDS.items():
+        try:
+            factory()
+            names.append(name)
+        except ImportError:
+            continue
+    return names
+
+
+def set_backend(name: str) -> None:
+    """Switch the module-level loads()/dumpb() to the named backend."""
+    global BACKEND, loads, dumpb
+    loads, dumpb = BACKENDS[name]()
+    BACKEND = name
+
+
+set_backend(available_backends()[0])
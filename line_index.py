@@ -0,0 +1,123 @@
+"""
+Line-offset index for random access into chat logs.
+
+A chat log is JSONL, so message i is line i + 1 (after the metadata header).
+LineIndex scans a file once through mmap for the newline positions and
+stores the start offset of every line next to the chat
+(<chat>.jsonl.offsets), together with the size and mtime it was built from,
+so later runs seek straight to any message without reading the rest.
+A stale or unreadable index is rebuilt, and if the chat's folder is not
+writable the index is only kept in memory.
+
+Usage:
+    from line_index import LineIndex
+
+    with LineIndex(log_path) as index:
+        header = index.line(0)
+        for line in index.lines(range(100, 120)):
+            ...
+"""
+
+import mmap
+import os
+import struct
+from array import array
+from typing import Iterable, Iterator, Optional
+
+INDEX_SUFFIX = ".offsets"
+
+# Magic, chat size, chat mtime_ns, number of lines
+_HEADER = struct.Struct("<8sQQQ")
+_MAGIC = b"TLCOFF01"
+
+
+def scan_line_offsets(data) -> array:
+    """
+    Start offset of every line of data (bytes or mmap), followed by the end offset.
+    A final line without a trailing newline counts as a line.
+    """
+    offsets = array("Q", [0])
+    size = len(data)
+    find = data.find
+    position = find(b"\n")
+    while position != -1:
+        offsets.append(position + 1)
+        position = find(b"\n", position + 1)
+    if offsets[-1] != size:
+        offsets.append(size)
+    return offsets
+
+
+class LineIndex:
+    """Random access to the lines of a chat log."""
+
+    def __init__(self, log_path: str, index_path: Optional[str] = None):
+        """
+        Open a chat log and load its line index, building it if needed.
+
+        Args:
+            log_path: Path to the chat log
+            index_path: Where the index is stored. Default: next to the chat
+        """
+        self.log_path = log_path
+        self.index_path = index_path or log_path + INDEX_SUFFIX
+        self._file = open(log_path, "rb")
+        stat = os.fstat(self._file.fileno())
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+        # Whether the index was loaded from disk rather than built
+        self.loaded = False
+        self.offsets = self._load(stat.st_size, stat.st_mtime_ns)
+        if self.offsets is None:
+            self.offsets = scan_line_offsets(self._map)
+            self._save(stat.st_size, stat.st_mtime_ns)
+
+    def __enter__(self) -> "LineIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def _load(self, size: int, mtime_ns: int) -> Optional[array]:
+        try:
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < _HEADER.size:
+            return None
+
+        magic, indexed_size, indexed_mtime_ns, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or (indexed_size, indexed_mtime_ns) != (size, mtime_ns) \
+                or len(data) != _HEADER.size + 8 * (count + 1):
+            return None
+        offsets = array("Q")
+        offsets.frombytes(data[_HEADER.size:])
+        self.loaded = True
+        return offsets
+
+    def _save(self, size: int, mtime_ns: int) -> None:
+        temp_path = self.index_path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, size, mtime_ns, len(self)))
+                self.offsets.tofile(f)
+            os.replace(temp_path, self.index_path)
+        except OSError:
+            # Read-only chats folder: keep the index in memory only
+            pass
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def line(self, number: int) -> bytes:
+        """Line number (0 is the metadata header), including its newline."""
+        return self._map[self.offsets[number]:self.offsets[number + 1]]
+
+    def lines(self, numbers: Iterable[int]) -> Iterator[bytes]:
+        for number in numbers:
+            yield self.line(number)
@@ -0,0 +1,233 @@
+"""
+Client for an OpenAI-compatible completions endpoint (vLLM, llama.cpp
+server, text-generation-webui, ...), used for the fuzzy_classifier prompts.
+
+LLMClient.complete() takes a list of prompts and
+- deduplicates identical prompts, so each one is sent once per run,
+- answers prompts from a persistent CompletionCache (SQLite), so each one
+  is sent once ever for the same model and parameters,
+- sends the rest in batches (the completions API accepts a list of
+  prompts), with at most `concurrency` requests in flight,
+- retries failed requests with exponential backoff,
+- stores every completed batch in the cache right away, so an interrupted
+  run keeps its progress.
+
+Requests go through urllib in worker threads; only the standard library
+is needed.
+
+Usage:
+    import asyncio
+    from llm_client import CompletionCache, LLMClient
+
+    client = LLMClient("http://localhost:8000/v1", "my-model", cache=CompletionCache("out/.cache/llm.sqlite"))
+    completions = asyncio.run(client.complete(prompts, max_tokens=8, temperature=0))
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from run_stats import RunStats
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    completion TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+# HTTP statuses worth retrying: rate limits and server errors
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# SQLite limits the number of parameters of a statement
+_SELECT_CHUNK = 500
+
+
+class LLMError(RuntimeError):
+    """A request to the completions endpoint failed."""
+
+
+class CompletionCache:
+    """Persistent SQLite cache of completions."""
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: Path of the SQLite database, created if missing
+        """
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    @staticmethod
+    def key(model: str, prompt: str, params: Dict[str, Any], variant: int = 0) -> str:
+        """Cache key of a prompt sent with these model and parameters."""
+        data = json.dumps([model, prompt, params, variant], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Cached completions of the keys that have one."""
+        keys = list(keys)
+        found = {}
+        connection = self._connect()
+        try:
+            for start in range(0, len(keys), _SELECT_CHUNK):
+                chunk = keys[start:start + _SELECT_CHUNK]
+                query = f"SELECT key, completion FROM completions WHERE key IN ({', '.join('?' * len(chunk))})"
+                found.update(connection.execute(query, chunk))
+        finally:
+            connection.close()
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, str, str, str]]) -> None:
+        """Store (key, model, prompt, completion) items."""
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO completions (key, model, prompt, completion, created) VALUES (?, ?, ?, ?, ?)",
+                    ((key, model, prompt, completion, now) for key, model, prompt, completion in items))
+        finally:
+            connection.close()
+
+    def __len__(self) -> int:
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        finally:
+            connection.close()
+
+
+class LLMClient:
+    """Batched, cached, concurrency-limited client for an OpenAI-compatible completions endpoint."""
+
+    def __init__(self, base_url: str, model: str, api_key: Optional[str] = None,
+                 cache: Optional[CompletionCache] = None, concurrency: int = 4, batch_size: int = 8,
+                 timeout: float = 120.0, max_retries: int = 3, retry_delay: float = 1.0,
+                 stats: Optional[RunStats] = None):
+        """
+        Args:
+            base_url: Base URL of the API, e.g. http://localhost:8000/v1
+            model: Model name sent with every request
+            api_key: Bearer token, if the endpoint needs one
+            cache: Persistent cache of completions. Default: no cache
+            concurrency: Maximum number of requests in flight
+            batch_size: Maximum number of prompts per request
+            timeout: Timeout of a request in seconds
+            max_retries: Retries of a failed request before giving up
+            retry_delay: Delay before the first retry in seconds, doubled on each one
+            stats: Run statistics to record into. Default: a new RunStats
+        """
+        if concurrency < 1 or batch_size < 1:
+            raise ValueError("concurrency and batch_size must be positive")
+        self.url = base_url.rstrip("/") + "/completions"
+        self.model = model
+        self.api_key = api_key
+        self.cache = cache
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.stats = stats if stats is not None else RunStats()
+
+    def _post(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Send one request (blocking)."""
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        request = urllib.request.Request(self.url, data=json.dumps(body).encode("utf-8"), headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    async def _request(self, prompts: List[str], params: Dict[str, Any]) -> List[str]:
+        """Complete one batch of prompts, retrying on transient errors."""
+        body = {"model": self.model, "prompt": prompts, **params}
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.stats.timer("llm.request"):
+                    response = await asyncio.to_thread(self._post, body)
+                choices = sorted(response["choices"], key=lambda choice: choice.get("index", 0))
+                if len(choices) != len(prompts):
+                    raise LLMError(f"Expected {len(prompts)} completions, got {len(choices)}")
+                self.stats.count("llm_requests")
+                return [choice["text"] for choice in choices]
+            except urllib.error.HTTPError as e:
+                if e.code not in RETRY_STATUSES or attempt == self.max_retries:
+                    raise LLMError(f"Completion request failed: HTTP {e.code} {e.reason}") from e
+            except (urllib.error.URLError, OSError) as e:
+                if attempt == self.max_retries:
+                    raise LLMError(f"Completion request failed: {e}") from e
+            except (KeyError, TypeError, ValueError) as e:
+                raise LLMError(f"Invalid completion response: {e}") from e
+            self.stats.count("llm_retries")
+            await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    async def complete(self, prompts: Sequence[str], variants: Optional[Sequence[int]] = None,
+                       **params) -> List[str]:
+        """
+        Complete prompts.
+
+        Args:
+            prompts: The prompts
+            variants: Sample number of each prompt. Equal prompts with different
+                variants are completed (and cached) separately, e.g. to sample
+                several answers. Default: equal prompts share one completion
+            **params: Completion parameters (max_tokens, temperature, stop, ...)
+
+        Returns:
+            The completion of each prompt, in order
+        """
+        if variants is None:
+            variants = [0] * len(prompts)
+        items = list(zip(prompts, variants))
+        self.stats.count("llm_prompts", len(items))
+
+        # Identical prompts are completed once
+        keys = {item: CompletionCache.key(self.model, item[0], params, item[1]) for item in dict.fromkeys(items)}
+        self.stats.count("llm_duplicate_prompts", len(items) - len(keys))
+
+        completions = self.cache.get_many(keys.values()) if self.cache is not None else {}
+        missing = [item for item, key in keys.items() if key not in completions]
+        self.stats.count("llm_cache_hits", len(keys) - len(missing))
+        self.stats.count("llm_cache_misses", len(missing))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_batch(batch: List[Tuple[str, int]]) -> None:
+            async with semaphore:
+                texts = await self._request([prompt for prompt, _ in batch], params)
+            results = [(keys[item], self.model, item[0], text) for item, text in zip(batch, texts)]
+            if self.cache is not None:
+                self.cache.put_many(results)
+            for key, _, _, text in results:
+                completions[key] = text
+
+        batches = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        tasks = [asyncio.create_task(run_batch(batch)) for batch in batches]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return [completions[keys[item]] for item in items]
@@ -0,0 +1,235 @@
+"""
+Character book (lorebook) injection.
+
+SillyTavern adds the entries of a card's character book to the prompt when
+one of their keys appears in the last scan_depth messages. Lorebook does
+the same for a whole chat. It scans the messages once, through a sliding
+window of scan_depth messages, and activates every entry that would have
+been triggered at some point of the chat:
+- an entry triggers when one of its keys is in the window; selective
+  entries also need one of their secondary keys in the same window,
+- constant entries are always active,
+- with recursive_scanning, the content of active entries can trigger
+  further entries,
+- the book's token_budget keeps the highest priority entries,
+- active entries are inserted by insertion_order, before or after the
+  character description according to their position.
+
+Keys are matched as substrings, case-insensitively unless the entry is
+case_sensitive, with one Aho-Corasick automaton per case mode holding every
+key of the book. Each message is scanned once, in a time independent of
+the number of keys. The automata are built once per card (see
+LogPreprocessor.get_lorebook).
+
+Usage:
+    from lorebook import Lorebook
+
+    lorebook = Lorebook(card.data.character_book)
+    description = lorebook.inject(card.data.description, [entry["mes"] for entry in conversation])
+"""
+
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from token_budget import CharTokenCounter
+from v2_card import CharacterBook, CharacterBookEntry
+
+# Messages scanned for keys when the book does not set scan_depth (SillyTavern's default)
+DEFAULT_SCAN_DEPTH = 2
+# Passes over the content of newly activated entries with recursive_scanning
+MAX_RECURSION = 5
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton finding which of a set of keywords occur in a text."""
+
+    def __init__(self, keywords: List[str]):
+        """
+        Args:
+            keywords: Keywords, identified by their position in the list
+        """
+        # Trie transitions, failure links and the keywords ending at each node
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Tuple[int, ...]] = [()]
+
+        for keyword_id, keyword in enumerate(keywords):
+            node = 0
+            for char in keyword:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                node = next_node
+            self.output[node] += (keyword_id,)
+
+        # Breadth-first, so the failure link of a node is final before its children's
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] += self.output[self.fail[child]]
+
+    def find(self, text: str) -> Set[int]:
+        """Ids of the keywords occurring in text."""
+        goto, fail, output = self.goto, self.fail, self.output
+        found: Set[int] = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+class Lorebook:
+    """A character book compiled for key matching."""
+
+    def __init__(self, book: CharacterBook, token_counter=None):
+        """
+        Args:
+            book: The card's character book
+            token_counter: Callable counting the tokens of a text, for the
+                book's token_budget. Default: CharTokenCounter()
+        """
+        self.entries: List[CharacterBookEntry] = [entry for entry in book.entries
+                                                  if entry.enabled and entry.content]
+        self.scan_depth = book.scan_depth if book.scan_depth and book.scan_depth > 0 else DEFAULT_SCAN_DEPTH
+        self.token_budget = book.token_budget
+        self.recursive = bool(book.recursive_scanning)
+        self.count_tokens = token_counter or CharTokenCounter()
+        self.constant = {i for i, entry in enumerate(self.entries) if entry.constant}
+        self.selective = {i for i, entry in enumerate(self.entries) if entry.selective and entry.secondary_keys}
+
+        # Keyword -> (entry, is secondary key) targets, per case mode
+        self._automata: List[Tuple[KeywordAutomaton, bool, List[List[Tuple[int, bool]]]]] = []
+        for case_sensitive in (False, True):
+            keyword_ids: Dict[str, int] = {}
+            targets: List[List[Tuple[int, bool]]] = []
+            for i, entry in enumerate(self.entries):
+                if bool(entry.case_sensitive) != case_sensitive:
+                    continue
+                keys = [(key, False) for key in entry.keys]
+                if i in self.selective:
+                    keys += [(key, True) for key in entry.secondary_keys]
+                for key, secondary in keys:
+                    key = key.strip() if isinstance(key, str) else ""
+                    if not key:
+                        continue
+                    if not case_sensitive:
+                        key = key.lower()
+                    if key not in keyword_ids:
+                        keyword_ids[key] = len(targets)
+                        targets.append([])
+                    targets[keyword_ids[key]].append((i, secondary))
+            if targets:
+                self._automata.append((KeywordAutomaton(list(keyword_ids)), not case_sensitive, targets))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def match(self, text: str) -> Set[Tuple[int, bool]]:
+        """(entry, is secondary key) pairs of the keys occurring in text."""
+        matches = set()
+        for automaton, lower, targets in self._automata:
+            for keyword_id in automaton.find(text.lower() if lower else text):
+                matches.update(targets[keyword_id])
+        return matches
+
+    def _triggered(self, entry: int, primary: Dict[int, int], secondary: Dict[int, int]) -> bool:
+        return primary.get(entry, 0) > 0 and (entry not in self.selective or secondary.get(entry, 0) > 0)
+
+    def activate(self, messages: Iterable[str]) -> List[int]:
+        """
+        Entries activated anywhere in a chat, within the token budget.
+
+        Args:
+            messages: Message texts, in chat order
+
+        Returns:
+            Indexes into entries, in insertion order
+        """
+        active = set(self.constant)
+        # Key hits per entry inside the window, updated as it slides
+        primary: Dict[int, int] = {}
+        secondary: Dict[int, int] = {}
+        window: deque = deque()
+        for text in messages:
+            matches = self.match(text) if isinstance(text, str) and text else set()
+            window.append(matches)
+            for entry, is_secondary in matches:
+                counts = secondary if is_secondary else primary
+                counts[entry] = counts.get(entry, 0) + 1
+            if len(window) > self.scan_depth:
+                for entry, is_secondary in window.popleft():
+                    counts = secondary if is_secondary else primary
+                    counts[entry] -= 1
+            # Entries can only become active through the message that just entered
+            for entry, _ in matches:
+                if entry not in active and self._triggered(entry, primary, secondary):
+                    active.add(entry)
+
+        if self.recursive:
+            new = set(active)
+            for _ in range(MAX_RECURSION):
+                found = self.match("\n".join(self.entries[entry].content for entry in sorted(new)))
+                primary = {entry: 1 for entry, is_secondary in found if not is_secondary}
+                secondary = {entry: 1 for entry, is_secondary in found if is_secondary}
+                new = {entry for entry, _ in found if entry not in active and self._triggered(entry, primary, secondary)}
+                if not new:
+                    break
+                active |= new
+
+        return self._fit_budget(active)
+
+    def _fit_budget(self, active: Set[int]) -> List[int]:
+        """Keep the highest priority entries within the token budget, in insertion order."""
+        def priority(entry: int):
+            item = self.entries[entry]
+            return (item.priority if item.priority is not None else item.insertion_order) or 0
+
+        kept = sorted(active)
+        if self.token_budget:
+            kept = []
+            used = 0
+            for entry in sorted(active, key=lambda entry: (-priority(entry), entry)):
+                tokens = self.count_tokens(self.entries[entry].content)
+                if used + tokens > self.token_budget:
+                    continue
+                used += tokens
+                kept.append(entry)
+        return sorted(kept, key=lambda entry: (self.entries[entry].insertion_order or 0, entry))
+
+    def inject(self, description: Optional[str], messages: Iterable[str]) -> Optional[str]:
+        """The character description with the entries activated by a chat."""
+        return self.insert(description, self.activate(messages))
+
+    def insert(self, description: Optional[str], active: List[int],
+               transform: Optional[Callable[[str], str]] = None) -> Optional[str]:
+        """
+        The character description with the active entries inserted before
+        (position before_char, the default) or after it.
+
+        Args:
+            description: The character description
+            active: Entries to insert, as returned by activate()
+            transform: Applied to the content of each inserted entry
+        """
+        before, after = [], []
+        for entry in active:
+            item = self.entries[entry]
+            content = transform(item.content) if transform is not None else item.content
+            (after if item.position == "after_char" else before).append(content)
+        parts = before + ([description] if description else []) + after
+        return "\n".join(parts) if parts else description
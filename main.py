@@ -1,8 +1,25 @@
 from stage1_preprocessor import LogPreprocessor
-from stage2_axolotl import AxolotlConverter
+from stage2_axolotl import FORMATS, AxolotlConverter
+from incremental_cache import ChatCache
+from chat_watcher import ChatWatcher
+from dedup import KEEP_POLICIES, Deduplicator
+from chat_index import ChatIndex, parse_date
+from sampler import Sampler
+from dataset_writer import parse_size
+from run_stats import RunStats, profiled
+from token_budget import DEFAULT_CHARS_PER_TOKEN, TokenBudget, make_token_counter
+from tokenized_writer import TEMPLATES
+from llm_client import CompletionCache, LLMClient, LLMError
+from name_registry import NameRegistry
+from quality import DEFAULT_CONDITIONS, FEATURES, QualityFilter
+from shuffle_split import GROUP_BY, DatasetSplitter, parse_ratios, split_output_file
+from fuzzy_classifier import CANON_KINDS, NAME_KINDS, classify_canon, classify_names, generate_guidelines
 import os
+import random
+import asyncio
 import argparse
 from datetime import datetime
+from typing import Dict, List, Optional
 
 
 def is_st_dir(dir):
@@ -10,6 +27,15 @@ def is_st_dir(dir):
     return os.path.isdir(os.path.join(dir, "public"))
 
 
+def run_llm(coroutine):
+    """Run an LLM task, exiting with an error message if its requests fail."""
+    try:
+        return asyncio.run(coroutine)
+    except LLMError as e:
+        print(f"Error: {e}")
+        exit(1)
+
+
 def main():
     parser = argparse.ArgumentParser(description="SillyTavern log cleaner and formatter")
 
@@ -32,7 +58,8 @@ def main():
         "-f",
         "--format",
         type=str,
-        help="Output format. Supported formats: sharegpt. Default: sharegpt",
+        help="Output format, or a comma-separated list of formats written from one pass, e.g. sharegpt,alpaca. "
+             f"Supported formats: {', '.join(FORMATS)}. Default: sharegpt",
         required=False,
         default="sharegpt",
     )
@@ -44,6 +71,13 @@ def main():
         required=False,
         default=False,
     )
+    parser.add_argument(
+        "--obfuscate-characters",
+        action="store_true",
+        help="With -O, give every user and character one pseudonym across the corpus, kept in <output>/.cache/names.json. Default: false",
+        required=False,
+        default=False,
+    )
     parser.add_argument(
         "-r",
         "--include-reasoning",
@@ -52,6 +86,367 @@ def main():
         required=False,
         default=False,
     )
+    parser.add_argument(
+        "--lorebook",
+        action="store_true",
+        help="Add the character book entries whose keywords appear in a chat to its character description. Default: false",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of worker processes for stage 1. Default: 1",
+        required=False,
+        default=1,
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        help="Seed for obfuscation. The same seed gives identical output for any number of workers. Default: random",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--keep-stage1",
+        action="store_true",
+        help="Also write the intermediate stage 1 logs to <output>/stage1_out, for debugging. Default: false",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--two-pass",
+        action="store_true",
+        help="Run stage 1 to disk, then read it back in stage 2, instead of streaming. Default: false",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--stage1-format",
+        type=str,
+        choices=["jsonl", "binary"],
+        help="Format of the intermediate stage 1 logs: jsonl, or the compact binary .tlb format. Default: jsonl",
+        required=False,
+        default="jsonl",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Cache results in <output>/.cache and only reprocess new or changed chats. Default: false",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and update the dataset (<format>_live_00001.<ext>, ...) whenever chats or cards change. Default: false",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        help="Seconds between two checks for changes in --watch mode. Default: 1",
+        required=False,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--watch-debounce",
+        type=float,
+        help="Seconds a changed file must stay unchanged before --watch reads it. Default: 2",
+        required=False,
+        default=2.0,
+    )
+    parser.add_argument(
+        "--watch-shards",
+        type=int,
+        help="Number of files --watch publishes the dataset as; an update only rewrites the files of the changed chats. "
+             "Default: 16",
+        required=False,
+        default=16,
+    )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        choices=["jsonl", "parquet", "arrow", "tokens"],
+        help="Container of the output dataset: jsonl, parquet/arrow for memory-mapped loading (requires pyarrow), "
+             "or tokens for pre-tokenized NumPy arrays (requires --tokenizer, numpy and tokenizers). Default: jsonl",
+        required=False,
+        default="jsonl",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=str,
+        help="Split the output into shards of at most this size, e.g. 512M. Default: no limit",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--shard-records",
+        type=int,
+        help="Split the output into shards of at most this many records. Default: no limit",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-z",
+        "--compress",
+        type=str,
+        choices=["gzip", "zstd"],
+        help="Compress the output shards. Default: no compression",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        nargs="?",
+        const="",
+        help="Discover chats through a SQLite index updated on every run. Default path: <output>/.cache/chats.sqlite",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--character",
+        type=str,
+        action="append",
+        help="Only convert chats with this character (repeatable). Uses the index",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--user",
+        type=str,
+        action="append",
+        help="Only convert chats with this user name (repeatable). Uses the index",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--min-messages",
+        type=int,
+        help="Only convert chats with at least this many messages. Uses the index",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--modified-since",
+        type=str,
+        help="Only convert chats modified since this date, e.g. 2024-06-01. Uses the index",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--with-reasoning",
+        action="store_true",
+        help="Only convert chats containing reasoning. Uses the index",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--character-kind",
+        type=str,
+        action="append",
+        choices=list(NAME_KINDS.values()),
+        help="Only convert chats whose character name the LLM classifies as this kind (repeatable). Requires --llm-url",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--character-canon",
+        type=str,
+        action="append",
+        choices=list(CANON_KINDS.values()),
+        help="Only convert chats whose character the LLM classifies as canon or original (repeatable). Requires --llm-url",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--llm-guidelines",
+        type=int,
+        help="Generate this many roleplay guidelines with the LLM and append a random one to each system prompt. Requires --llm-url",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--llm-url",
+        type=str,
+        help="Base URL of an OpenAI-compatible completions API, e.g. http://localhost:8000/v1. Results are cached in <output>/.cache/llm.sqlite",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--llm-model",
+        type=str,
+        help="Model name sent to the LLM API. Default: default",
+        required=False,
+        default="default",
+    )
+    parser.add_argument(
+        "--llm-api-key",
+        type=str,
+        help="API key of the LLM API. Default: $OPENAI_API_KEY",
+        required=False,
+        default=os.environ.get("OPENAI_API_KEY"),
+    )
+    parser.add_argument(
+        "--llm-concurrency",
+        type=int,
+        help="Maximum number of concurrent LLM requests. Default: 4",
+        required=False,
+        default=4,
+    )
+    parser.add_argument(
+        "--llm-batch-size",
+        type=int,
+        help="Maximum number of prompts per LLM request. Default: 8",
+        required=False,
+        default=8,
+    )
+    parser.add_argument(
+        "--dedup",
+        type=str,
+        choices=KEEP_POLICIES,
+        help="Drop duplicate, prefix and near-duplicate chats, keeping the longest, newest or first of each group. Default: no deduplication",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--dedup-prefix",
+        type=int,
+        help="Also treat chats whose first N messages are identical as branches of one chat. Default: 0 (off)",
+        required=False,
+        default=0,
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=float,
+        help="Estimated Jaccard similarity above which chats are near-duplicates; 0 disables near-duplicate detection. Default: 0.8",
+        required=False,
+        default=0.8,
+    )
+    parser.add_argument(
+        "--quality",
+        type=str,
+        nargs="?",
+        const=DEFAULT_CONDITIONS,
+        help=f"Drop chats failing comma-separated quality conditions on {', '.join(FEATURES)}, "
+             f"e.g. 'user_turns>=3,repeated_ngrams<=p95' (p95: 95th percentile of the corpus), instead of "
+             f"chats under 4KB. Writes <output>/quality_<timestamp>.csv. Without a value: {DEFAULT_CONDITIONS}",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        help="Only convert a random sample of this many chats. Default: all chats",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--sample-fraction",
+        type=float,
+        help="Only convert this share (0-1) of the chats, picked at random. Default: all chats",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--sample-window",
+        type=int,
+        help="Cut each sampled chat to a random window of this many messages, reading only those lines",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--shuffle",
+        action="store_true",
+        help="Write the samples in an order shuffled with the seed (-s), in bounded memory. Default: false",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--split",
+        type=str,
+        help="Split the chats into train,val[,test] outputs with these shares, e.g. 0.98,0.01,0.01 "
+             "(<format>_<timestamp>_train.<ext>, ...). Implies --shuffle",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--split-by",
+        choices=GROUP_BY,
+        help="Assign every chat to a split on its own, or all the chats of a character together. Default: chat",
+        required=False,
+        default="chat",
+    )
+    parser.add_argument(
+        "--shuffle-memory",
+        type=str,
+        help="Largest part of the output held in memory while shuffling, e.g. 512M. Default: 256M",
+        required=False,
+        default="256M",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        help="Split chats longer than this many tokens into windows that repeat the system prompt. Default: no limit",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="Pack short chats together up to --max-tokens. Default: false",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--tokenizer",
+        type=str,
+        help="Hugging Face tokenizer.json used to count tokens and for --output-format tokens. Default: estimate from --chars-per-token",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--prompt-template",
+        type=str,
+        choices=list(TEMPLATES),
+        help="Prompt template of the pre-tokenized output (--output-format tokens). Default: chatml",
+        required=False,
+        default="chatml",
+    )
+    parser.add_argument(
+        "--mask-reasoning",
+        action="store_true",
+        help="Leave the <think> reasoning of replies out of the pre-tokenized labels. Default: false",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--chars-per-token",
+        type=float,
+        help=f"Characters per token for the token estimate. Default: {DEFAULT_CHARS_PER_TOKEN}",
+        required=False,
+        default=DEFAULT_CHARS_PER_TOKEN,
+    )
+    parser.add_argument(
+        "--stats",
+        type=str,
+        nargs="?",
+        const="",
+        help="Write a JSON run statistics report to this path. Default path: <output>/stats_<timestamp>.json",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Run under cProfile and write the profile to this path",
+        required=False,
+        default=None,
+    )
 
     args = parser.parse_args()
 
@@ -65,26 +460,293 @@ def main():
     obfuscate = args.obfuscate
     format_name = args.format
     include_reasoning = args.include_reasoning
+    workers = args.workers
+    seed = args.seed
+    keep_stage1 = args.keep_stage1 or args.two_pass
+    writer_options = {
+        "shard_max_bytes": parse_size(args.shard_size) if args.shard_size else None,
+        "shard_max_records": args.shard_records,
+        "compression": args.compress,
+        "container": args.output_format,
+    }
+
+    format_names = list(dict.fromkeys(name.strip() for name in format_name.split(",")))
+    for name in format_names:
+        if name not in FORMATS:
+            parser.error(f"Unsupported format: {name}. Supported formats: {', '.join(FORMATS)}")
+    formats_label = ", ".join(format_names)
+    if args.output_format == "arrow" and args.compress == "gzip":
+        parser.error("Arrow output supports zstd compression only")
+    if args.output_format == "tokens":
+        if not args.tokenizer:
+            parser.error("--output-format tokens requires --tokenizer")
+        if format_names != ["sharegpt"]:
+            parser.error("--output-format tokens is rendered from the sharegpt format only")
+        if args.shard_size or args.shard_records or args.compress:
+            parser.error("--output-format tokens cannot be sharded or compressed")
+        writer_options.update({
+            "tokenizer_file": args.tokenizer,
+            "template": args.prompt_template,
+            "train_reasoning": not args.mask_reasoning,
+            "workers": workers,
+        })
+    if args.pack and not args.max_tokens:
+        parser.error("--pack requires --max-tokens")
+    classify = args.character_kind or args.character_canon
+    if (classify or args.llm_guidelines) and not args.llm_url:
+        parser.error("--character-kind, --character-canon and --llm-guidelines require --llm-url")
+    if args.obfuscate_characters and not obfuscate:
+        parser.error("--obfuscate-characters requires -O 1")
+    sampling = args.sample is not None or args.sample_fraction is not None or args.sample_window is not None
+    if sampling and args.incremental:
+        parser.error("--sample options cannot be combined with --incremental")
+    if args.watch and (args.two_pass or args.incremental or args.dedup or args.quality or sampling or args.split):
+        parser.error("--watch cannot be combined with --two-pass, --incremental, --dedup, --quality, --sample or --split options")
+    if args.watch_shards < 1:
+        parser.error("--watch-shards must be at least 1")
+    splitter = None
+    if args.split:
+        if args.two_pass:
+            parser.error("--split cannot be combined with --two-pass")
+        try:
+            split_ratios = parse_ratios(args.split)
+        except ValueError as e:
+            parser.error(str(e))
+    shuffle = args.shuffle or args.split is not None
+    shuffle_seed = None
+    if shuffle:
+        shuffle_seed = seed if seed is not None else random.randrange(2**32)
+        if seed is None:
+            print(f"Shuffle seed: {shuffle_seed} (pass -s {shuffle_seed} to reproduce)")
+    if args.split:
+        splitter = DatasetSplitter(split_ratios, shuffle_seed, args.split_by)
+    shuffle_memory = parse_size(args.shuffle_memory)
 
     # Create output directories
     os.makedirs(output_dir, exist_ok=True)
-    stage1_out_dir = os.path.join(output_dir, "stage1_out")
-    os.makedirs(stage1_out_dir, exist_ok=True)
-
-    # Stage 1: Preprocess logs
-    print(f"Stage 1: Preprocessing logs from {st_dir}...")
-    processor = LogPreprocessor(st_dir, stage1_out_dir, obfuscate=obfuscate)
-    logs_processed = processor.process_all_files()
-    print(f"Stage 1 completed. Preprocessed {logs_processed} logs. Output saved to: {stage1_out_dir}")
+    stage1_out_dir = os.path.join(output_dir, "stage1_out") if keep_stage1 else None
+    if stage1_out_dir:
+        os.makedirs(stage1_out_dir, exist_ok=True)
 
-    # Stage 2: Convert to specified format
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    final_file = os.path.join(output_dir, f"{format_name}_{timestamp}.jsonl")
-    
-    print(f"Stage 2: Converting to {format_name} format...")
-    converter = AxolotlConverter(format_name, stage1_out_dir, final_file)
-    conversations_processed = converter.process_all_files(include_reasoning)
-    print(f"Stage 2 completed. Processed {conversations_processed} conversations. Output saved to: {final_file}")
+    # One output file per format
+    final_file = os.path.join(output_dir, f"{{format}}_{timestamp}.{args.output_format}")
+    stats = RunStats()
+    token_budget = None
+    if args.max_tokens:
+        token_budget = TokenBudget(args.max_tokens, make_token_counter(args.tokenizer, args.chars_per_token),
+                                   pack=args.pack, stats=stats)
+    deduplicator = None
+    if args.dedup:
+        deduplicator = Deduplicator(keep=args.dedup, shared_prefix=args.dedup_prefix,
+                                    near_threshold=args.dedup_threshold or None)
+    quality_filter = None
+    if args.quality:
+        try:
+            quality_filter = QualityFilter(args.quality, report_file=os.path.join(output_dir, f"quality_{timestamp}.csv"))
+        except (ImportError, ValueError) as e:
+            parser.error(str(e))
+    chat_filters = {
+        "characters": args.character,
+        "user_names": args.user,
+        "min_messages": args.min_messages,
+        "modified_since": parse_date(args.modified_since) if args.modified_since else None,
+        "has_reasoning": True if args.with_reasoning else None,
+    }
+    chat_filters = {name: value for name, value in chat_filters.items() if value is not None}
+    chat_index = None
+    if args.index is not None or chat_filters or classify:
+        chat_index = ChatIndex(args.index or os.path.join(output_dir, ".cache", "chats.sqlite"))
+    sampler = None
+    if sampling:
+        sampler = Sampler(size=args.sample, fraction=args.sample_fraction, window=args.sample_window, seed=seed)
+    llm_client = None
+    if args.llm_url:
+        llm_client = LLMClient(args.llm_url, args.llm_model, api_key=args.llm_api_key,
+                               cache=CompletionCache(os.path.join(output_dir, ".cache", "llm.sqlite")),
+                               concurrency=args.llm_concurrency, batch_size=args.llm_batch_size, stats=stats)
+    guidelines = None
+    if args.llm_guidelines:
+        with stats.timer("llm.guidelines"):
+            guidelines = run_llm(generate_guidelines(llm_client, args.llm_guidelines))
+        print(f"Generated {len(guidelines)} system prompt guidelines.")
+    name_registry = None
+    if args.obfuscate_characters:
+        name_registry = NameRegistry(os.path.join(output_dir, ".cache", "names.json"), seed=seed)
+        with stats.timer("names"):
+            new_names = name_registry.collect(os.path.join(st_dir, "data", "default-user", "chats"),
+                                              os.path.join(st_dir, "data", "default-user", "characters"), workers)
+            name_registry.save()
+        stats.count("names_registered", len(name_registry))
+        stats.count("names_new", new_names)
+        print(f"Name registry: {len(name_registry)} names, {new_names} new.")
+    processor = LogPreprocessor(st_dir, stage1_out_dir, obfuscate=obfuscate, seed=seed, stats=stats,
+                                deduplicator=deduplicator, chat_index=chat_index, chat_filters=chat_filters,
+                                sampler=sampler, output_format=args.stage1_format, guidelines=guidelines,
+                                lorebook=args.lorebook, name_registry=name_registry,
+                                quality_filter=quality_filter)
+    if classify:
+        # Each distinct character name of the corpus is classified once (and cached)
+        with stats.timer("llm.classify"):
+            for name, value in chat_index.update(processor.input_folder).items():
+                if name != "unchanged":
+                    stats.count(f"index_{name}", value)
+            names = list(chat_index.characters())
+            selected = set(names)
+            if args.character_kind:
+                kinds = run_llm(classify_names(llm_client, names))
+                selected &= {name for name, kind in kinds.items() if kind in args.character_kind}
+            if args.character_canon:
+                canon = run_llm(classify_canon(llm_client, names))
+                selected &= {name for name, kind in canon.items() if kind in args.character_canon}
+        if args.character:
+            selected &= set(args.character)
+        processor.chat_filters["characters"] = sorted(selected)
+        print(f"Selected {len(selected)} of {len(names)} characters by LLM classification.")
+
+    if args.watch:
+        # The dataset is written to a staging folder, then moved into the output folder
+        live_file = os.path.join(output_dir, ".watch", f"{{format}}_live.{args.output_format}")
+        converter = AxolotlConverter(format_names, None, live_file, writer_options, stats, token_budget,
+                                     shuffle_seed=shuffle_seed, shuffle_memory=shuffle_memory)
+        watcher = ChatWatcher(processor, converter, output_dir, include_reasoning, write_output=keep_stage1,
+                              workers=workers, interval=args.watch_interval, debounce=args.watch_debounce,
+                              shards=args.watch_shards, stats=stats)
+        stats_file = None
+        if args.stats is not None:
+            stats_file = args.stats or os.path.join(output_dir, f"stats_{timestamp}.json")
+
+        def report():
+            message = (f"Dataset updated: {watcher.conversations} conversations. "
+                       f"Output saved to: {', '.join(watcher.output_files)}")
+            latency = stats.latency_summary("watch")
+            if latency["count"]:
+                message += (f" Change-to-update latency: p50 {latency['p50_s']:.2f}s, "
+                            f"p95 {latency['p95_s']:.2f}s, max {latency['max_s']:.2f}s.")
+            print(message)
+            if name_registry is not None:
+                # Names of chats created while watching
+                name_registry.save()
+            if stats_file:
+                stats.write(stats_file)
+
+        print(f"Watching {processor.input_folder} and {processor.characters_folder} for changes. Press Ctrl+C to stop.")
+        try:
+            with profiled(args.profile):
+                watcher.run(on_update=report)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        finally:
+            watcher.close()
+        return
+
+    def make_converter(input_dir: Optional[str] = None, split: Optional[str] = None) -> AxolotlConverter:
+        # Each split is shuffled with its own seed
+        split_seed = shuffle_seed if split is None or shuffle_seed is None else f"{shuffle_seed}:{split}"
+        return AxolotlConverter(format_names, input_dir, split_output_file(final_file, split), writer_options, stats,
+                                token_budget, shuffle_seed=split_seed, shuffle_memory=shuffle_memory)
+
+    def split_log_files() -> Dict[Optional[str], Optional[List[str]]]:
+        """Log files of each split, or {None: None} for a single output of every selected log."""
+        if splitter is None:
+            return {None: None}
+        with stats.timer("split"):
+            splits = splitter.assign(processor.select_log_files(workers), processor.input_folder)
+        for split, log_paths in splits.items():
+            stats.count(f"split_{split}_logs", len(log_paths))
+        print("Split logs: " + ", ".join(f"{len(log_paths)} {split}" for split, log_paths in splits.items()) + ".")
+        return splits
+
+    output_files = []
+    conversations_processed = 0
+    with profiled(args.profile), stats.timer("total"):
+        if args.two_pass:
+            # Stage 1: Preprocess logs
+            print(f"Stage 1: Preprocessing logs from {st_dir}...")
+            with stats.timer("stage1"):
+                logs_processed = processor.process_all_files(workers=workers)
+            print(f"Stage 1 completed. Preprocessed {logs_processed} logs. Output saved to: {stage1_out_dir}")
+
+            # Stage 2: Convert to specified format
+            print(f"Stage 2: Converting to {formats_label} format...")
+            converter = make_converter(stage1_out_dir)
+            with stats.timer("stage2"):
+                conversations_processed = converter.process_all_files(include_reasoning)
+            output_files = converter.output_files
+        elif args.incremental:
+            print(f"Converting new and changed logs from {st_dir} to {formats_label} format...")
+            cache_options = {
+                "obfuscate": obfuscate,
+                "include_reasoning": include_reasoning,
+                "format": format_name,
+                "seed": seed,
+            }
+            if guidelines:
+                cache_options["guidelines"] = guidelines
+            if args.lorebook:
+                cache_options["lorebook"] = True
+            if quality_filter is not None:
+                # Small chats are no longer skipped by size
+                cache_options["quality"] = True
+            if name_registry is not None:
+                # A chat cached before a name was registered still holds that name
+                cache_options["name_registry"] = name_registry.digest()
+            cache = ChatCache(os.path.join(output_dir, ".cache"), cache_options)
+            with stats.timer("pipeline"):
+                splits = split_log_files()
+                if splitter is not None:
+                    cache.prune([cache.chat_id(processor, log_path)
+                                 for log_paths in splits.values() for log_path in log_paths])
+                for split, log_paths in splits.items():
+                    converter = make_converter(split=split)
+                    # Stage 1 runs lazily inside stage 2; its time is recorded apart
+                    with stats.timer("stage2", exclude="stage1"):
+                        conversations_processed += cache.convert(processor, converter, include_reasoning,
+                                                                 workers=workers, write_output=keep_stage1,
+                                                                 log_paths=log_paths)
+                    output_files += converter.output_files
+            stats.count("cache_hits", cache.hits)
+            stats.count("cache_misses", cache.misses)
+            stats.count("cache_removed", cache.removed)
+            print(f"Reused {cache.hits} cached logs, processed {cache.misses}, removed {cache.removed} deleted logs.")
+        else:
+            # Stages 1 and 2 streamed: cleaned conversations go straight to the formatter
+            print(f"Converting logs from {st_dir} to {formats_label} format...")
+            with stats.timer("pipeline"):
+                for split, log_paths in split_log_files().items():
+                    converter = make_converter(split=split)
+                    conversations = (conversation for _, conversation in
+                                     processor.iter_conversations(workers=workers, write_output=keep_stage1,
+                                                                  log_paths=log_paths))
+                    # Stage 1 runs lazily inside stage 2; its time is recorded apart
+                    with stats.timer("stage2", exclude="stage1"):
+                        conversations_processed += converter.process_conversations(
+                            stats.timed_iter("stage1", conversations), include_reasoning)
+                    output_files += converter.output_files
+            if keep_stage1:
+                print(f"Intermediate stage 1 logs saved to: {stage1_out_dir}")
+
+    if chat_index is not None:
+        print(f"Selected {stats.counters['index_selected']} logs from the index "
+              f"({stats.counters['index_added']} added, {stats.counters['index_updated']} updated, "
+              f"{stats.counters['index_removed']} removed"
+              + (f", {stats.counters['index_errors']} unreadable" if stats.counters["index_errors"] else "") + ").")
+    if deduplicator is not None:
+        print(deduplicator.summary())
+    if quality_filter is not None:
+        print(quality_filter.summary())
+        print(f"Quality report saved to: {quality_filter.report_file}")
+    if args.stats is not None:
+        stats_file = args.stats or os.path.join(output_dir, f"stats_{timestamp}.json")
+        stats.write(stats_file)
+        print(f"Run statistics saved to: {stats_file}")
+    if args.profile:
+        print(f"Profile saved to: {args.profile}")
+
+    if processor.errors:
+        print(f"{len(processor.errors)} logs failed to process.")
+    print(f"Stage 2 completed. Processed {conversations_processed} conversations. "
+          f"Output saved to: {', '.join(output_files)}")
 
 
 if __name__ == "__main__":
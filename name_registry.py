@@ -0,0 +1,349 @@
+"""
+Corpus-wide name obfuscation.
+
+LogPreprocessor.obfuscate_user_name replaces the user's name with a random
+name picked per chat, so a user gets a different name in every chat and
+the character keeps theirs. NameRegistry gives every user and character
+name in the corpus one pseudonym instead:
+- a first pass (NameRegistry.collect, in worker processes) reads the
+  user_name/character_name header of every chat and the name of every
+  character card,
+- each new name gets a pseudonym derived from the registry's seed and the
+  name, unique across the registry,
+- the registry is saved as JSON (by default <output>/.cache/names.json)
+  and reused by later runs: known names keep their pseudonym, and chats
+  and cards that did not change since the last scan are not read again.
+
+The second pass replaces every registered name in a message with a single
+regular expression. Its alternatives are arranged as a trie, so the cost of
+a substitution depends on the length of the message, not on the number of
+names. Full names and their first and last names (unless they are shared
+by several names) are replaced as whole words, in their original and UPPER
+case, in every chat. Words that may be ordinary words are only replaced in
+the chats of the name they belong to (the chat's user and character): the
+lower case variants, and names or name parts that are common words (Will,
+Grace, Walker, ...; see COMMON_WORDS). Lower case common words are never
+replaced.
+
+Usage:
+    from name_registry import NameRegistry
+
+    registry = NameRegistry("out/.cache/names.json", seed=42)
+    registry.collect(chats_folder, characters_folder, workers=8)
+    registry.save()
+    message = registry.replace(message, participants=(char_name, user_name))
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import v2_card
+from chat_reader import ChatReader
+from name_replacer import _case_variants, split_name
+
+# Pairs of first names tried for a name once the single names are taken
+PAIR_PROBES = 16
+# Prime step spreading the probes over the pairs
+PAIR_STEP = 7919
+
+# (name, kind) pairs found in a chat or card
+Names = List[Tuple[str, str]]
+
+# Common English words that are also names or name parts. As names, they are
+# only replaced in the chats of their owner, and never in lower case.
+COMMON_WORDS = frozenset("""
+    a an and are as at be but by for from he her him his i in is it its me my no not of on or our she so that the
+    their them they this to us was we what when who will with would you your yours
+    all am any art back bay bell best big bill black blue bob bold born brook brown buck burn can cash chase cliff
+    cook crow dale dawn day dean dell doll dove drew duke earl ever faith fall field fish fisher flower ford fox frank
+    free gay gene gift gill glen gold grace grant gray green grey guy hall hart hazel heather hill holly honey hope
+    hunter iris ivy jack jade jewel jay jean joy judge june just kay kit king knight lake lance lane lark laurel lee
+    light lily long love low lucky mark marsh mason may mercy miles mill miller mint moon moss nick noble north
+    page park pat patience pearl penny pepper pierce pine price prince queen rain raven ray reed rich river rob robin
+    rock rocky rose ruby rush rusty sandy scout shadow sky smith snow so sparrow spring star sterling stone storm
+    summer sun sunny sweet tanner taylor true victor violet wade walker ward west white wolf wood woods wren young
+    angel baby boy girl lady lord man master miss mister mom mother dad father sister brother nurse doctor
+    teacher user anon narrator system
+""".split())
+
+
+def scan_names(path: str) -> Names:
+    """Names in a chat log's header, or on a character card."""
+    if path.endswith(".png"):
+        card = v2_card.parse(path)
+        return [(card.data.name, "character")] if card.data.name else []
+
+    with ChatReader(path) as reader:
+        names = []
+        if reader.character_name:
+            names.append((reader.character_name, "character"))
+        if reader.user_name:
+            names.append((reader.user_name, "user"))
+        return names
+
+
+def _scan_worker(path: str) -> Tuple[str, Optional[Names]]:
+    try:
+        return path, scan_names(path)
+    except Exception:
+        return path, None
+
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """
+    Regular expression matching any of words, its alternatives arranged as a
+    trie: '(?:Al(?:ex|ice)|Bob)' rather than 'Alex|Alice|Bob'. Longer words
+    are tried first.
+    """
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class NameRegistry:
+    """Persistent mapping of every user and character name to a pseudonym."""
+
+    # Bump when the file format or the pseudonym assignment change
+    VERSION = 1
+
+    def __init__(self, path: Optional[str] = None, seed: Optional[int] = None,
+                 pool: Optional[List[str]] = None):
+        """
+        Args:
+            path: JSON file the registry is loaded from and saved to. Default: not persisted
+            seed: Seed of the pseudonym assignment, for a new registry. A loaded
+                registry keeps its own. Default: random
+            pool: First names pseudonyms are made of. Default: LogPreprocessor.UNISEX_NAMES
+        """
+        if pool is None:
+            from stage1_preprocessor import LogPreprocessor
+            pool = LogPreprocessor.UNISEX_NAMES
+        self.pool = list(dict.fromkeys(pool))
+        self.path = path
+        self.seed = seed if seed is not None else random.randrange(2**63)
+        # Original name -> {"kind": "character" | "user", "pseudonym": ...}
+        self.names: Dict[str, Dict[str, str]] = {}
+        # Scanned chat or card path -> [size, mtime_ns, names]
+        self.scanned: Dict[str, List[Any]] = {}
+        self.dirty = False
+        self._pseudonyms = set()
+        self._pattern: Optional[re.Pattern] = None
+        self._table: Dict[str, Tuple[str, Optional[str]]] = {}
+
+        if path:
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if data.get("version") != self.VERSION:
+            return
+        self.seed = data["seed"]
+        self.names = data["names"]
+        self.scanned = data.get("scanned", {})
+        self._pseudonyms = {entry["pseudonym"] for entry in self.names.values()}
+
+    def save(self) -> None:
+        """Write the registry atomically, if it changed."""
+        if not self.path or not self.dirty:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "seed": self.seed, "names": self.names,
+                       "scanned": self.scanned}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Copies sent to worker processes only replace names
+        state = self.__dict__.copy()
+        state["scanned"] = {}
+        return state
+
+    def digest(self) -> str:
+        """Hash of every name and its pseudonym, which change what replace does."""
+        pairs = sorted((name, entry["pseudonym"]) for name, entry in self.names.items())
+        return hashlib.sha256(json.dumps(pairs, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def _candidates(self, name: str) -> Iterator[str]:
+        """
+        Pseudonyms for name in order of preference: single names, then first
+        and last name pairs, then numbered pairs.
+        """
+        digest = hashlib.sha256(f"{self.seed}:{name}".encode("utf-8")).digest()
+        start = int.from_bytes(digest[:8], "big")
+        size = len(self.pool)
+        for i in range(size):
+            yield self.pool[(start + i) % size]
+        pairs = [f"{self.pool[index // size]} {self.pool[index % size]}"
+                 for index in ((start + i * PAIR_STEP) % (size * size) for i in range(PAIR_PROBES))]
+        yield from pairs
+        for number in itertools.count(2):
+            for pair in pairs:
+                yield f"{pair} {number}"
+
+    def _assign(self, name: str) -> str:
+        """A free pseudonym for name, derived from the seed and the name."""
+        for candidate in self._candidates(name):
+            if candidate not in self._pseudonyms and candidate not in self.names:
+                return candidate
+
+    def register(self, name: str, kind: str) -> str:
+        """Register a name if it is new (e.g. not collected yet) and return its pseudonym."""
+        entry = self.names.get(name)
+        if entry is None:
+            pseudonym = self._assign(name)
+            self.names[name] = {"kind": kind, "pseudonym": pseudonym}
+            self._pseudonyms.add(pseudonym)
+            self._pattern = None
+            self.dirty = True
+            return pseudonym
+        return entry["pseudonym"]
+
+    def collect(self, chats_folder: str, characters_folder: str, workers: int = 1) -> int:
+        """
+        Register the names of every chat and card. Chats and cards whose size
+        and mtime match the last scan are not read again.
+
+        Args:
+            chats_folder: SillyTavern chats folder
+            characters_folder: SillyTavern characters folder
+            workers: Number of worker processes
+
+        Returns:
+            Number of new names
+        """
+        signatures = {}
+        for folder, extension in ((chats_folder, ".jsonl"), (characters_folder, ".png")):
+            for root, _, files in os.walk(folder):
+                for file in files:
+                    if file.endswith(extension):
+                        path = os.path.join(root, file)
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            # Deleted or renamed between the listing and the stat
+                            continue
+                        signatures[path] = [stat.st_size, stat.st_mtime_ns]
+
+        changed = sorted(path for path, signature in signatures.items()
+                         if self.scanned.get(path, [None, None])[:2] != signature)
+        if workers <= 1:
+            results = map(_scan_worker, changed)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(_scan_worker, changed, chunksize=max(1, len(changed) // (workers * 4)))
+
+        try:
+            for path, names in results:
+                if names is not None:
+                    self.scanned[path] = signatures[path] + [names]
+        finally:
+            if workers > 1:
+                executor.shutdown()
+        for path in set(self.scanned) - set(signatures):
+            del self.scanned[path]
+        if changed or len(self.scanned) != len(signatures):
+            self.dirty = True
+
+        # Sorted, so the assignment does not depend on the scan order
+        before = len(self.names)
+        for name, kind in sorted({tuple(name) for entry in self.scanned.values() for name in entry[2]}):
+            self.register(name, kind)
+        return len(self.names) - before
+
+    @staticmethod
+    def _scope(word: str) -> Optional[bool]:
+        """
+        Where a variant of a name is replaced: None for nowhere (lower case
+        common words), True for the chats of its name only (lower case
+        variants and common words), False for every chat.
+        """
+        lower = word == word.lower() and word != word.upper()
+        common = word.lower() in COMMON_WORDS
+        if lower and common:
+            return None
+        return lower or common
+
+    def replacements(self) -> Dict[str, Tuple[str, Optional[str]]]:
+        """
+        Every replaced word -> (replacement, owner): the full names, then the
+        first and last names that belong to one name only, each in its
+        original, UPPER and lower case. owner is the name whose chats the word
+        is restricted to, or None if it is replaced in every chat (see _scope).
+        """
+        table: Dict[str, Tuple[str, Optional[str]]] = {}
+        for name, entry in self.names.items():
+            for orig, new in _case_variants(name, entry["pseudonym"]):
+                scope = self._scope(orig)
+                if scope is not None:
+                    table.setdefault(orig, (new, name if scope else None))
+
+        parts: Dict[str, Optional[Tuple[str, Optional[str]]]] = {}
+        for name, entry in self.names.items():
+            pseudonym = entry["pseudonym"]
+            new_parts = pseudonym.split(" ")
+            for position, part in enumerate(split_name(name)[:-1]):
+                # First name to first name, last name to last name where possible
+                new = new_parts[0 if position == 0 else -1] if len(new_parts) > 1 else pseudonym
+                for orig, replacement in _case_variants(part, new):
+                    scope = self._scope(orig)
+                    if len(orig) < 2 or orig in table or scope is None:
+                        continue
+                    value = (replacement, name if scope else None)
+                    parts[orig] = value if parts.get(orig, value) == value else None
+        table.update((orig, value) for orig, value in parts.items() if value is not None)
+        return table
+
+    def replace(self, text: str, participants: Iterable[str] = ()) -> str:
+        """
+        Replace every registered name in text, in a single pass.
+
+        Args:
+            text: The text
+            participants: Original names of the chat's user and character,
+                whose lower case and common word variants are replaced too
+        """
+        if not text or not self.names:
+            return text
+        if self._pattern is None:
+            self._table = self.replacements()
+            self._pattern = re.compile(r"(?<!\w)" + trie_pattern(self._table) + r"(?!\w)")
+        table = self._table
+        participants = set(participants)
+
+        def substitute(match: re.Match) -> str:
+            new, owner = table[match.group()]
+            return new if owner is None or owner in participants else match.group()
+
+        return self._pattern.sub(substitute, text)
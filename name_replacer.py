@@ -0,0 +1,153 @@
+"""
+Compiled name replacement for log obfuscation.
+
+The original obfuscation routine ran one str.replace() per
+(case variant x prefix x suffix) combination, i.e. 192 scans of every
+message per name. Because the empty prefix/suffix pass runs first, every
+later pass can only ever match text that the replacement itself produced.
+When the replacements cannot re-create a name, the whole chain collapses
+to one str.replace() per distinct case variant of the names: at most 9
+passes for a full name (first name, last name and the whole name, each in
+its original, UPPER and lower case). NameReplacer uses that chain when it
+is exact and falls back to the sequential chain otherwise, so the output is
+always identical.
+
+Usage:
+    from name_replacer import get_name_replacer
+
+    replacer = get_name_replacer("John Smith", "Avery")
+    message = replacer.replace(message)
+"""
+
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# Surrounding context patterns used by the sequential replacement chain
+SUFFIXES = ["", " ", ",", "*", "'", ".", "-", "?"]
+
+
+def _prefixes(original_name: str) -> List[str]:
+    return ["", f"{original_name[0]}-", " ", "\"", "—", "-", "'", "*"]
+
+
+def _case_variants(original_name: str, new_name: str) -> List[Tuple[str, str]]:
+    return [
+        (original_name, new_name),                  # Original case
+        (original_name.upper(), new_name.upper()),  # ALL CAPS
+        (original_name.lower(), new_name.lower()),  # all lowercase
+    ]
+
+
+def split_name(original_name: str) -> List[str]:
+    """
+    Names handled by LogPreprocessor.replace_name, in replacement order:
+    first name and last name for full names, then the whole name.
+    """
+    names = []
+    if " " in original_name:
+        names.append(original_name.split(" ")[0])
+        names.append(original_name.split(" ")[-1])
+    names.append(original_name)
+    return names
+
+
+def fuzzy_replace_sequential(message: str, original_name: str, new_name: str) -> str:
+    """
+    Reference implementation: replace names with surrounding context,
+    one full pass over the message per pattern.
+    """
+    prefixes = _prefixes(original_name)
+
+    for orig, replacement in _case_variants(original_name, new_name):
+        for prefix in prefixes:
+            for suffix in SUFFIXES:
+                old = f"{prefix}{orig}{suffix}"
+                new = f"{prefix}{replacement}{suffix}"
+                message = message.replace(old, new)
+
+    return message
+
+
+def _overlaps_before(a: str, b: str) -> bool:
+    """Whether an occurrence of a can start before, and run into, an occurrence of b."""
+    return any(a[-i:] == b[:i] for i in range(1, min(len(a), len(b))))
+
+
+def _overlaps(a: str, b: str) -> bool:
+    """Whether an occurrence of a and an occurrence of b can share characters."""
+    return a in b or b in a or _overlaps_before(a, b) or _overlaps_before(b, a)
+
+
+class NameReplacer:
+    """
+    Applies the sequential fuzzy replacement for a list of names.
+
+    The replacement is compiled into the cheapest strategy that still gives
+    the sequential chain's output:
+    - "chain": one str.replace() per distinct name variant, when no
+      replacement can re-create a name,
+    - "sequential": the full sequential chain otherwise.
+
+    Args:
+        pairs: (original_name, new_name) pairs, in the order the sequential
+            chain would apply them
+    """
+
+    def __init__(self, pairs: List[Tuple[str, str]]):
+        self.pairs = list(pairs)
+        self.chain = self._compile_chain(self.pairs)
+
+    @property
+    def strategy(self) -> str:
+        if self.chain is not None:
+            return "chain"
+        return "sequential"
+
+    @staticmethod
+    def _compile_chain(pairs: List[Tuple[str, str]]) -> Optional[List[Tuple[str, str]]]:
+        """
+        Reduce the sequential chain to the (original, replacement) passes that
+        can actually match, or return None if a replacement could re-create a
+        name and only the full chain reproduces the output.
+        """
+        chain = []
+        for original_name, new_name in pairs:
+            if not original_name:
+                # The sequential chain raises on empty names; keep that behaviour
+                return None
+
+            for orig, replacement in _case_variants(original_name, new_name):
+                # Once a name's bare pass has run no occurrence of it is left, so
+                # the prefixed/suffixed passes and any longer name containing it
+                # can no longer match.
+                if any(known in orig for known, _ in chain):
+                    continue
+                chain.append((orig, replacement))
+
+        for orig, _ in chain:
+            for _, replacement in chain:
+                if _overlaps(orig, replacement):
+                    return None
+        return chain
+
+    def replace(self, message: str) -> str:
+        if self.chain is not None:
+            for orig, replacement in self.chain:
+                message = message.replace(orig, replacement)
+            return message
+
+        for original_name, new_name in self.pairs:
+            message = fuzzy_replace_sequential(message, original_name, new_name)
+        return message
+
+
+@lru_cache(maxsize=1024)
+def get_fuzzy_replacer(original_name: str, new_name: str) -> NameReplacer:
+    """Cached replacer equivalent to fuzzy_replace_sequential for one name."""
+    return NameReplacer([(original_name, new_name)])
+
+
+@lru_cache(maxsize=1024)
+def get_name_replacer(original_name: str, new_name: str) -> NameReplacer:
+    """Cached replacer equivalent to LogPreprocessor.replace_name."""
+    return NameReplacer([(name, new_name) for name in split_name(original_name)])
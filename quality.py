@@ -0,0 +1,361 @@
+"""
+Conversation quality scoring and filtering.
+
+The only quality gate of stage 1 is a 4KB minimum file size, which lets
+one-sided, looping or broken chats through and drops short good ones.
+QualityFilter scores every chat on a few features and keeps those that
+meet a set of conditions:
+- messages, user_turns, assistant_turns, chars: sizes of the chat,
+- length_ratio: characters written by the user per character of the
+  assistant's replies (0 for a user who never writes, inf without replies),
+- repeated_ngrams: share of the word n-grams of the assistant's replies
+  that already occurred earlier in the chat (looping replies),
+- empty_messages: share of messages without text,
+- duplicate_swipes: share of swipes that are empty or copies of another
+  swipe of the same message,
+- reasoning_share: share of the assistant's characters spent in reasoning.
+
+Conditions are `feature>=value` or `feature<=value`, where the value can be
+a percentile of the corpus: `repeated_ngrams<=p95`.
+
+Chats are read in batches on worker processes. Each batch is read into flat
+per-message arrays tagged with chat ids and reduced to one NumPy array of
+raw counts (one row per chat) with bincount and a single sort. Features,
+percentiles and the selection are then computed with array operations over
+the whole corpus, and a per-chat report (features, kept, failed conditions)
+can be written as CSV.
+
+Requires the optional 'numpy' package.
+
+Usage:
+    from quality import QualityFilter
+
+    quality = QualityFilter("user_turns>=3,repeated_ngrams<=p95", report_file="quality.csv")
+    kept = quality.select(log_paths, workers=8)
+    print(quality.summary())
+"""
+
+import csv
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from chat_reader import ChatReader
+
+# Raw per-chat counts, one column each of the arrays returned by the workers
+COUNTS = ("messages", "user_turns", "assistant_turns", "user_chars", "assistant_chars",
+          "reasoning_chars", "empty_messages", "swipes", "duplicate_swipes", "ngrams", "repeated_ngrams")
+
+FEATURES = ("messages", "user_turns", "assistant_turns", "chars", "length_ratio", "repeated_ngrams",
+            "empty_messages", "duplicate_swipes", "reasoning_share")
+
+# Used by `--quality` without conditions
+DEFAULT_CONDITIONS = ("user_turns>=2,assistant_turns>=2,length_ratio>=0.01,length_ratio<=10,"
+                      "repeated_ngrams<=0.5,empty_messages<=0.2,duplicate_swipes<=0.5")
+
+_CONDITION = re.compile(r"^\s*(\w+)\s*(>=|<=)\s*(p?)(\d+(?:\.\d*)?|\.\d+)\s*$")
+
+# Multiplier combining word hashes into n-gram hashes
+_NGRAM_PRIME = 1000003
+
+
+class Condition:
+    """One quality condition: feature >= value or feature <= value."""
+
+    def __init__(self, feature: str, operator: str, value: float, percentile: bool = False):
+        self.feature = feature
+        self.operator = operator
+        self.value = value
+        self.percentile = percentile
+
+    def __str__(self) -> str:
+        value = f"p{self.value:g}" if self.percentile else f"{self.value:g}"
+        return f"{self.feature}{self.operator}{value}"
+
+
+def parse_conditions(spec: str) -> List[Condition]:
+    """
+    Parse comma-separated conditions, e.g. 'user_turns>=3,repeated_ngrams<=p95'.
+
+    Raises:
+        ValueError: On an unknown feature, a malformed condition or a percentile above 100
+    """
+    conditions = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        match = _CONDITION.match(part)
+        if not match:
+            raise ValueError(f"Invalid quality condition: {part.strip()!r} (expected e.g. 'user_turns>=3' or 'repeated_ngrams<=p95')")
+        feature, operator, percentile, value = match.groups()
+        if feature not in FEATURES:
+            raise ValueError(f"Unknown quality feature: {feature}. Features: {', '.join(FEATURES)}")
+        if percentile and float(value) > 100:
+            raise ValueError(f"Invalid percentile in quality condition: {part.strip()!r}")
+        conditions.append(Condition(feature, operator, float(value), bool(percentile)))
+    return conditions
+
+
+def count_chats(log_paths: List[str], ngram_size: int = 3):
+    """
+    Raw counts of chat logs.
+
+    The chats are read into flat per-message columns tagged with their chat,
+    which are then summed per chat with numpy.bincount. Repeated n-grams are
+    counted with one sort over the (chat, n-gram hash) pairs of every reply in
+    the batch.
+
+    Returns:
+        An N x len(COUNTS) array, in log_paths order. Unreadable chats are NaN rows
+    """
+    import numpy
+
+    # One entry per message
+    chats: List[int] = []
+    is_user: List[bool] = []
+    chars: List[int] = []
+    empty: List[bool] = []
+    # Chat and counts of each message with reasoning, and of each message with swipes
+    reasoning_chats: List[int] = []
+    reasoning: List[int] = []
+    swipe_chats: List[int] = []
+    swipes: List[int] = []
+    duplicate_swipes: List[int] = []
+    # Word hashes of the assistant's replies, and the chat and number of words of each reply
+    words: List[int] = []
+    reply_chats: List[int] = []
+    reply_words: List[int] = []
+    columns = (chats, is_user, chars, empty, words, reply_chats, reply_words,
+               reasoning_chats, reasoning, swipe_chats, swipes, duplicate_swipes)
+
+    unreadable = numpy.zeros(len(log_paths), dtype=bool)
+    for chat, log_path in enumerate(log_paths):
+        sizes = [len(column) for column in columns]
+        try:
+            with ChatReader(log_path) as reader:
+                for message in reader:
+                    text = message.get("mes")
+                    text = text if isinstance(text, str) else ""
+                    user = bool(message.get("is_user"))
+                    chats.append(chat)
+                    is_user.append(user)
+                    chars.append(len(text))
+                    empty.append(not text.strip())
+                    if not user:
+                        tokens = text.split()
+                        words.extend(map(hash, tokens))
+                        reply_chats.append(chat)
+                        reply_words.append(len(tokens))
+
+                    extra = message.get("extra")
+                    if isinstance(extra, dict) and isinstance(extra.get("reasoning"), str):
+                        reasoning_chats.append(chat)
+                        reasoning.append(len(extra["reasoning"]))
+                    variants = message.get("swipes")
+                    if isinstance(variants, list) and variants:
+                        texts = [variant if isinstance(variant, str) else "" for variant in variants]
+                        distinct = set(texts)
+                        swipe_chats.append(chat)
+                        swipes.append(len(texts))
+                        duplicate_swipes.append(len(texts) - len(distinct)
+                                                + sum(1 for variant in distinct if not variant.strip()))
+        except Exception:
+            # Drop what was read of the chat before it failed
+            unreadable[chat] = True
+            for column, size in zip(columns, sizes):
+                del column[size:]
+
+    n = len(log_paths)
+    chat_ids = numpy.array(chats, dtype=numpy.int64)
+    user_mask = numpy.array(is_user, dtype=bool)
+    lengths = numpy.array(chars, dtype=numpy.float64)
+    reasoning_ids = numpy.array(reasoning_chats, dtype=numpy.int64)
+    swipe_ids = numpy.array(swipe_chats, dtype=numpy.int64)
+
+    def per_chat(ids, weights=None):
+        return numpy.bincount(ids, weights, minlength=n).astype(numpy.float64)
+
+    c = {
+        "messages": per_chat(chat_ids),
+        "user_turns": per_chat(chat_ids[user_mask]),
+        "assistant_turns": per_chat(chat_ids[~user_mask]),
+        "user_chars": per_chat(chat_ids, lengths * user_mask),
+        "assistant_chars": per_chat(chat_ids, lengths * ~user_mask),
+        "reasoning_chars": per_chat(reasoning_ids, numpy.array(reasoning, dtype=numpy.float64)),
+        "empty_messages": per_chat(chat_ids[numpy.array(empty, dtype=bool)]),
+        "swipes": per_chat(swipe_ids, numpy.array(swipes, dtype=numpy.float64)),
+        "duplicate_swipes": per_chat(swipe_ids, numpy.array(duplicate_swipes, dtype=numpy.float64)),
+        "ngrams": numpy.zeros(n),
+        "repeated_ngrams": numpy.zeros(n),
+    }
+
+    # n-grams within each reply, hashed from the word hashes (wrapping int64 arithmetic)
+    if len(words) >= ngram_size:
+        hashes = numpy.array(words, dtype=numpy.int64)
+        replies = numpy.repeat(numpy.arange(len(reply_words)), reply_words)
+        length = len(hashes) - ngram_size + 1
+        ngram_hashes = hashes[:length].copy()
+        for offset in range(1, ngram_size):
+            ngram_hashes = ngram_hashes * _NGRAM_PRIME + hashes[offset:offset + length]
+        within = replies[:length] == replies[ngram_size - 1:]
+        ngram_chats = numpy.array(reply_chats, dtype=numpy.int64)[replies[:length][within]]
+        # The chat id in the low bits of each n-gram hash, so one sort finds the distinct
+        # (chat, n-gram) pairs of the batch (numpy.unique hashes, which is slower on large arrays)
+        bits = max(n - 1, 1).bit_length()
+        keys = numpy.sort(numpy.left_shift(ngram_hashes[within], bits) | ngram_chats)
+        distinct = keys[numpy.concatenate(([True], keys[1:] != keys[:-1]))] & ((1 << bits) - 1)
+        c["ngrams"] = per_chat(ngram_chats)
+        c["repeated_ngrams"] = c["ngrams"] - per_chat(distinct)
+
+    counts = numpy.column_stack([c[name] for name in COUNTS]) if n else numpy.empty((0, len(COUNTS)))
+    counts[unreadable] = numpy.nan
+    return counts
+
+
+def _count_batch(args: Tuple[List[str], int]):
+    """Counts of a batch of chats, one row each; NaN rows for unreadable chats."""
+    log_paths, ngram_size = args
+    return count_chats(log_paths, ngram_size)
+
+
+def compute_features(counts) -> Dict[str, Any]:
+    """Features of every chat from its raw counts (an N x len(COUNTS) array)."""
+    import numpy
+
+    c = {name: counts[:, i] for i, name in enumerate(COUNTS)}
+    replies_and_reasoning = c["assistant_chars"] + c["reasoning_chars"]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "messages": c["messages"],
+            "user_turns": c["user_turns"],
+            "assistant_turns": c["assistant_turns"],
+            "chars": c["user_chars"] + c["assistant_chars"],
+            "length_ratio": numpy.where(c["assistant_chars"] > 0, c["user_chars"] / c["assistant_chars"], numpy.inf),
+            "repeated_ngrams": numpy.where(c["ngrams"] > 0, c["repeated_ngrams"] / c["ngrams"], 0.0),
+            "empty_messages": numpy.where(c["messages"] > 0, c["empty_messages"] / c["messages"], 1.0),
+            "duplicate_swipes": numpy.where(c["swipes"] > 0, c["duplicate_swipes"] / c["swipes"], 0.0),
+            "reasoning_share": numpy.where(replies_and_reasoning > 0, c["reasoning_chars"] / replies_and_reasoning, 0.0),
+        }
+
+
+def _cell(value: float) -> Any:
+    """Report cell of a feature value: counts as integers, blank for unreadable chats."""
+    if value != value:
+        return ""
+    return int(value) if value.is_integer() else value
+
+
+class QualityFilter:
+    """Scores chats and keeps those meeting every quality condition."""
+
+    def __init__(self, conditions: str = DEFAULT_CONDITIONS, ngram_size: int = 3, batch_size: int = 256,
+                 report_file: Optional[str] = None):
+        """
+        Args:
+            conditions: Comma-separated conditions (see parse_conditions)
+            ngram_size: Words per n-gram for repeated_ngrams
+            batch_size: Chats per worker task
+            report_file: Write the per-chat report (CSV) here. Default: no report
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("Quality filtering requires the 'numpy' package: pip3 install numpy")
+        if ngram_size < 1 or batch_size < 1:
+            raise ValueError("ngram_size and batch_size must be positive")
+        self._np = numpy
+        self.conditions = parse_conditions(conditions)
+        self.ngram_size = ngram_size
+        self.batch_size = batch_size
+        self.report_file = report_file
+
+        # Resolved value of each condition (percentiles computed over the corpus)
+        self.thresholds: Dict[str, float] = {}
+        self.counts: Counter = Counter()
+
+    def score(self, log_paths: List[str], workers: int = 1):
+        """
+        Raw counts of chat logs.
+
+        Returns:
+            An N x len(COUNTS) array, in log_paths order. Unreadable chats are NaN rows
+        """
+        numpy = self._np
+        batches = [(log_paths[start:start + self.batch_size], self.ngram_size)
+                   for start in range(0, len(log_paths), self.batch_size)]
+        if not batches:
+            return numpy.empty((0, len(COUNTS)))
+        if workers <= 1:
+            return numpy.vstack([_count_batch(batch) for batch in batches])
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return numpy.vstack(list(executor.map(_count_batch, batches)))
+
+    def evaluate(self, features: Dict[str, Any], readable) -> Dict[str, Any]:
+        """Mask of the chats failing each condition, resolving percentiles over the readable chats."""
+        numpy = self._np
+        failed = {}
+        for condition in self.conditions:
+            values = features[condition.feature]
+            threshold = condition.value
+            if condition.percentile:
+                finite = values[readable & numpy.isfinite(values)]
+                threshold = float(numpy.percentile(finite, condition.value)) if finite.size else numpy.inf
+            self.thresholds[str(condition)] = threshold
+            with numpy.errstate(invalid="ignore"):
+                passed = values >= threshold if condition.operator == ">=" else values <= threshold
+            failed[str(condition)] = readable & ~passed
+        return failed
+
+    def select(self, log_paths: List[str], workers: int = 1) -> List[str]:
+        """
+        Score chat logs and filter them.
+
+        Args:
+            log_paths: Chat logs, in a stable order
+            workers: Number of worker processes used to read the chats
+
+        Returns:
+            The log paths meeting every condition, in the given order
+        """
+        numpy = self._np
+        counts = self.score(log_paths, workers)
+        readable = ~numpy.isnan(counts).any(axis=1)
+        features = compute_features(counts)
+        failed = self.evaluate(features, readable)
+
+        kept = readable.copy()
+        for name, mask in failed.items():
+            kept &= ~mask
+            self.counts[f"failed_{name}"] += int(mask.sum())
+        self.counts["chats"] += len(log_paths)
+        self.counts["unreadable"] += int((~readable).sum())
+        self.counts["removed"] += int((~kept).sum())
+
+        if self.report_file:
+            self.write_report(log_paths, features, kept, failed)
+        return [log_path for log_path, keep in zip(log_paths, kept.tolist()) if keep]
+
+    def write_report(self, log_paths: List[str], features: Dict[str, Any], kept, failed: Dict[str, Any]) -> None:
+        """Write one CSV row per chat: path, features, kept and the conditions it failed."""
+        numpy = self._np
+        names = list(failed)
+        failed_matrix = numpy.column_stack([failed[name] for name in names]) if names else None
+        columns = [[_cell(value) for value in numpy.round(features[name], 6).tolist()] for name in FEATURES]
+        with open(self.report_file, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["path", *FEATURES, "kept", "failed"])
+            for i, log_path in enumerate(log_paths):
+                reasons = [names[j] for j in numpy.flatnonzero(failed_matrix[i])] if names else []
+                if not kept[i] and not reasons:
+                    reasons = ["unreadable"]
+                writer.writerow([log_path, *(column[i] for column in columns), int(kept[i]), ";".join(reasons)])
+
+    def summary(self) -> str:
+        counts = self.counts
+        reasons = ", ".join(f"{counts[f'failed_{condition}']} {condition}" for condition in map(str, self.conditions)
+                            if counts[f"failed_{condition}"])
+        if counts["unreadable"]:
+            reasons = ", ".join(filter(None, [reasons, f"{counts['unreadable']} unreadable"]))
+        return (f"Quality filter removed {counts['removed']} of {counts['chats']} logs"
+                + (f" ({reasons})" if reasons else "") + ".")
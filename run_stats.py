@@ -0,0 +1,197 @@
+"""
+Run statistics for both stages.
+
+RunStats collects counters (bytes read and written, skipped files, missing
+metadata, card cache hits and misses, exceptions, messages, characters),
+wall/CPU timers for stages and hot functions, a per-file latency histogram,
+the slowest files and named latency samples (e.g. the change-to-update
+latency of --watch). Stats from worker processes are merged into the
+parent's, and the whole report can be written as JSON (main.py --stats).
+
+Usage:
+    from run_stats import RunStats
+
+    stats = RunStats()
+    with stats.timer("stage1"):
+        ...
+    stats.count("messages", 12)
+    stats.write("stats.json")
+"""
+
+import cProfile
+import heapq
+import json
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Upper bounds (seconds) of the per-file latency histogram buckets
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, float("inf")]
+
+
+class RunStats:
+    """Counters, timers and per-file latencies of a conversion run."""
+
+    # Number of slowest files kept for the report
+    SLOWEST_FILES = 20
+    # Number of most recent samples kept per named latency
+    LATENCY_SAMPLES = 1000
+
+    def __init__(self):
+        self.counters: Counter = Counter()
+        self.timers: Dict[str, Dict[str, float]] = {}
+        self.histogram: List[int] = [0] * len(LATENCY_BUCKETS)
+        # Min-heap of (latency, path), so the fastest of the slowest is evicted first
+        self.slowest: List[Tuple[float, str]] = []
+        # Name -> most recent latency samples (seconds)
+        self.latencies: Dict[str, List[float]] = {}
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def add_time(self, name: str, wall_s: float, cpu_s: float, calls: int = 1) -> None:
+        timer = self.timers.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+        timer["calls"] += calls
+        timer["wall_s"] += wall_s
+        timer["cpu_s"] += cpu_s
+
+    @contextmanager
+    def timer(self, name: str, exclude: Optional[str] = None) -> Iterator[None]:
+        """
+        Accumulate the wall and CPU time of a block under name.
+
+        Args:
+            name: Timer name
+            exclude: Timer whose time accumulated during the block is not
+                counted, e.g. stage 1 pulled lazily from inside stage 2
+        """
+        excluded = dict(self.timers.get(exclude, {})) if exclude else {}
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall_s, cpu_s = time.perf_counter() - wall, time.process_time() - cpu
+            if exclude:
+                timer = self.timers.get(exclude, {})
+                wall_s -= timer.get("wall_s", 0.0) - excluded.get("wall_s", 0.0)
+                cpu_s -= timer.get("cpu_s", 0.0) - excluded.get("cpu_s", 0.0)
+            self.add_time(name, max(wall_s, 0.0), max(cpu_s, 0.0))
+
+    def timed_iter(self, name: str, iterable: Iterable[Any]) -> Iterator[Any]:
+        """
+        Yield the items of iterable, accumulating the time spent producing
+        each of them under name (one call per item).
+        """
+        iterator = iter(iterable)
+        while True:
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - wall, time.process_time() - cpu, calls=0)
+                return
+            self.add_time(name, time.perf_counter() - wall, time.process_time() - cpu)
+            yield item
+
+    def record_file(self, path: str, latency_s: float) -> None:
+        """Add one file's processing latency to the histogram and slowest files."""
+        self.histogram[bisect_left(LATENCY_BUCKETS, latency_s)] += 1
+        entry = (latency_s, path)
+        if len(self.slowest) < self.SLOWEST_FILES:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def record_latency(self, name: str, latency_s: float) -> None:
+        """Add a latency sample under name, keeping the most recent LATENCY_SAMPLES."""
+        samples = self.latencies.setdefault(name, [])
+        samples.append(latency_s)
+        if len(samples) > self.LATENCY_SAMPLES:
+            del samples[:len(samples) - self.LATENCY_SAMPLES]
+
+    def latency_summary(self, name: str) -> Dict[str, float]:
+        """Count, median, 95th percentile and maximum of a named latency."""
+        samples = sorted(self.latencies.get(name, []))
+        if not samples:
+            return {"count": 0}
+        return {
+            "count": len(samples),
+            "p50_s": samples[len(samples) // 2],
+            "p95_s": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "max_s": samples[-1],
+        }
+
+    def merge(self, other: "RunStats") -> None:
+        """Merge stats collected elsewhere, e.g. in a worker process."""
+        self.counters.update(other.counters)
+        for name, timer in other.timers.items():
+            self.add_time(name, timer["wall_s"], timer["cpu_s"], timer["calls"])
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        for latency_s, path in other.slowest:
+            if len(self.slowest) < self.SLOWEST_FILES:
+                heapq.heappush(self.slowest, (latency_s, path))
+            elif (latency_s, path) > self.slowest[0]:
+                heapq.heapreplace(self.slowest, (latency_s, path))
+        for name, samples in other.latencies.items():
+            for latency_s in samples:
+                self.record_latency(name, latency_s)
+
+    def take(self) -> "RunStats":
+        """Return the stats collected so far and start over (used by workers)."""
+        taken = RunStats()
+        taken.counters, taken.timers, taken.histogram, taken.slowest, taken.latencies = (
+            self.counters, self.timers, self.histogram, self.slowest, self.latencies)
+        self.__init__()
+        return taken
+
+    def to_dict(self) -> Dict[str, Any]:
+        histogram = {}
+        lower = 0.0
+        for upper, files in zip(LATENCY_BUCKETS, self.histogram):
+            label = f"{lower}-{upper}s" if upper != float("inf") else f">{lower}s"
+            histogram[label] = files
+            lower = upper
+
+        return {
+            "counters": dict(sorted(self.counters.items())),
+            "timers": {
+                name: {key: round(value, 6) for key, value in timer.items()}
+                for name, timer in sorted(self.timers.items())
+            },
+            "file_latency_histogram": histogram,
+            "slowest_files": [
+                {"path": path, "latency_s": round(latency_s, 6)}
+                for latency_s, path in sorted(self.slowest, reverse=True)
+            ],
+            "latencies": {
+                name: {key: round(value, 6) for key, value in self.latency_summary(name).items()}
+                for name in sorted(self.latencies)
+            },
+        }
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+@contextmanager
+def profiled(output_file: Optional[str]) -> Iterator[None]:
+    """
+    Run a block under cProfile and dump the profile to output_file (inspect
+    with `python3 -m pstats` or snakeviz). Does nothing if output_file is None.
+    For sampling profilers such as py-spy, run main.py under `py-spy record`;
+    the hot paths are the named methods timed in RunStats.timers.
+    """
+    if not output_file:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_file)
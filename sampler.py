@@ -0,0 +1,92 @@
+"""
+Random samples of the chat corpus, for dataset previews and small runs.
+
+Sampler picks conversations either as a fixed-size reservoir sample or as a
+Bernoulli sample of a fraction of the chats, and can cut each picked chat
+down to a random window of consecutive messages. Windows are located with
+each chat's LineIndex, so only the metadata header and the lines of the
+window are ever parsed.
+
+Usage:
+    from sampler import Sampler
+
+    sampler = Sampler(size=100, window=40, seed=1)
+    log_paths = sampler.select(log_paths)
+    line_ranges = sampler.windows(log_paths)
+"""
+
+import random
+from typing import Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from line_index import LineIndex
+
+T = TypeVar("T")
+
+
+def reservoir_sample(items: Iterable[T], size: int, rng: random.Random) -> List[T]:
+    """
+    Uniform sample of size items from a stream of unknown length, in one pass
+    (Algorithm R). The sample keeps the items' stream order.
+    """
+    reservoir: List[Tuple[int, T]] = []
+    for i, item in enumerate(items):
+        if i < size:
+            reservoir.append((i, item))
+        else:
+            j = rng.randint(0, i)
+            if j < size:
+                reservoir[j] = (i, item)
+    return [item for _, item in sorted(reservoir, key=lambda entry: entry[0])]
+
+
+class Sampler:
+    """Samples conversations and message windows."""
+
+    def __init__(self, size: Optional[int] = None, fraction: Optional[float] = None,
+                 window: Optional[int] = None, seed: Optional[int] = None):
+        """
+        Args:
+            size: Number of conversations to sample
+            fraction: Share of conversations to sample, if size is not given
+            window: Cut each sampled conversation to a random window of this
+                many consecutive messages. Default: whole conversations
+            seed: Seed for the sample. Default: random
+        """
+        if size is not None and size < 0:
+            raise ValueError("size must not be negative")
+        if fraction is not None and not 0 <= fraction <= 1:
+            raise ValueError("fraction must be between 0 and 1")
+        if window is not None and window < 1:
+            raise ValueError("window must be positive")
+        self.size = size
+        self.fraction = fraction
+        self.window = window
+        self.rng = random.Random(seed)
+
+    def select(self, log_paths: Iterable[str]) -> List[str]:
+        """Sample log paths, keeping their order."""
+        if self.size is not None:
+            return reservoir_sample(log_paths, self.size, self.rng)
+        if self.fraction is not None:
+            return [log_path for log_path in log_paths if self.rng.random() < self.fraction]
+        return list(log_paths)
+
+    def windows(self, log_paths: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+        """
+        Pick a random message window in each log.
+
+        Returns:
+            Log path -> line range [start, stop) of the window, for logs longer
+            than the window (shorter ones are used whole)
+        """
+        line_ranges = {}
+        if self.window is None:
+            return line_ranges
+        for log_path in log_paths:
+            with LineIndex(log_path) as index:
+                # Line 0 is the metadata header
+                messages = len(index) - 1
+            if messages > self.window:
+                start = self.rng.randint(1, messages - self.window + 1)
+                line_ranges[log_path] = (start, start + self.window)
+        return line_ranges
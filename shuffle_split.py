@@ -0,0 +1,250 @@
+"""
+Seeded shuffle and train/validation/test split of the dataset.
+
+Conversations are written in chats folder order, so all the chats of a
+character end up next to each other. Two pieces fix that:
+
+DatasetSplitter assigns every chat to a split (train/val/test) from a hash
+of the seed and the chat's path, or of its character with group_by
+"character", so that no character appears in two splits. The assignment of
+a chat does not depend on the other chats: adding chats to the corpus never
+moves a chat to another split. The ratios are the expected shares of chats
+(or characters) in each split.
+
+ExternalShuffler shuffles the samples of one output in bounded memory. Each
+sample gets a random key from a generator seeded with the seed and is
+appended to one of `buckets` files on disk by key range. The buckets are
+then read back one at a time, in key order, and sorted by key. A bucket
+larger than max_memory is split again by key range before it is read.
+The output order depends only on the seed and the input order.
+
+Usage:
+    from shuffle_split import DatasetSplitter, ExternalShuffler
+
+    splitter = DatasetSplitter({"train": 0.98, "val": 0.01, "test": 0.01}, seed=42, group_by="character")
+    splits = splitter.assign(log_paths, chats_folder)  # {"train": [...], "val": [...], "test": [...]}
+
+    shuffler = ExternalShuffler(seed=42, temp_dir="out")
+    for sample in samples:
+        shuffler.add((line,))
+    for (line,) in shuffler.drain():
+        ...
+"""
+
+import hashlib
+import math
+import os
+import random
+import shutil
+import struct
+import tempfile
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Split names for two and three ratios
+SPLIT_NAMES = ("train", "val", "test")
+GROUP_BY = ("chat", "character")
+
+# Bucket record: sort key and number of parts, then each part's length and bytes
+_HEADER = struct.Struct("<dI")
+_LENGTH = struct.Struct("<I")
+# Length of a missing part (a format that skipped the sample)
+_MISSING = 0xFFFFFFFF
+
+
+def parse_ratios(spec: str) -> Dict[str, float]:
+    """
+    Parse split ratios: 'train,val' or 'train,val,test' shares, e.g. '0.98,0.01,0.01'.
+    Shares are normalized to sum to 1.
+
+    Raises:
+        ValueError: On anything but two or three non-negative numbers with a positive sum
+    """
+    try:
+        values = [float(value) for value in spec.split(",")]
+    except ValueError:
+        raise ValueError(f"Invalid split ratios: {spec!r} (expected e.g. '0.98,0.01,0.01')")
+    if len(values) not in (2, 3) or any(value < 0 for value in values) or sum(values) <= 0:
+        raise ValueError(f"Invalid split ratios: {spec!r} (expected two or three non-negative shares)")
+    total = sum(values)
+    return {name: value / total for name, value in zip(SPLIT_NAMES, values)}
+
+
+class DatasetSplitter:
+    """Assigns chats to splits by a seeded hash of the chat or its character."""
+
+    def __init__(self, ratios: Dict[str, float], seed: Union[int, str], group_by: str = "chat"):
+        """
+        Args:
+            ratios: Split name -> share of the chats (or characters)
+            seed: Seed of the assignment
+            group_by: 'chat' to assign every chat on its own, or 'character'
+                to keep all the chats of a character in the same split
+        """
+        if group_by not in GROUP_BY:
+            raise ValueError(f"Unsupported split grouping: {group_by}")
+        self.ratios = ratios
+        self.seed = seed
+        self.group_by = group_by
+
+    def group(self, log_path: str, chats_folder: str) -> str:
+        """Key of the group a chat is assigned with: its path, or its character folder."""
+        rel_path = os.path.relpath(log_path, chats_folder).replace(os.sep, "/")
+        return rel_path.split("/", 1)[0] if self.group_by == "character" else rel_path
+
+    def split_of(self, group: str) -> str:
+        digest = hashlib.sha256(f"{self.seed}:{group}".encode("utf-8")).digest()
+        position = int.from_bytes(digest[:8], "big") / 2**64
+        cumulative = 0.0
+        for name, share in self.ratios.items():
+            cumulative += share
+            if position < cumulative:
+                return name
+        return next(reversed(self.ratios))
+
+    def assign(self, log_paths: List[str], chats_folder: str) -> Dict[str, List[str]]:
+        """
+        Split chat logs.
+
+        Args:
+            log_paths: Chat logs, in a stable order
+            chats_folder: SillyTavern chats folder the paths are relative to
+
+        Returns:
+            Split name -> its log paths, in the given order, for every split
+        """
+        splits: Dict[str, List[str]] = {name: [] for name in self.ratios}
+        for log_path in log_paths:
+            splits[self.split_of(self.group(log_path, chats_folder))].append(log_path)
+        return splits
+
+
+class ExternalShuffler:
+    """Seeded shuffle of samples through key-range buckets on disk."""
+
+    def __init__(self, seed: Union[int, str], temp_dir: Optional[str] = None,
+                 max_memory: int = 256 * 1024 * 1024, buckets: int = 64):
+        """
+        Args:
+            seed: Seed of the shuffle
+            temp_dir: Folder the bucket folder is created in. Default: the system's
+            max_memory: Largest bucket, in bytes, read into memory at once
+            buckets: Number of bucket files the samples are spread over
+        """
+        if max_memory < 1 or buckets < 1:
+            raise ValueError("max_memory and buckets must be positive")
+        self.rng = random.Random(f"shuffle:{seed}")
+        self.max_memory = max_memory
+        self.buckets = buckets
+        self.bucket_dir = tempfile.mkdtemp(prefix=".shuffle_", dir=temp_dir)
+        self._files: List[Optional[object]] = [None] * buckets
+        self.samples = 0
+
+    def _bucket_path(self, bucket: int) -> str:
+        return os.path.join(self.bucket_dir, f"{bucket}.bin")
+
+    @staticmethod
+    def _encode(key: float, parts: Sequence[Optional[bytes]]) -> bytes:
+        chunks = [_HEADER.pack(key, len(parts))]
+        for part in parts:
+            if part is None:
+                chunks.append(_LENGTH.pack(_MISSING))
+            else:
+                chunks.append(_LENGTH.pack(len(part)))
+                chunks.append(part)
+        return b"".join(chunks)
+
+    @staticmethod
+    def _decode(data: bytes) -> Iterator[Tuple[float, Tuple[Optional[bytes], ...]]]:
+        position = 0
+        while position < len(data):
+            key, count = _HEADER.unpack_from(data, position)
+            position += _HEADER.size
+            parts = []
+            for _ in range(count):
+                (length,) = _LENGTH.unpack_from(data, position)
+                position += _LENGTH.size
+                if length == _MISSING:
+                    parts.append(None)
+                else:
+                    parts.append(data[position:position + length])
+                    position += length
+            yield key, tuple(parts)
+
+    def add(self, parts: Sequence[Optional[bytes]]) -> None:
+        """Add a sample: its rendered line in each output (None where an output skips it)."""
+        key = self.rng.random()
+        bucket = min(int(key * self.buckets), self.buckets - 1)
+        f = self._files[bucket]
+        if f is None:
+            f = self._files[bucket] = open(self._bucket_path(bucket), "wb")
+        f.write(self._encode(key, parts))
+        self.samples += 1
+
+    def drain(self) -> Iterator[Tuple[Optional[bytes], ...]]:
+        """Yield the samples in shuffled order, removing the buckets as they are read."""
+        for f in self._files:
+            if f is not None:
+                f.close()
+        width = 1.0 / self.buckets
+        for bucket, f in enumerate(self._files):
+            if f is not None:
+                yield from self._drain_bucket(self._bucket_path(bucket), bucket * width, width)
+        self._files = [None] * self.buckets
+
+    def _drain_bucket(self, path: str, low: float, width: float) -> Iterator[Tuple[Optional[bytes], ...]]:
+        size = os.path.getsize(path)
+        if size <= self.max_memory or width < 1e-12:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.remove(path)
+            # Stable sort: equal keys keep their input order
+            for _, parts in sorted(self._decode(data), key=lambda item: item[0]):
+                yield parts
+            return
+
+        # Too large to sort in memory: split its key range again, reading it in pieces
+        count = max(2, math.ceil(size / self.max_memory) * 2)
+        sub_width = width / count
+        sub_paths = [f"{path[:-4]}_{i}.bin" for i in range(count)]
+        sub_files = [open(sub_path, "wb") for sub_path in sub_paths]
+        try:
+            with open(path, "rb") as f:
+                for key, parts in self._read_records(f):
+                    index = min(int((key - low) / sub_width), count - 1)
+                    sub_files[max(index, 0)].write(self._encode(key, parts))
+        finally:
+            for sub_file in sub_files:
+                sub_file.close()
+        os.remove(path)
+        for i, sub_path in enumerate(sub_paths):
+            yield from self._drain_bucket(sub_path, low + i * sub_width, sub_width)
+
+    @staticmethod
+    def _read_records(f) -> Iterator[Tuple[float, Tuple[Optional[bytes], ...]]]:
+        """Records of a bucket file, read one at a time."""
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            key, count = _HEADER.unpack(header)
+            parts = []
+            for _ in range(count):
+                (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+                parts.append(None if length == _MISSING else f.read(length))
+            yield key, tuple(parts)
+
+    def close(self) -> None:
+        """Remove the bucket folder."""
+        for f in self._files:
+            if f is not None:
+                f.close()
+        self._files = [None] * self.buckets
+        shutil.rmtree(self.bucket_dir, ignore_errors=True)
+
+
+def split_output_file(output_file: str, split: Optional[str]) -> str:
+    """Output file of a split: the split name appended to the file name."""
+    if split is None:
+        return output_file
+    root, extension = os.path.splitext(output_file)
+    return f"{root}_{split}{extension}"
@@ -0,0 +1,234 @@
+"""
+Formats of the intermediate stage 1 logs.
+
+- jsonl: one JSON entry per line (.jsonl), readable by anything.
+- binary: a compact length-prefixed format (.tlb). Speaker names and the
+  extra fields other than reasoning (usually the same api/model on every
+  message) are interned: written once per file, then referenced by number.
+  Message bodies and reasoning are stored as raw UTF-8, so stage 2 reads
+  entries by slicing a memoryview instead of parsing JSON. Entries that do
+  not fit the compact layout (other fields, non-string names or messages)
+  are stored as JSON.
+
+Binary layout, after the b"TLB\\x01" magic, little endian:
+    name:    kind=2 (u8), length (u16), UTF-8 name
+    extra:   kind=4 (u8), length (u32), JSON of extra without reasoning
+    message: kind=1 (u8), flags (u8), name number (u16), length (u32), UTF-8 message,
+             then if FLAG_EXTRA: extra number (u16),
+             then if FLAG_REASONING: length (u32), UTF-8 reasoning
+    json:    kind=3 (u8), length (u32), JSON entry
+Entries are rebuilt with their fields in LogPreprocessor.FIELDS_TO_KEEP
+order (name, mes, is_user, extra), with reasoning last in extra.
+
+Usage:
+    import stage1_format
+
+    with open("out/chat.tlb", "wb") as f:
+        stage1_format.write_log(f, conversation, "binary")
+    for entry in stage1_format.read_log("out/chat.tlb"):
+        ...
+"""
+
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterable, Iterator, List
+
+import json_codec
+
+FORMATS = ("jsonl", "binary")
+EXTENSIONS = {"jsonl": ".jsonl", "binary": ".tlb"}
+
+MAGIC = b"TLB\x01"
+
+KIND_MESSAGE = 1
+KIND_NAME = 2
+KIND_JSON = 3
+KIND_EXTRA = 4
+
+FLAG_IS_USER = 1
+FLAG_HAS_IS_USER = 2
+FLAG_EXTRA = 4
+FLAG_NAME = 8
+FLAG_MES = 16
+FLAG_REASONING = 32
+
+_MESSAGE = struct.Struct("<BBHI")
+_NAME = struct.Struct("<BH")
+_JSON = struct.Struct("<BI")
+_LENGTH = struct.Struct("<I")
+_NUMBER = struct.Struct("<H")
+
+_COMPACT_FIELDS = {"name", "mes", "is_user", "extra"}
+# Interned names and extras per file
+_MAX_INTERNED = 0xFFFF
+
+
+def _encode(text: str) -> bytes:
+    # Lone surrogates survive the round trip, as they do through JSON
+    return text.encode("utf-8", "surrogatepass")
+
+
+def _decode(buffer) -> str:
+    return str(buffer, "utf-8", "surrogatepass")
+
+
+def _is_compact(entry: Dict[str, Any], names: Dict[str, int], extras: Dict[bytes, int]) -> bool:
+    """Whether an entry fits the compact message layout."""
+    if not entry.keys() <= _COMPACT_FIELDS:
+        return False
+    if "name" in entry:
+        name = entry["name"]
+        if not isinstance(name, str):
+            return False
+        if name not in names and (len(names) >= _MAX_INTERNED or len(_encode(name)) > 0xFFFF):
+            return False
+    if "mes" in entry and not isinstance(entry["mes"], str):
+        return False
+    if "is_user" in entry and not isinstance(entry["is_user"], bool):
+        return False
+    if "extra" in entry:
+        extra = entry["extra"]
+        if not isinstance(extra, dict) or not isinstance(extra.get("reasoning", ""), str):
+            return False
+        if len(extras) >= _MAX_INTERNED:
+            return False
+    return True
+
+
+def encode_log(entries: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """Yield the binary encoding of a stage 1 log, piece by piece."""
+    yield MAGIC
+    names: Dict[str, int] = {}
+    extras: Dict[bytes, int] = {}
+    for entry in entries:
+        if not _is_compact(entry, names, extras):
+            data = json_codec.dumpb(entry)
+            yield _JSON.pack(KIND_JSON, len(data)) + data
+            continue
+
+        flags = 0
+        name_number = 0
+        if "name" in entry:
+            flags |= FLAG_NAME
+            name = entry["name"]
+            if name not in names:
+                data = _encode(name)
+                names[name] = len(names)
+                yield _NAME.pack(KIND_NAME, len(data)) + data
+            name_number = names[name]
+        message = b""
+        if "mes" in entry:
+            flags |= FLAG_MES
+            message = _encode(entry["mes"])
+        if "is_user" in entry:
+            flags |= FLAG_HAS_IS_USER | (FLAG_IS_USER if entry["is_user"] else 0)
+        extra = b""
+        if "extra" in entry:
+            flags |= FLAG_EXTRA
+            rest = {key: value for key, value in entry["extra"].items() if key != "reasoning"}
+            data = json_codec.dumpb(rest)
+            if data not in extras:
+                extras[data] = len(extras)
+                yield _JSON.pack(KIND_EXTRA, len(data)) + data
+            extra = _NUMBER.pack(extras[data])
+            if "reasoning" in entry["extra"]:
+                flags |= FLAG_REASONING
+                reasoning = _encode(entry["extra"]["reasoning"])
+                extra += _LENGTH.pack(len(reasoning)) + reasoning
+
+        yield _MESSAGE.pack(KIND_MESSAGE, flags, name_number, len(message)) + message + extra
+
+
+def decode_log(data: bytes) -> Iterator[Dict[str, Any]]:
+    """Yield the entries of a binary stage 1 log."""
+    with memoryview(data) as view:
+        yield from _decode_view(view)
+
+
+def _decode_view(view: memoryview) -> Iterator[Dict[str, Any]]:
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a binary stage 1 log")
+
+    names: List[str] = []
+    extras: List[Dict[str, Any]] = []
+    position = len(MAGIC)
+    end = len(view)
+    unpack_message, message_size = _MESSAGE.unpack_from, _MESSAGE.size
+    while position < end:
+        kind = view[position]
+        if kind == KIND_MESSAGE:
+            _, flags, name_number, length = unpack_message(view, position)
+            position += message_size
+            entry: Dict[str, Any] = {}
+            if flags & FLAG_NAME:
+                entry["name"] = names[name_number]
+            if flags & FLAG_MES:
+                entry["mes"] = _decode(view[position:position + length])
+            position += length
+            if flags & FLAG_HAS_IS_USER:
+                entry["is_user"] = bool(flags & FLAG_IS_USER)
+            if flags & FLAG_EXTRA:
+                (number,) = _NUMBER.unpack_from(view, position)
+                position += _NUMBER.size
+                extra = dict(extras[number])
+                if flags & FLAG_REASONING:
+                    (length,) = _LENGTH.unpack_from(view, position)
+                    position += _LENGTH.size
+                    extra["reasoning"] = _decode(view[position:position + length])
+                    position += length
+                entry["extra"] = extra
+            yield entry
+        elif kind == KIND_NAME:
+            _, length = _NAME.unpack_from(view, position)
+            position += _NAME.size
+            names.append(_decode(view[position:position + length]))
+            position += length
+        elif kind == KIND_EXTRA:
+            _, length = _JSON.unpack_from(view, position)
+            position += _JSON.size
+            extras.append(json_codec.loads(bytes(view[position:position + length])))
+            position += length
+        elif kind == KIND_JSON:
+            _, length = _JSON.unpack_from(view, position)
+            position += _JSON.size
+            yield json_codec.loads(bytes(view[position:position + length]))
+            position += length
+        else:
+            raise ValueError(f"Unknown record kind {kind} at offset {position}")
+
+
+def format_of(path: str) -> str:
+    """Format of a stage 1 log, from its extension."""
+    return "binary" if path.endswith(EXTENSIONS["binary"]) else "jsonl"
+
+
+def is_stage1_log(path: str) -> bool:
+    return path.endswith(tuple(EXTENSIONS.values()))
+
+
+def output_name(log_path: str, log_format: str) -> str:
+    """File name of the stage 1 log of a chat log."""
+    return os.path.splitext(os.path.basename(log_path))[0] + EXTENSIONS[log_format]
+
+
+def write_log(f, entries: Iterable[Dict[str, Any]], log_format: str = "jsonl") -> None:
+    """Write a stage 1 log to a binary file object."""
+    if log_format == "binary":
+        for chunk in encode_log(entries):
+            f.write(chunk)
+    else:
+        for entry in entries:
+            f.write(json_codec.dumpb(entry) + b"\n")
+
+
+def read_log(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the entries of a stage 1 log in either format."""
+    if format_of(path) == "binary":
+        # Mapped rather than read, so memory does not grow with the size of the log
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from decode_log(data)
+    else:
+        with open(path, "rb") as f:
+            for line in f:
+                yield json_codec.loads(line)
@@ -4,7 +4,7 @@ SillyTavern Log Preprocessor
 
 This script processes SillyTavern logs by:
 1. Cleaning metadata to keep only relevant fields
-2. Optionally obfuscating usernames in the logs
+2. Optionally obfuscating user (and character) names in the logs
 3. Adding system instructions for roleplay
 
 Usage as a library:
@@ -15,13 +15,35 @@ Usage as a library:
     
     # Process all logs
     logs_processed = processor.process_all_files()
+
+    # Stream cleaned conversations without writing intermediate files
+    for log_path, conversation in processor.iter_conversations():
+        ...
+    
+    # Process all logs on 8 cores, reproducibly
+    processor = LogPreprocessor("path/to/sillytavern", "./cleaned_logs", obfuscate=True, seed=42)
+    logs_processed = processor.process_all_files(workers=8)
 """
 
-import json
+import hashlib
 import os
 import random
-from typing import Dict, List, Optional, Any
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Any, Tuple
 import v2_card 
+import json_codec
+import stage1_format
+from chat_index import ChatIndex
+from chat_reader import ChatReader
+from dedup import Deduplicator
+from lorebook import Lorebook
+from run_stats import RunStats
+from sampler import Sampler
+from name_registry import NameRegistry
+from name_replacer import get_fuzzy_replacer, get_name_replacer
+from quality import QualityFilter
 
 
 class LogPreprocessor:
@@ -40,6 +62,10 @@ class LogPreprocessor:
         "In this roleplay scenario, you are '{0}' interacting with '{1}'. Make your responses engaging and authentic."
     ]
     
+    # Most log files per worker task. With at most two tasks per worker queued
+    # or waiting to be consumed, memory grows with the workers, not the corpus
+    MAX_CHUNK_FILES = 16
+    
     # Simple fixed system prompt for when obfuscation is disabled
     FIXED_SYSTEM_PROMPT = "Assume the role of '{0}' in a roleplay conversation with '{1}'. Respond as your character would."
     
@@ -62,19 +88,71 @@ class LogPreprocessor:
         "Xiu", "Yara", "Zahra"
     ]
     
-    def __init__(self, st_folder: str, output_folder: str, obfuscate: bool = True):
+    def __init__(self, st_folder: str, output_folder: Optional[str], obfuscate: bool = True,
+                 seed: Optional[int] = None, stats: Optional[RunStats] = None,
+                 deduplicator: Optional[Deduplicator] = None, chat_index: Optional[ChatIndex] = None,
+                 chat_filters: Optional[Dict[str, Any]] = None, sampler: Optional[Sampler] = None,
+                 output_format: str = "jsonl", guidelines: Optional[List[str]] = None,
+                 lorebook: bool = False, name_registry: Optional[NameRegistry] = None,
+                 quality_filter: Optional[QualityFilter] = None):
         """
         Initialize the LogPreprocessor with the required parameters.
         
         Args:
             st_folder: Path to the SillyTavern folder
-            output_folder: Path where processed logs will be saved
+            output_folder: Path where processed logs will be saved. May be None when
+                conversations are only consumed through iter_conversations()
             obfuscate: Whether to obfuscate usernames in the logs
+            seed: Seed for the random choices made per file. Each file gets its own
+                generator derived from the seed and its path, so output does not
+                depend on processing order or worker count.
+            stats: Run statistics to record into. Default: a new RunStats
+            deduplicator: Drop duplicate, prefix and near-duplicate chats before
+                processing. Default: process every chat
+            chat_index: Discover chats through this index instead of walking the folder
+            chat_filters: ChatIndex.select() filters (characters, user_names,
+                min_messages, ...) choosing the chats to process. Requires chat_index.
+            sampler: Only process a random sample of the (deduplicated) chats,
+                optionally cut to random message windows
+            output_format: Format of the logs written to output_folder: 'jsonl'
+                or 'binary' (see stage1_format)
+            guidelines: Roleplay guidelines (see fuzzy_classifier.generate_guidelines),
+                one of which is picked at random and appended to each system prompt
+            lorebook: Inject the character book entries triggered by each chat
+                into the character description (see lorebook.Lorebook)
+            name_registry: With obfuscate, replace every user and character name
+                with its pseudonym in this registry, instead of the user name only
+            quality_filter: Drop chats failing its quality conditions before
+                processing. Its conditions replace the 4KB minimum file size
         """
         self.st_folder = st_folder
         self.input_folder = os.path.join(st_folder, "data", "default-user", "chats")
         self.output_folder = output_folder
+        if output_format not in stage1_format.FORMATS:
+            raise ValueError(f"Unsupported stage 1 format: {output_format}")
+        self.output_format = output_format
         self.obfuscate = obfuscate
+        self.seed = seed
+        self.characters_folder = os.path.join(st_folder, "data", "default-user", "characters")
+        
+        # Parsed character cards, shared by all chats of a character
+        self.card_cache = v2_card.CardCache()
+        self.lorebook = lorebook
+        # Card path -> (parsed card, its compiled lorebook), rebuilt when the card changes
+        self._lorebooks: Dict[str, Tuple[Any, Optional[Lorebook]]] = {}
+        
+        # (log_path, error message) for every file that failed to process
+        self.errors: List[Tuple[str, str]] = []
+        self.stats = stats if stats is not None else RunStats()
+        self.deduplicator = deduplicator
+        self.chat_index = chat_index
+        self.chat_filters = chat_filters or {}
+        self.sampler = sampler
+        self.guidelines = guidelines or []
+        self.name_registry = name_registry
+        self.quality_filter = quality_filter
+        # Log path -> [start, stop) line range to read instead of the whole log
+        self.line_ranges: Dict[str, Tuple[int, int]] = {}
         
         # Validate input folder existence
         if not os.path.exists(self.input_folder):
@@ -83,25 +161,48 @@ class LogPreprocessor:
             )
         
         # Create output folder if it doesn't exist
-        if not os.path.exists(self.output_folder):
+        if self.output_folder and not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
     
-    def get_random_unisex_name(self, blacklisted: str) -> str:
+    def get_file_rng(self, log_path: str) -> random.Random:
+        """
+        Get the random generator for a log file.
+        
+        Args:
+            log_path: Path to the log file
+            
+        Returns:
+            A generator seeded from the seed and the file's path relative to the
+            chats folder, or an unseeded generator if no seed was given
+        """
+        if self.seed is None:
+            return random.Random()
+        
+        rel_path = os.path.relpath(log_path, self.input_folder).replace(os.sep, "/")
+        digest = hashlib.sha256(f"{self.seed}:{rel_path}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+    
+    def get_random_unisex_name(self, blacklisted: str, rng: Optional[random.Random] = None) -> str:
         """
         Get a random unisex name that isn't the blacklisted name.
         
         Args:
             blacklisted: Name to avoid selecting
+            rng: Random generator to use. Default: the global random module
             
         Returns:
             A randomly selected unisex name
         """
-        name = random.choice(self.UNISEX_NAMES)
+        rng = rng or random
+        name = rng.choice(self.UNISEX_NAMES)
         while name == blacklisted:
-            name = random.choice(self.UNISEX_NAMES)
+            name = rng.choice(self.UNISEX_NAMES)
         return name
     
     def should_process_file(self, log_path: str) -> bool:
+        if self.quality_filter is not None:
+            # Already selected by the quality conditions
+            return True
         return os.path.getsize(log_path) >= 4 * 1024  # 4KB minimum
     
     def search_metadata(self, lines: List[str], field: str) -> Optional[str]:
@@ -117,48 +218,27 @@ class LogPreprocessor:
         """
         for line in lines:
             try:
-                jobj = json.loads(line)
+                jobj = json_codec.loads(line)
                 if field in jobj:
                     return jobj[field]
-            except json.JSONDecodeError:
+            except json_codec.JSONDecodeError:
                 continue
         return None
     
     def replace_name(self, message: str, original_name: str, new_name: str) -> str:
-        # Handle full names (first and last name)
-        if " " in original_name:
-            firstname = original_name.split(" ")[0]
-            lastname = original_name.split(" ")[-1]
-            message = self._fuzzy_replace_name(message, firstname, new_name)
-            message = self._fuzzy_replace_name(message, lastname, new_name)
-        
-        # Handle the whole name
-        return self._fuzzy_replace_name(message, original_name, new_name)
+        """
+        Replace first name, last name and the whole name in one pass.
+        The compiled replacer is cached per (original_name, new_name) pair.
+        """
+        return get_name_replacer(original_name, new_name).replace(message)
     
     def _fuzzy_replace_name(self, message: str, original_name: str, new_name: str) -> str:
         """
         Replace names with surrounding context to avoid partial word replacements.
         Handles regular case, uppercase, and lowercase versions of the name.
+        See name_replacer.fuzzy_replace_sequential for the reference behaviour.
         """
-        # Define surrounding context patterns
-        prefixes = ["", f"{original_name[0]}-", " ", "\"", "—", "-", "'", "*"]
-        suffixes = ["", " ", ",", "*", "'", ".", "-", "?"]
-        
-        # Process regular case, uppercase, and lowercase versions
-        case_variants = [
-            (original_name, new_name),            # Original case
-            (original_name.upper(), new_name.upper()),  # ALL CAPS
-            (original_name.lower(), new_name.lower())   # all lowercase
-        ]
-        
-        for orig, replacement in case_variants:
-            for prefix in prefixes:
-                for suffix in suffixes:
-                    old = f"{prefix}{orig}{suffix}"
-                    new = f"{prefix}{replacement}{suffix}"
-                    message = message.replace(old, new)
-                    
-        return message
+        return get_fuzzy_replacer(original_name, new_name).replace(message)
     
     def obfuscate_user_name(self, entry: Dict[str, Any], original_name: str, new_name: str) -> Dict[str, Any]:
         """
@@ -196,6 +276,35 @@ class LogPreprocessor:
 
         return new_data
     
+    def obfuscate_names(self, entry: Dict[str, Any], user_name: str,
+                        participants: Tuple[str, ...] = ()) -> Dict[str, Any]:
+        """
+        Replace every registered name in a log entry with its pseudonym.
+        
+        Args:
+            entry: Log entry as dictionary
+            user_name: Pseudonym of the chat's user
+            participants: Original names of the chat's character and user
+            
+        Returns:
+            Processed log entry with obfuscated names
+        """
+        if not entry:
+            return entry
+        
+        registry = self.name_registry
+        new_data = dict(entry)
+        if entry.get("is_user"):
+            new_data["name"] = user_name
+        elif isinstance(entry.get("name"), str):
+            new_data["name"] = registry.replace(entry["name"], participants)
+        if isinstance(entry.get("mes"), str):
+            new_data["mes"] = registry.replace(entry["mes"], participants)
+        extra = entry.get("extra")
+        if isinstance(extra, dict) and isinstance(extra.get("reasoning"), str):
+            new_data["extra"] = {**extra, "reasoning": registry.replace(extra["reasoning"], participants)}
+        return new_data
+    
     def keep_fields(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Filter out unwanted fields, keeping only those specified in FIELDS_TO_KEEP.
@@ -208,23 +317,73 @@ class LogPreprocessor:
         """
         return {k: v for k, v in data.items() if k in self.FIELDS_TO_KEEP}
     
+    def get_card_path(self, log_path: str) -> str:
+        """
+        Convert chat path to character card path.
+        """
+        card_path_parts = log_path.replace("/chats/", "/characters/", 1).split("/")[:-1]
+        return "/".join(card_path_parts) + ".png"
+    
     def get_char_description(self, log_path: str) -> Optional[str]:
         """
         Extract character description from character card.
         """
         try:
-            # Convert chat path to character card path
-            card_path_parts = log_path.replace("/chats/", "/characters/", 1).split("/")[:-1]
-            card_path = "/".join(card_path_parts) + ".png"
+            card_path = self.get_card_path(log_path)
             
             if not os.path.exists(card_path):
+                self.stats.count("card_missing")
                 return None
                 
-            card = v2_card.parse(card_path)
+            misses = self.card_cache.misses
+            card = self.card_cache.get(card_path)
+            self.stats.count("card_cache_misses" if self.card_cache.misses > misses else "card_cache_hits")
             return card.data.description
         except Exception:
+            self.stats.count("card_errors")
             return None
     
+    def get_lorebook(self, log_path: str) -> Optional[Lorebook]:
+        """
+        Get the compiled character book of a chat's card, compiling it once per card.
+        """
+        try:
+            card_path = self.get_card_path(log_path)
+            if not os.path.exists(card_path):
+                return None
+            card = self.card_cache.get(card_path)
+        except Exception:
+            return None
+        
+        cached = self._lorebooks.get(card_path)
+        if cached is None or cached[0] is not card:
+            book = card.data.character_book
+            compiled = Lorebook(book) if book is not None and book.entries else None
+            cached = self._lorebooks[card_path] = (card, compiled)
+            self.stats.count("lorebooks_compiled")
+        return cached[1]
+    
+    def inject_lorebook(self, log_path: str, char_desc: Optional[str], messages: Iterable[Optional[str]],
+                        transform: Optional[Callable[[str], str]] = None) -> Optional[str]:
+        """
+        Add the character book entries triggered by a conversation to the
+        character description.
+        
+        Args:
+            log_path: Path to the log file
+            char_desc: Character description
+            messages: The chat's original message texts, before obfuscation,
+                so keys naming the user or other characters still match
+            transform: Applied to the content of the injected entries, e.g.
+                to obfuscate the names in it
+        """
+        lorebook = self.get_lorebook(log_path)
+        if lorebook is None:
+            return char_desc
+        active = lorebook.activate(messages)
+        self.stats.count("lorebook_entries_injected", len(active))
+        return lorebook.insert(char_desc, active, transform)
+    
     def fix_char_description(self, char_desc: Optional[str], user_name: str, char_name: str) -> Optional[str]:
         """
         Replace placeholders in character description with actual names.
@@ -244,7 +403,8 @@ class LogPreprocessor:
     
     def prepend_instructions(self, conversation: List[Dict[str, Any]], 
                            user_name: str, char_name: str, 
-                           char_desc: Optional[str]) -> List[Dict[str, Any]]:
+                           char_desc: Optional[str],
+                           rng: Optional[random.Random] = None) -> List[Dict[str, Any]]:
         """
         Add system instructions to the beginning of the conversation.
         
@@ -253,6 +413,7 @@ class LogPreprocessor:
             user_name: Username for the conversation
             char_name: Character name for the conversation
             char_desc: Character description
+            rng: Random generator to use. Default: the global random module
             
         Returns:
             Conversation with prepended system instructions
@@ -260,7 +421,7 @@ class LogPreprocessor:
         # Choose system prompt based on obfuscation setting
         if self.obfuscate:
             # Select a random system prompt template when obfuscating
-            sysprompt_template = random.choice(self.SYSTEM_PROMPTS)
+            sysprompt_template = (rng or random).choice(self.SYSTEM_PROMPTS)
         else:
             # Use fixed system prompt when not obfuscating
             sysprompt_template = self.FIXED_SYSTEM_PROMPT
@@ -272,6 +433,10 @@ class LogPreprocessor:
         if char_desc:
             sysprompt += f" {char_name}'s description: {char_desc}"
         
+        # Add a generated guideline for more varied system prompts
+        if self.guidelines:
+            sysprompt += "\n\n" + (rng or random).choice(self.guidelines)
+        
         # Create the system message and starter message
         system = {"name": "system", "mes": sysprompt, "is_user": False}
         starter = {"name": user_name, "mes": "The roleplay begins.", "is_user": True}
@@ -279,67 +444,286 @@ class LogPreprocessor:
         # Return the new conversation with the prepended instructions
         return [system, starter] + conversation
     
-    def process_file(self, log_path: str) -> bool:
+    def clean_file(self, log_path: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Clean, obfuscate and prepend instructions to a single log file.
+        
+        Args:
+            log_path: Path to the log file
+            
+        Returns:
+            The cleaned conversation, or None if the file was skipped or failed
+        """
         if not self.should_process_file(log_path):
-            return False
+            self.stats.count("files_skipped_small")
+            return None
         
+        with self.stats.timer("stage1.clean_file"):
+            wall = time.perf_counter()
+            conversation = self._clean_file(log_path)
+            self.stats.record_file(log_path, time.perf_counter() - wall)
+        
+        if conversation is not None:
+            self.stats.count("files_processed")
+            self.stats.count("messages", len(conversation))
+            self.stats.count("characters", sum(len(entry.get("mes") or "") for entry in conversation))
+        return conversation
+    
+    def _clean_file(self, log_path: str) -> Optional[List[Dict[str, Any]]]:
         try:
-            with open(log_path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-            
-            conversation = []
-            original_user_name = self.search_metadata(lines, "user_name")
-            original_char_name = self.search_metadata(lines, "character_name")
-            
-            if not original_user_name or not original_char_name:
-                return False
+            with ChatReader(log_path, self.line_ranges.get(log_path)) as reader:
+                conversation = []
+                original_user_name = reader.user_name
+                original_char_name = reader.character_name
                 
-            char_name = original_char_name
-            user_name = original_user_name
-            
-            if self.obfuscate:
-                user_name = self.get_random_unisex_name(char_name)
-            else:
-                user_name = "User"
-            
-            print(f"Processing {log_path} with user name {original_user_name} and char name {char_name}")
-            for line in lines:
-                try:
-                    entry = json.loads(line)
+                if not original_user_name or not original_char_name:
+                    self.stats.count("files_missing_metadata")
+                    self.stats.count("stage1_bytes_read", reader.bytes_read)
+                    return None
                     
+                char_name = original_char_name
+                user_name = original_user_name
+                rng = self.get_file_rng(log_path)
+                
+                registry = self.name_registry if self.obfuscate else None
+                if registry is not None:
+                    char_name = registry.register(original_char_name, "character")
+                    user_name = registry.register(original_user_name, "user")
+                elif self.obfuscate:
+                    user_name = self.get_random_unisex_name(char_name, rng)
+                else:
+                    user_name = "User"
+                
+                print(f"Processing {log_path} with user name {original_user_name} and char name {original_char_name}")
+                # Names that may be ordinary words are only replaced in their own chats
+                participants = (original_char_name, original_user_name)
+                # Lorebook keys are matched against the messages as written
+                messages = [] if self.lorebook else None
+                # Every line is parsed once, header included
+                for entry in reader.records():
                     entry = self.keep_fields(entry)
+                    if messages is not None and entry:
+                        messages.append(entry.get("mes"))
 
-                    entry = self.obfuscate_user_name(entry, original_user_name, user_name)
+                    if registry is not None:
+                        entry = self.obfuscate_names(entry, user_name, participants)
+                    else:
+                        entry = self.obfuscate_user_name(entry, original_user_name, user_name)
                     
                     if entry:  # Only add valid entries
                         conversation.append(entry)
-                except json.JSONDecodeError:
-                    continue
+                self.stats.count("stage1_bytes_read", reader.bytes_read)
             
-            char_desc = self.get_char_description(log_path)
+            with self.stats.timer("stage1.get_char_description"):
+                char_desc = self.get_char_description(log_path)
+            if self.lorebook:
+                with self.stats.timer("stage1.lorebook"):
+                    # With a registry, the whole description is obfuscated below
+                    transform = None if registry is not None else \
+                        (lambda text: self.replace_name(text, original_user_name, user_name))
+                    char_desc = self.inject_lorebook(log_path, char_desc, messages, transform)
+            if registry is not None and char_desc:
+                char_desc = registry.replace(char_desc, participants)
             char_desc = self.fix_char_description(char_desc, user_name, char_name)
-            conversation = self.prepend_instructions(conversation, user_name, char_name, char_desc)
+            return self.prepend_instructions(conversation, user_name, char_name, char_desc, rng)
             
-            # Write processed output to new file
-            output_path = os.path.join(self.output_folder, os.path.basename(log_path))
-            with open(output_path, "w", encoding="utf-8") as f:
-                for entry in conversation:
-                    f.write(json.dumps(entry) + "\n")
+        except Exception as e:
+            print(f"Error processing {log_path}: {e}")
+            self.errors.append((log_path, str(e)))
+            self.stats.count("exceptions")
+            return None
+    
+    def write_file(self, log_path: str, conversation: List[Dict[str, Any]]) -> bool:
+        """
+        Write a cleaned conversation to the output folder, in output_format.
+        
+        Args:
+            log_path: Path to the original log file
+            conversation: Cleaned conversation
             
+        Returns:
+            True if the file was written
+        """
+        try:
+            output_path = os.path.join(self.output_folder, stage1_format.output_name(log_path, self.output_format))
+            with self.stats.timer("stage1.write_file"), open(output_path, "wb") as f:
+                stage1_format.write_log(f, conversation, self.output_format)
+                self.stats.count("stage1_bytes_written", f.tell())
             return True
-            
         except Exception as e:
-            print(f"Error processing {log_path}: {e}")
+            print(f"Error writing {log_path}: {e}")
+            self.errors.append((log_path, str(e)))
+            self.stats.count("exceptions")
             return False
     
-    def process_all_files(self) -> int:
-        logs_processed = 0
+    def process_file(self, log_path: str) -> bool:
+        return self._handle_file(log_path, write_output=True) is not None
+    
+    def _handle_file(self, log_path: str, write_output: bool) -> Optional[List[Dict[str, Any]]]:
+        conversation = self.clean_file(log_path)
+        if conversation is not None and write_output and not self.write_file(log_path, conversation):
+            return None
+        return conversation
+    
+    def list_log_files(self) -> List[str]:
+        """
+        List all log files in the chats folder, in a stable order. With a chat
+        index, the index is updated and the logs matching chat_filters are listed.
+        """
+        if self.chat_index is not None:
+            with self.stats.timer("index"):
+                changes = self.chat_index.update(self.input_folder)
+                log_paths = self.chat_index.select(self.input_folder, **self.chat_filters)
+            for name, value in changes.items():
+                self.stats.count(f"index_{name}", value)
+            self.stats.count("index_selected", len(log_paths))
+            return log_paths
         
+        log_paths = []
         for root, _, files in os.walk(self.input_folder):
             for file in files:
                 if file.endswith(".jsonl"):
-                    log_path = os.path.join(root, file)
-                    if self.process_file(log_path):
-                        logs_processed += 1
+                    log_paths.append(os.path.join(root, file))
+        return sorted(log_paths)
+    
+    def select_log_files(self, workers: int = 1) -> List[str]:
+        """
+        List the log files to process: list_log_files(), deduplicated if a
+        deduplicator is set, filtered if a quality filter is set and sampled if
+        a sampler is set. Sampled message windows are stored in line_ranges.
+        
+        Args:
+            workers: Number of worker processes used for deduplication and quality scoring
+        """
+        log_paths = self.list_log_files()
+        
+        if self.deduplicator is not None:
+            with self.stats.timer("dedup"):
+                # Only chats that will be processed may stand in for their duplicates;
+                # the others stay listed and are skipped as before
+                processed = [log_path for log_path in log_paths if self.should_process_file(log_path)]
+                kept = set(self.deduplicator.select(processed, workers))
+                dropped = set(processed) - kept
+                log_paths = [log_path for log_path in log_paths if log_path not in dropped]
+            for name, value in self.deduplicator.counts.items():
+                self.stats.count(f"dedup_{name}", value)
         
-        return logs_processed
+        if self.quality_filter is not None:
+            with self.stats.timer("quality"):
+                log_paths = self.quality_filter.select(log_paths, workers)
+            for name, value in self.quality_filter.counts.items():
+                self.stats.count(f"quality_{name}", value)
+        
+        if self.sampler is not None:
+            with self.stats.timer("sample"):
+                log_paths = self.sampler.select(log_paths)
+                self.line_ranges = self.sampler.windows(log_paths)
+            self.stats.count("sampled_logs", len(log_paths))
+            self.stats.count("sampled_windows", len(self.line_ranges))
+        return log_paths
+    
+    def _run(self, log_paths: Optional[List[str]], workers: int, write_output: bool,
+             return_conversations: bool) -> Iterator[Tuple[str, Any]]:
+        """
+        Handle log files, in this process or in a process pool.
+        
+        Yields:
+            (log_path, result) in log_paths order (default: select_log_files()).
+            result is the cleaned conversation (or a bool if return_conversations
+            is False), None/False if the file was skipped or failed.
+        """
+        if log_paths is None:
+            log_paths = self.select_log_files(workers)
+        
+        if workers <= 1:
+            for log_path in log_paths:
+                conversation = self._handle_file(log_path, write_output)
+                yield log_path, conversation if return_conversations else conversation is not None
+            return
+        
+        if self.seed is None:
+            # Workers must not share the parent's random state
+            self.seed = random.randrange(2**63)
+        
+        # Parse every card once here; workers inherit the warm cache
+        self.card_cache.prewarm(self.characters_folder)
+        
+        chunksize = max(1, min(len(log_paths) // (workers * 4), self.MAX_CHUNK_FILES))
+        chunks = iter([log_paths[start:start + chunksize] for start in range(0, len(log_paths), chunksize)])
+        initargs = (self, write_output, return_conversations)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            # A bounded window of chunks in flight; the next one is submitted as each is consumed, in order
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk, executor.submit(_handle_chunk_worker, chunk)))
+                if len(pending) >= workers * 2:
+                    break
+            while pending:
+                chunk, future = pending.popleft()
+                results = future.result()
+                next_chunk = next(chunks, None)
+                if next_chunk is not None:
+                    pending.append((next_chunk, executor.submit(_handle_chunk_worker, next_chunk)))
+                for log_path, (result, errors, stats) in zip(chunk, results):
+                    self.errors.extend(errors)
+                    self.stats.merge(stats)
+                    yield log_path, result
+    
+    def iter_conversations(self, workers: int = 1, write_output: bool = False,
+                           log_paths: Optional[List[str]] = None,
+                           include_skipped: bool = False) -> Iterator[Tuple[str, Optional[List[Dict[str, Any]]]]]:
+        """
+        Lazily yield cleaned conversations, without the stage 1 files round-trip.
+        
+        Args:
+            workers: Number of worker processes. 1 processes files in this process.
+            write_output: Also write each conversation to the output folder (for debugging)
+            log_paths: Log files to process. Default: every (deduplicated) log in the chats folder
+            include_skipped: Also yield (log_path, None) for logs that were skipped or failed
+            
+        Yields:
+            (log_path, conversation) for every processed log, in a stable order
+        """
+        for log_path, conversation in self._run(log_paths, workers, write_output, return_conversations=True):
+            if conversation is not None or include_skipped:
+                yield log_path, conversation
+    
+    def process_all_files(self, workers: int = 1) -> int:
+        """
+        Process all log files in the chats folder.
+        
+        Args:
+            workers: Number of worker processes. 1 processes files in this process.
+            
+        Returns:
+            Number of logs processed
+        """
+        return sum(1 for _, processed in self._run(None, workers, True, return_conversations=False) if processed)
+
+
+# Preprocessor copy and options owned by each worker process
+_worker_processor: Optional[LogPreprocessor] = None
+_worker_write_output = True
+_worker_return_conversations = False
+
+
+def _init_worker(processor: LogPreprocessor, write_output: bool, return_conversations: bool) -> None:
+    global _worker_processor, _worker_write_output, _worker_return_conversations
+    _worker_processor = processor
+    # Only stats collected in this worker are sent back
+    _worker_processor.stats = RunStats()
+    _worker_write_output = write_output
+    _worker_return_conversations = return_conversations
+
+
+def _handle_file_worker(log_path: str) -> Tuple[Any, List[Tuple[str, str]], RunStats]:
+    """Handle one file in a worker and hand the result and its stats back to the parent."""
+    _worker_processor.errors = []
+    conversation = _worker_processor._handle_file(log_path, _worker_write_output)
+    result = conversation if _worker_return_conversations else conversation is not None
+    return result, _worker_processor.errors, _worker_processor.stats.take()
+
+
+def _handle_chunk_worker(log_paths: List[str]) -> List[Tuple[Any, List[Tuple[str, str]], RunStats]]:
+    """Handle a chunk of files in a worker, one result per file."""
+    return [_handle_file_worker(log_path) for log_path in log_paths]
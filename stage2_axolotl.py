@@ -1,17 +1,60 @@
-import json
 import os
 from abc import ABC, abstractmethod
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import json_codec
+import stage1_format
+from arrow_writer import ArrowDatasetWriter
+from dataset_writer import DatasetWriter
+from run_stats import RunStats
+from shuffle_split import ExternalShuffler
+from tokenized_writer import TokenizedDatasetWriter
+from token_budget import TokenBudget
 
 
 class DialogueFormat(ABC):
     @abstractmethod
     def generate_dialogue(self, jobj: dict) -> dict:
         pass
+    
+    def to_record(self, dialogue: List[dict]) -> Optional[dict]:
+        """
+        Build the output record of a conversation.
+        
+        Args:
+            dialogue: ShareGPT dialogue turns ({"from": ..., "value": ...}),
+                the form every conversation is parsed into once
+                
+        Returns:
+            The record, or None if the conversation has no record in this format
+        """
+        return {"conversations": dialogue}
+    
+    def render(self, dialogue: List[dict]) -> Optional[bytes]:
+        """Render a conversation as an output line, None if it has no record."""
+        record = self.to_record(dialogue)
+        if record is None:
+            return None
+        return json_codec.dumpb(record) + b"\n"
 
     @abstractmethod
     def generate_conversation(self, cleaned_log_file: str) -> list[dict]:
         pass
 
+    def generate_conversation_from_entries(self, entries: Iterable[dict], include_reasoning: bool = False) -> list[dict]:
+        """Build a conversation from already parsed stage 1 entries."""
+        return [self.generate_dialogue(jobj, include_reasoning) for jobj in entries]
+
+    def iter_conversation(self, cleaned_log_file: str, include_reasoning: bool = False) -> Iterator[dict]:
+        """
+        Yield the dialogue turns of a cleaned log (JSONL or binary) one at a
+        time, reading the file lazily, so memory does not grow with the length
+        of the chat.
+        """
+        for jobj in stage1_format.read_log(cleaned_log_file):
+            yield self.generate_dialogue(jobj, include_reasoning)
+
 
 class ShareGPTFormat(DialogueFormat):
     def generate_dialogue(self, jobj: dict, include_reasoning: bool = False) -> dict:
@@ -34,44 +77,149 @@ class ShareGPTFormat(DialogueFormat):
             print("Not supported", jobj)
 
     def generate_conversation(self, cleaned_log_file: str, include_reasoning: bool = False) -> list[dict]:
-        with open(cleaned_log_file, "r") as f:
-            lines = f.readlines()
+        return list(self.iter_conversation(cleaned_log_file, include_reasoning))
+
+
+class ChatTemplateFormat(ShareGPTFormat):
+    """
+    OpenAI-style messages, for Axolotl's chat_template datasets:
+    {"messages": [{"role": "system" | "user" | "assistant", "content": ...}]}
+    """
+    
+    ROLES = {"system": "system", "human": "user", "gpt": "assistant"}
+    
+    def to_record(self, dialogue: List[dict]) -> Optional[dict]:
+        return {"messages": [{"role": self.ROLES[turn["from"]], "content": turn["value"]}
+                             for turn in dialogue if turn is not None]}
+
+
+class AlpacaFormat(ShareGPTFormat):
+    """
+    Single-turn instruction records: {"instruction", "input", "output"}.
+    
+    The system prompt is the instruction, the last assistant reply is the
+    output and the turns before it, as a "Role: text" transcript, are the
+    input. Turns after the last reply are dropped, and conversations without
+    an assistant reply have no record.
+    """
+    
+    LABELS = {"system": "System", "human": "User", "gpt": "Assistant"}
+    
+    def to_record(self, dialogue: List[dict]) -> Optional[dict]:
+        dialogue = [turn for turn in dialogue if turn is not None]
+        last_reply = max((i for i, turn in enumerate(dialogue) if turn["from"] == "gpt"), default=None)
+        if last_reply is None:
+            return None
+        
+        # Leading system turns form the instruction
+        start = 0
+        while start < last_reply and dialogue[start]["from"] == "system":
+            start += 1
+        instruction = "\n\n".join(turn["value"] for turn in dialogue[:start])
+        history = "\n\n".join(f"{self.LABELS[turn['from']]}: {turn['value']}" for turn in dialogue[start:last_reply])
+        return {"instruction": instruction, "input": history, "output": dialogue[last_reply]["value"]}
+
+
+FORMATS = {
+    "sharegpt": ShareGPTFormat,
+    "chat_template": ChatTemplateFormat,
+    "alpaca": AlpacaFormat,
+}
 
-        conversations = []
-        for line in lines:
-            jobj = json.loads(line)
-            dialogue = self.generate_dialogue(jobj, include_reasoning)
-            conversations.append(dialogue)
 
-        return conversations
+def format_output_file(output_file: str, format_name: str) -> str:
+    """
+    Output file of one of several formats: '{format}' in output_file is
+    replaced by the format name, or the name is appended to the file name.
+    """
+    if "{format}" in output_file:
+        return output_file.replace("{format}", format_name)
+    root, extension = os.path.splitext(output_file)
+    return f"{root}_{format_name}{extension}"
 
 
 class AxolotlConverter:
-    def __init__(self, format_name: str, input_dir: str, output_file: str):
+    def __init__(self, format_name: Union[str, Sequence[str]], input_dir: Optional[str], output_file: str,
+                 writer_options: Optional[Dict[str, Any]] = None, stats: Optional[RunStats] = None,
+                 token_budget: Optional[TokenBudget] = None, shuffle_seed: Optional[Union[int, str]] = None,
+                 shuffle_memory: Optional[int] = None):
         """
         Initialize the converter with format type, input directory, and output file.
         
         Args:
-            format_name: The format to convert to ('sharegpt' or 'alpaca')
-            input_dir: Directory containing cleaned log files
-            output_file: Path to the output file
+            format_name: The format to convert to ('sharegpt', 'chat_template' or
+                'alpaca'), or a list of formats to write from a single pass
+                over the logs
+            input_dir: Directory containing cleaned log files. May be None when
+                conversations are passed in with process_conversations()
+            output_file: Path to the output file. '{format}' in it is replaced
+                by the format name; with several formats, each one gets its
+                own file (see format_output_file())
+            writer_options: DatasetWriter options (shard_max_bytes, shard_max_records,
+                compression, buffer_size, write_index), and 'container': 'jsonl'
+                (default), 'parquet' / 'arrow' to write with ArrowDatasetWriter,
+                or 'tokens' to write token arrays with TokenizedDatasetWriter
+                (with its tokenizer_file, template, ... options)
+            stats: Run statistics to record into. Default: a new RunStats
+            token_budget: Split long chats and pack short ones to this budget.
+                Default: one sample per chat
+            shuffle_seed: Write the samples in an order shuffled with this seed,
+                through an ExternalShuffler next to the output. Default: input order
+            shuffle_memory: Largest shuffle bucket read into memory, in bytes.
+                Default: ExternalShuffler's
         """
         self.input_dir = input_dir
         self.output_file = output_file
+        self.writer_options = writer_options or {}
+        # Files written by the last writers, shards included
+        self.output_files: List[str] = []
+        self._writers: Dict[str, Any] = {}
+        self.stats = stats if stats is not None else RunStats()
+        self.token_budget = token_budget
+        self.shuffle_seed = shuffle_seed
+        self.shuffle_memory = shuffle_memory
+        self._shuffler: Optional[ExternalShuffler] = None
         
-        # Initialize the appropriate format handler
-        if format_name == "sharegpt":
-            self.dialogue_format = ShareGPTFormat()
+        # Initialize the appropriate format handlers
+        format_names = [format_name] if isinstance(format_name, str) else list(dict.fromkeys(format_name))
+        if not format_names:
+            raise ValueError("No output format given")
+        for name in format_names:
+            if name not in FORMATS:
+                raise ValueError(f"Unsupported format: {name}")
+        self.formats: Dict[str, DialogueFormat] = {name: FORMATS[name]() for name in format_names}
+        if len(format_names) == 1:
+            self.output_paths = {format_names[0]: output_file.replace("{format}", format_names[0])}
         else:
-            raise ValueError(f"Unsupported format: {format_name}")
+            self.output_paths = {name: format_output_file(output_file, name) for name in format_names}
+        # Logs are parsed once into ShareGPT turns, which every format renders from
+        self.dialogue_format = ShareGPTFormat()
+        # Whether rendered ShareGPT lines can go to the output as they are
+        self._sharegpt_only = format_names == ["sharegpt"]
         
-        # Remove output file if it already exists
-        if os.path.isfile(output_file):
-            os.remove(output_file)
+        # Remove output files if they already exist
+        for path in self.output_paths.values():
+            if os.path.isfile(path):
+                os.remove(path)
+    
+    def with_output_file(self, output_file: str, shuffle_seed: Optional[Union[int, str]] = None) -> "AxolotlConverter":
+        """
+        A converter with the same formats and options writing to another
+        output file, e.g. one part of a dataset.
+        
+        Args:
+            output_file: Path to the output file ('{format}' is replaced as in __init__)
+            shuffle_seed: Shuffle seed of the new converter, if this one shuffles.
+                Default: this one's
+        """
+        if self.shuffle_seed is None or shuffle_seed is None:
+            shuffle_seed = self.shuffle_seed
+        return AxolotlConverter(list(self.formats), self.input_dir, output_file, self.writer_options, self.stats,
+                                self.token_budget, shuffle_seed=shuffle_seed, shuffle_memory=self.shuffle_memory)
     
     def process_file(self, file_path: str, include_reasoning: bool) -> int:
         """
-        Process a single file and append the result to the output file.
+        Process a single file and append the result to the output files.
         
         Args:
             file_path: Path to the input file
@@ -79,28 +227,246 @@ class AxolotlConverter:
         Returns:
             Number of conversations processed
         """
-        conversations = self.dialogue_format.generate_conversation(file_path, include_reasoning)
+        count = 0
+        
+        def dialogue() -> Iterator[dict]:
+            nonlocal count
+            for turn in self.dialogue_format.iter_conversation(file_path, include_reasoning):
+                count += 1
+                yield turn
         
-        with open(self.output_file, "a") as fout:
-            data = json.dumps({"conversations": conversations}) + "\n"
-            fout.write(data)
+        with self.stats.timer("stage2.process_file"):
+            if self._sharegpt_only:
+                # The record is streamed turn by turn from the cleaned log to the output
+                chunks = self.record_chunks(dialogue())
+                writer = self._writers.get("sharegpt")
+                if self._shuffler is not None:
+                    self._shuffler.add((b"".join(chunks),))
+                elif writer is not None:
+                    writer.write_chunks(chunks)
+                else:
+                    with open(self.output_paths["sharegpt"], "ab") as fout:
+                        for chunk in chunks:
+                            fout.write(chunk)
+            else:
+                # Read once, then rendered in every format
+                self._write_sample(list(dialogue()))
+        self.stats.count("stage2_bytes_read", os.path.getsize(file_path))
         
-        return len(conversations)
+        return count
     
-    def process_all_files(self, include_reasoning: bool = False) -> int:
+    @staticmethod
+    def record_chunks(dialogue: Iterable[dict]) -> Iterator[bytes]:
+        """
+        Serialize {"conversations": dialogue} as a JSONL line, one turn at a time.
+        The pieces join to the same bytes as json_codec.dumpb() of the whole
+        record, except when a turn holds a lone surrogate: only that turn is
+        then written with \\u escapes, where dumpb() escapes the whole record.
+        Both decode to the same record.
+        """
+        yield b'{"conversations":['
+        separator = b""
+        for turn in dialogue:
+            yield separator + json_codec.dumpb(turn)
+            separator = b","
+        yield b"]}\n"
+    
+    def open_writer(self, format_name: Optional[str] = None):
+        """
+        Open a DatasetWriter, an ArrowDatasetWriter for Parquet/Arrow output or
+        a TokenizedDatasetWriter for pre-tokenized output, for the output file
+        of a format (default: the first) with the configured options.
+        """
+        format_name = format_name or next(iter(self.formats))
+        options = dict(self.writer_options)
+        container = options.pop("container", "jsonl")
+        output_file = self.output_paths[format_name]
+        if container == "jsonl":
+            return DatasetWriter(output_file, **options)
+        if container == "tokens":
+            return TokenizedDatasetWriter(output_file, record_format=format_name, **options)
+        return ArrowDatasetWriter(output_file, container=container, record_format=format_name, **options)
+    
+    @contextmanager
+    def _writing(self) -> Iterator[Dict[str, Any]]:
+        """Open a writer for every format for the duration of a conversion."""
+        with ExitStack() as stack:
+            writers = {name: stack.enter_context(self.open_writer(name)) for name in self.formats}
+            self._writers = writers
+            if self.shuffle_seed is not None:
+                options = {"max_memory": self.shuffle_memory} if self.shuffle_memory else {}
+                self._shuffler = ExternalShuffler(self.shuffle_seed, os.path.dirname(self.output_file) or None, **options)
+                stack.callback(self._shuffler.close)
+            try:
+                yield writers
+                if self._shuffler is not None:
+                    self._write_shuffled(writers)
+            finally:
+                self._writers = {}
+                self._shuffler = None
+        self._finish_writers(writers)
+    
+    def _write_shuffled(self, writers: Dict[str, Any]) -> None:
+        """Write the samples collected by the shuffler, in shuffled order."""
+        self.stats.count("shuffled_samples", self._shuffler.samples)
+        with self.stats.timer("stage2.shuffle"):
+            for lines in self._shuffler.drain():
+                for name, line in zip(self.formats, lines):
+                    if line is not None:
+                        writers[name].write(line)
+    
+    def _finish_writers(self, writers: Dict[str, Any]) -> None:
+        self.output_files = [path for writer in writers.values() for path in writer.output_files]
+        for writer in writers.values():
+            self.stats.count("stage2_records_written", writer.records)
+        self.stats.count("stage2_bytes_written", sum(os.path.getsize(path) for path in self.output_files))
+    
+    def _write_sample(self, dialogue: List[dict], sharegpt_line: Optional[bytes] = None) -> None:
+        """
+        Render one sample in every format and write it to the open writers
+        (or append it to the output files).
+        
+        Args:
+            dialogue: ShareGPT dialogue turns of the sample
+            sharegpt_line: The sample already rendered as ShareGPT, if it is
         """
-        Process all JSONL files in the input directory and write to the output file.
+        lines = []
+        for name, dialogue_format in self.formats.items():
+            with self.stats.timer("stage2.render_record"):
+                line = sharegpt_line if name == "sharegpt" and sharegpt_line is not None \
+                    else dialogue_format.render(dialogue)
+            if line is None:
+                self.stats.count(f"{name}_records_skipped")
+            lines.append(line)
+        if self._shuffler is not None:
+            # All formats of a sample are kept together, so their files stay aligned
+            self._shuffler.add(lines)
+            return
         
+        for name, line in zip(self.formats, lines):
+            if line is None:
+                continue
+            with self.stats.timer("stage2.write"):
+                writer = self._writers.get(name)
+                if writer is not None:
+                    writer.write(line)
+                else:
+                    with open(self.output_paths[name], "ab") as fout:
+                        fout.write(line)
+    
+    def process_conversations(self, conversations: Iterable[list[dict]], include_reasoning: bool = False) -> int:
+        """
+        Convert cleaned conversations as they are produced, e.g. by
+        LogPreprocessor.iter_conversations(), writing the output in one pass.
+        
+        Args:
+            conversations: Iterable of cleaned conversations (lists of stage 1 entries)
+            
         Returns:
             Total number of conversations processed
         """
+        if self._sharegpt_only and self.token_budget is None:
+            return self.write_records(self.render_record(entries, include_reasoning) for entries in conversations)
+        dialogues = (self.dialogue_format.generate_conversation_from_entries(entries, include_reasoning)
+                     for entries in conversations)
+        if self.token_budget is not None:
+            return self.write_samples(self.token_budget.apply(dialogues))
+        return self.write_samples(dialogues)
+    
+    def render_record(self, entries: Iterable[dict], include_reasoning: bool = False) -> Tuple[bytes, int]:
+        """
+        Render one cleaned conversation as a ShareGPT output line.
+        
+        Returns:
+            The JSONL line and the number of conversations in it
+        """
+        with self.stats.timer("stage2.render_record"):
+            dialogue = self.dialogue_format.generate_conversation_from_entries(entries, include_reasoning)
+            return json_codec.dumpb({"conversations": dialogue}) + b"\n", len(dialogue)
+    
+    def budget_samples(self, records: Iterable[Tuple[bytes, int]]) -> Iterator[List[dict]]:
+        """
+        Apply the token budget to already rendered ShareGPT lines, e.g. from
+        the incremental cache.
+        """
+        return self.token_budget.apply(json_codec.loads(line)["conversations"] for line, _ in records)
+    
+    def write_records(self, records: Iterable[Tuple[bytes, int]]) -> int:
+        """
+        Write rendered ShareGPT lines to the output files in one pass. With
+        other formats, each line is parsed once and rendered in all of them.
+        
+        Args:
+            records: (line, conversation count) pairs, as returned by render_record()
+            
+        Returns:
+            Total number of conversations written
+        """
+        total_conversations = 0
+        
+        with self._writing() as writers:
+            for line, count in records:
+                if self._sharegpt_only:
+                    if self._shuffler is not None:
+                        self._shuffler.add((line,))
+                    else:
+                        with self.stats.timer("stage2.write"):
+                            writers["sharegpt"].write(line)
+                else:
+                    self._write_sample(json_codec.loads(line)["conversations"], line)
+                total_conversations += count
+        
+        return total_conversations
+    
+    def write_samples(self, samples: Iterable[List[dict]]) -> int:
+        """
+        Render samples in every format and write them to the output files in one pass.
+        
+        Args:
+            samples: Samples as lists of ShareGPT dialogue turns
+            
+        Returns:
+            Total number of conversations written
+        """
         total_conversations = 0
         
+        with self._writing():
+            for sample in samples:
+                self._write_sample(sample)
+                total_conversations += len(sample)
+        
+        return total_conversations
+    
+    def list_input_files(self) -> List[str]:
+        """
+        The cleaned log files, in either stage 1 format, in the input directory.
+        Sorted, so the output (and a shuffle with a given seed) does not depend
+        on the order the filesystem lists them in.
+        """
+        file_paths = []
         for root, _, files in os.walk(self.input_dir):
             for file in files:
-                if file.endswith(".jsonl"):
-                    file_path = os.path.join(root, file)
-                    conversations_count = self.process_file(file_path, include_reasoning)
-                    total_conversations += conversations_count
+                if stage1_format.is_stage1_log(file):
+                    file_paths.append(os.path.join(root, file))
+        return sorted(file_paths)
+    
+    def process_all_files(self, include_reasoning: bool = False) -> int:
+        """
+        Process all JSONL files in the input directory and write to the output files.
+        
+        Returns:
+            Total number of conversations processed
+        """
+        if self.token_budget is not None:
+            dialogues = (self.dialogue_format.iter_conversation(file_path, include_reasoning)
+                         for file_path in self.list_input_files())
+            return self.write_samples(self.token_budget.apply(dialogues))
+        
+        total_conversations = 0
+        
+        with self._writing():
+            for file_path in self.list_input_files():
+                conversations_count = self.process_file(file_path, include_reasoning)
+                total_conversations += conversations_count
         
-        return total_conversations
\ No newline at end of file
+        return total_conversations
@@ -0,0 +1,213 @@
+"""
+LLMClient against a local stub of an OpenAI-compatible completions server.
+
+The stub answers every prompt with "re:<prompt>" (or server.answer(prompt)),
+records the prompts of each request and the peak number of requests in
+flight, and can be told to fail its next requests with given HTTP statuses.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fuzzy_classifier
+from llm_client import CompletionCache, LLMClient, LLMError
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.delay = delay
+        self.answer = lambda prompt: f"re:{prompt}"
+        self.lock = threading.Lock()
+        # Prompts of every request that got an answer, and statuses of every request
+        self.batches = []
+        self.statuses = []
+        # HTTP statuses of the next requests
+        self.failures = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status = server.failures.pop(0) if server.failures else 200
+            server.statuses.append(status)
+        try:
+            time.sleep(server.delay)
+            if status != 200:
+                self.send_error(status)
+                return
+            with server.lock:
+                server.batches.append(body["prompt"])
+            # Out of order, as some servers answer; the client sorts by index
+            choices = [{"index": i, "text": server.answer(prompt)} for i, prompt in enumerate(body["prompt"])][::-1]
+            data = json.dumps({"choices": choices}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+@pytest.fixture
+def server():
+    server = StubServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server: StubServer, **options) -> LLMClient:
+    options.setdefault("retry_delay", 0.01)
+    return LLMClient(server.url, "stub-model", **options)
+
+
+def test_batches_by_batch_size(server):
+    prompts = [f"p{i}" for i in range(10)]
+    client = make_client(server, batch_size=3, concurrency=1)
+
+    completions = asyncio.run(client.complete(prompts, max_tokens=4))
+
+    assert completions == [f"re:{prompt}" for prompt in prompts]
+    assert [len(batch) for batch in server.batches] == [3, 3, 3, 1]
+    assert sorted(prompt for batch in server.batches for prompt in batch) == sorted(prompts)
+    assert client.stats.counters["llm_requests"] == 4
+
+
+def test_concurrency_cap(server):
+    server.delay = 0.05
+    client = make_client(server, batch_size=1, concurrency=2)
+
+    asyncio.run(client.complete([f"p{i}" for i in range(8)]))
+
+    assert len(server.batches) == 8
+    assert server.max_in_flight == 2
+
+
+def test_identical_prompts_sent_once(server):
+    client = make_client(server, batch_size=8)
+
+    completions = asyncio.run(client.complete(["a", "b", "a", "a"]))
+
+    assert completions == ["re:a", "re:b", "re:a", "re:a"]
+    assert server.batches == [["a", "b"]]
+    assert client.stats.counters["llm_duplicate_prompts"] == 2
+
+
+def test_variants_completed_separately(server):
+    client = make_client(server, batch_size=8)
+
+    asyncio.run(client.complete(["a", "a"], variants=[0, 1]))
+
+    assert server.batches == [["a", "a"]]
+
+
+def test_cache_reused_across_calls(server, tmp_path):
+    cache = CompletionCache(str(tmp_path / "llm.sqlite"))
+    client = make_client(server, cache=cache, batch_size=2)
+
+    first = asyncio.run(client.complete(["a", "b", "c"], max_tokens=4))
+    requests = len(server.batches)
+    second = asyncio.run(client.complete(["c", "a", "b"], max_tokens=4))
+    # A new client on the same database, as in a later run
+    third = asyncio.run(make_client(server, cache=CompletionCache(cache.db_path)).complete(["b"], max_tokens=4))
+
+    assert first == ["re:a", "re:b", "re:c"]
+    assert second == ["re:c", "re:a", "re:b"]
+    assert third == ["re:b"]
+    assert len(server.batches) == requests == 2
+    assert len(cache) == 3
+    assert client.stats.counters["llm_cache_hits"] == 3
+
+
+def test_cache_keyed_by_parameters(server, tmp_path):
+    client = make_client(server, cache=CompletionCache(str(tmp_path / "llm.sqlite")))
+
+    asyncio.run(client.complete(["a"], max_tokens=4))
+    asyncio.run(client.complete(["a"], max_tokens=8))
+
+    assert server.batches == [["a"], ["a"]]
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_retries_transient_errors(server, status):
+    server.failures = [status, status]
+    client = make_client(server, max_retries=3)
+
+    completions = asyncio.run(client.complete(["a"]))
+
+    assert completions == ["re:a"]
+    assert server.statuses == [status, status, 200]
+    assert client.stats.counters["llm_retries"] == 2
+
+
+def test_gives_up_after_max_retries(server):
+    server.failures = [503] * 3
+    client = make_client(server, max_retries=2)
+
+    with pytest.raises(LLMError, match="HTTP 503"):
+        asyncio.run(client.complete(["a"]))
+    assert server.statuses == [503, 503, 503]
+
+
+def test_fails_on_client_error_without_retrying(server, tmp_path):
+    server.failures = [400]
+    cache = CompletionCache(str(tmp_path / "llm.sqlite"))
+    client = make_client(server, cache=cache, max_retries=3)
+
+    with pytest.raises(LLMError, match="HTTP 400"):
+        asyncio.run(client.complete(["a"]))
+    assert server.statuses == [400]
+    assert client.stats.counters["llm_retries"] == 0
+    assert len(cache) == 0
+
+
+def test_classify_names(server):
+    answers = {"Alice": " 1. One character", "Sword of Dawn": "2", "Tom and Jerry": "3.", "Nowhere": "no idea"}
+    server.answer = lambda prompt: next(text for name, text in answers.items() if f'"{name}"' in prompt)
+    client = make_client(server, batch_size=2)
+
+    names = ["Alice", "Sword of Dawn", "Alice", "Tom and Jerry", "Nowhere"]
+    kinds = asyncio.run(fuzzy_classifier.classify_names(client, names))
+
+    assert kinds == {"Alice": "character", "Sword of Dawn": "object", "Tom and Jerry": "group", "Nowhere": "unsure"}
+    assert sum(len(batch) for batch in server.batches) == 4
+
+
+def test_generate_guidelines_samples_each_variant(server, tmp_path):
+    server.answer = lambda prompt: "Stay in character.'"
+    cache = CompletionCache(str(tmp_path / "llm.sqlite"))
+
+    guidelines = asyncio.run(fuzzy_classifier.generate_guidelines(make_client(server, cache=cache, batch_size=8), 3))
+
+    assert guidelines == ["Stay in character."] * 3
+    assert len(server.batches[0]) == 3
+    assert len(cache) == 3
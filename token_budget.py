@@ -0,0 +1,189 @@
+"""
+Token budget for stage 2 samples.
+
+Trainers truncate samples longer than their context window and pad short
+ones up to it. TokenBudget measures dialogue turns with a token counter and
+- splits chats longer than max_tokens into context-sized windows, each
+  starting with the chat's system prompt (the leading system turns added by
+  LogPreprocessor.prepend_instructions). Windows break before human turns,
+  so every window starts with the user speaking.
+- optionally packs short chats (and the last window of long ones) together
+  into samples of up to max_tokens. A packed sample is the concatenation
+  of its chats; each one still starts with its own system turn.
+
+Token counts come from a local Hugging Face tokenizer file (needs the
+'tokenizers' package) or from a fast characters-per-token estimate.
+
+Usage:
+    from token_budget import TokenBudget, make_token_counter
+
+    budget = TokenBudget(4096, make_token_counter("tokenizer.json"), pack=True)
+    for sample in budget.apply(dialogues):
+        ...
+"""
+
+import math
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from run_stats import RunStats
+
+# Approximate number of characters per token of English text for BPE tokenizers
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+
+class CharTokenCounter:
+    """Estimates token counts from the text length."""
+
+    def __init__(self, chars_per_token: float = DEFAULT_CHARS_PER_TOKEN):
+        if chars_per_token <= 0:
+            raise ValueError("chars_per_token must be positive")
+        self.chars_per_token = chars_per_token
+
+    def __call__(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+
+class TokenizerTokenCounter:
+    """Counts tokens with a Hugging Face tokenizer.json file."""
+
+    def __init__(self, tokenizer_file: str):
+        try:
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError("Counting with a tokenizer requires the 'tokenizers' package: pip3 install tokenizers")
+        self.tokenizer = Tokenizer.from_file(tokenizer_file)
+
+    def __call__(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def make_token_counter(tokenizer_file: Optional[str] = None,
+                       chars_per_token: float = DEFAULT_CHARS_PER_TOKEN) -> Callable[[str], int]:
+    """
+    Token counter for a tokenizer file, or the character estimate if tokenizer_file is None.
+    """
+    if tokenizer_file:
+        return TokenizerTokenCounter(tokenizer_file)
+    return CharTokenCounter(chars_per_token)
+
+
+class TokenBudget:
+    """Splits long chats into windows and packs short ones up to a token budget."""
+
+    def __init__(self, max_tokens: int, counter: Callable[[str], int], pack: bool = False,
+                 turn_overhead: int = 4, pack_buffer: int = 64, stats: Optional[RunStats] = None):
+        """
+        Args:
+            max_tokens: Token budget of one sample, usually the training context length
+            counter: Function returning the number of tokens of a text
+            pack: Pack short chats together up to max_tokens
+            turn_overhead: Tokens added per turn by the chat template (role markers, separators)
+            pack_buffer: Number of partially filled samples kept open while packing.
+                More gives fuller samples at the cost of memory.
+            stats: Run statistics to record into. Default: a new RunStats
+        """
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be positive")
+        self.max_tokens = max_tokens
+        self.counter = counter
+        self.pack = pack
+        self.turn_overhead = turn_overhead
+        self.pack_buffer = max(1, pack_buffer)
+        self.stats = stats if stats is not None else RunStats()
+
+    def count_turn(self, turn: dict) -> int:
+        value = turn.get("value") if isinstance(turn, dict) else None
+        return self.counter(value or "") + self.turn_overhead
+
+    def split(self, dialogue: Iterable[dict]) -> Iterator[Tuple[List[dict], int, bool]]:
+        """
+        Split one chat into windows of at most max_tokens. The turns are read
+        lazily, so only one window is held in memory.
+
+        Yields:
+            (turns, tokens, last) for each window; last is True for the final one.
+            An exchange longer than max_tokens on its own becomes one oversized window.
+        """
+        header: List[dict] = []
+        header_tokens = 0
+        window: List[dict] = []
+        window_tokens = 0
+        exchange: List[dict] = []
+        exchange_tokens = 0
+        in_header = True
+
+        def flush_exchange():
+            nonlocal window, window_tokens, exchange, exchange_tokens
+            full = None
+            if window and header_tokens + window_tokens + exchange_tokens > self.max_tokens:
+                full = (header + window, header_tokens + window_tokens, False)
+                window, window_tokens = [], 0
+            window += exchange
+            window_tokens += exchange_tokens
+            exchange, exchange_tokens = [], 0
+            return full
+
+        for turn in dialogue:
+            if in_header and isinstance(turn, dict) and turn.get("from") == "system":
+                header.append(turn)
+                header_tokens += self.count_turn(turn)
+                continue
+            in_header = False
+
+            if exchange and isinstance(turn, dict) and turn.get("from") == "human":
+                full = flush_exchange()
+                if full is not None:
+                    yield full
+            exchange.append(turn)
+            exchange_tokens += self.count_turn(turn)
+
+        full = flush_exchange()
+        if full is not None:
+            yield full
+        if window or header:
+            yield header + window, header_tokens + window_tokens, True
+
+    def apply(self, dialogues: Iterable[Iterable[dict]]) -> Iterator[List[dict]]:
+        """
+        Split and pack a stream of chats.
+
+        Args:
+            dialogues: Chats as iterables of dialogue turns ({"from": ..., "value": ...})
+
+        Yields:
+            Samples as lists of dialogue turns
+        """
+        # Open samples being packed: [tokens, turns]
+        bins: List[list] = []
+
+        for dialogue in dialogues:
+            self.stats.count("budget_chats")
+            windows = 0
+            for turns, tokens, last in self.split(dialogue):
+                windows += 1
+                if tokens > self.max_tokens:
+                    self.stats.count("budget_oversized_samples")
+                if not (last and self.pack) or tokens >= self.max_tokens:
+                    self.stats.count("budget_samples")
+                    yield turns
+                    continue
+
+                # First fit into the open samples
+                for open_bin in bins:
+                    if open_bin[0] + tokens <= self.max_tokens:
+                        open_bin[0] += tokens
+                        open_bin[1] += turns
+                        self.stats.count("budget_packed_chats")
+                        break
+                else:
+                    if len(bins) >= self.pack_buffer:
+                        fullest = max(range(len(bins)), key=lambda i: bins[i][0])
+                        self.stats.count("budget_samples")
+                        yield bins.pop(fullest)[1]
+                    bins.append([tokens, turns])
+            if windows > 1:
+                self.stats.count("budget_split_chats")
+
+        for _, turns in bins:
+            self.stats.count("budget_samples")
+            yield turns
@@ -0,0 +1,357 @@
+"""
+Pre-tokenized dataset writer.
+
+Instead of text that the trainer tokenizes again on every run,
+TokenizedDatasetWriter renders each ShareGPT conversation with a prompt
+template, tokenizes it with a local Hugging Face tokenizer.json and appends
+the tokens to flat NumPy arrays that trainers memory-map:
+
+    <output>.input_ids.npy  uint16 (vocabularies up to 65536) or uint32 token ids
+    <output>.labels.npy     int32, the token id on trained tokens, -100 elsewhere
+    <output>.offsets.npy    int64, sample i is [offsets[i], offsets[i + 1])
+    <output>.meta.json      template, tokenizer, dtypes and counts
+
+Only assistant replies and their end-of-turn marker are trained; the
+reasoning of a reply (a leading <think>...</think> block) can be masked too.
+Records are tokenized in batches, in worker processes if requested, and
+written in order as the batches complete. The .npy headers are rewritten
+with the final lengths on close.
+
+Requires the optional 'numpy' and 'tokenizers' packages.
+
+Usage:
+    from tokenized_writer import TokenizedDatasetWriter, open_tokenized
+
+    with TokenizedDatasetWriter("out/sharegpt.tokens", "tokenizer.json", workers=4) as writer:
+        writer.write(json_codec.dumpb({"conversations": conversation}) + b"\\n")
+
+    arrays = open_tokenized("out/sharegpt.tokens")
+    start, stop = arrays["offsets"][i], arrays["offsets"][i + 1]
+    input_ids, labels = arrays["input_ids"][start:stop], arrays["labels"][start:stop]
+"""
+
+import json
+import os
+import struct
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import json_codec
+
+# Label of tokens that are not trained (ignored by the cross-entropy loss)
+IGNORE_INDEX = -100
+
+# Prompt templates: text before the first turn, and around each turn
+TEMPLATES = {
+    "chatml": {
+        "bos": "",
+        "prefix": "<|im_start|>{role}\n",
+        "suffix": "<|im_end|>\n",
+    },
+    "llama3": {
+        "bos": "<|begin_of_text|>",
+        "prefix": "<|start_header_id|>{role}<|end_header_id|>\n\n",
+        "suffix": "<|eot_id|>",
+    },
+}
+
+ROLES = {"system": "system", "human": "user", "gpt": "assistant"}
+
+ARRAYS = ("input_ids", "labels", "offsets")
+
+# Fixed size of the .npy headers, so they can be rewritten in place
+_NPY_HEADER_SIZE = 128
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+def npy_header(dtype: str, length: int) -> bytes:
+    """Header of a one-dimensional .npy file (format 1.0), padded to a fixed size."""
+    header = repr({"descr": dtype, "fortran_order": False, "shape": (length,)}).encode("latin1")
+    header = header.ljust(_NPY_HEADER_SIZE - len(_NPY_MAGIC) - 2 - 1) + b"\n"
+    return _NPY_MAGIC + struct.pack("<H", len(header)) + header
+
+
+def render_segments(dialogue: Iterable[dict], template: Dict[str, str],
+                    train_reasoning: bool = True) -> List[Tuple[str, bool]]:
+    """
+    Render a conversation with a prompt template.
+
+    Args:
+        dialogue: ShareGPT dialogue turns
+        template: One of TEMPLATES
+        train_reasoning: Train the <think> block of assistant replies
+
+    Returns:
+        (text, trained) segments; adjacent segments differ in trained
+    """
+    segments: List[Tuple[str, bool]] = []
+
+    def add(text: str, trained: bool) -> None:
+        if not text:
+            return
+        if segments and segments[-1][1] == trained:
+            segments[-1] = (segments[-1][0] + text, trained)
+        else:
+            segments.append((text, trained))
+
+    add(template["bos"], False)
+    for turn in dialogue:
+        if turn is None:
+            continue
+        role = ROLES[turn["from"]]
+        value = turn["value"]
+        add(template["prefix"].format(role=role), False)
+        if role != "assistant":
+            add(value + template["suffix"], False)
+            continue
+        if not train_reasoning and value.startswith("<think>"):
+            end = value.find("</think>")
+            if end != -1:
+                end += len("</think>")
+                if value.startswith("\n", end):
+                    end += 1
+                add(value[:end], False)
+                value = value[end:]
+        add(value + template["suffix"], True)
+    return segments
+
+
+def tokenize_records(tokenizer, lines: List[bytes], template_name: str, train_reasoning: bool,
+                     ids_typecode: str) -> Tuple[bytes, bytes, List[int], int]:
+    """
+    Tokenize a batch of rendered {"conversations": [...]} lines.
+
+    Returns:
+        The raw input ids and labels of the batch, the number of tokens of
+        each sample and the number of trained tokens
+    """
+    template = TEMPLATES[template_name]
+    samples = [render_segments(json_codec.loads(line)["conversations"], template, train_reasoning)
+               for line in lines]
+    encodings = tokenizer.encode_batch([text for segments in samples for text, _ in segments],
+                                       add_special_tokens=False)
+
+    input_ids = array(ids_typecode)
+    labels = array("i")
+    lengths = []
+    trained_tokens = 0
+    position = 0
+    for segments in samples:
+        length = 0
+        for _, trained in segments:
+            token_ids = encodings[position].ids
+            position += 1
+            input_ids.extend(token_ids)
+            if trained:
+                labels.extend(token_ids)
+                trained_tokens += len(token_ids)
+            else:
+                labels.extend([IGNORE_INDEX] * len(token_ids))
+            length += len(token_ids)
+        lengths.append(length)
+    return input_ids.tobytes(), labels.tobytes(), lengths, trained_tokens
+
+
+def _load_tokenizer(tokenizer_file: str):
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        raise ImportError("Pre-tokenized output requires the 'tokenizers' package: pip3 install tokenizers")
+    return Tokenizer.from_file(tokenizer_file)
+
+
+class TokenizedDatasetWriter:
+    """Tokenizes conversations into flat, memory-mappable NumPy arrays."""
+
+    def __init__(self, output_file: str, tokenizer_file: str, template: str = "chatml",
+                 train_reasoning: bool = True, batch_size: int = 256, workers: int = 1,
+                 record_format: str = "sharegpt", shard_max_bytes: Optional[int] = None,
+                 shard_max_records: Optional[int] = None, compression: Optional[str] = None,
+                 buffer_size: Optional[int] = None, write_index: bool = True):
+        """
+        Args:
+            output_file: Path of the output; the arrays are named after it
+                without its extension (<root>.input_ids.npy, ...)
+            tokenizer_file: Hugging Face tokenizer.json
+            template: Prompt template, see TEMPLATES
+            train_reasoning: Train the <think> block of assistant replies
+            batch_size: Records per tokenization batch
+            workers: Number of worker processes tokenizing batches. 1
+                tokenizes in this process
+            record_format: Dialogue format of the records; only 'sharegpt'
+            shard_max_bytes, shard_max_records, compression: Not supported,
+                accepted for DatasetWriter compatibility
+            buffer_size: Unused, accepted for DatasetWriter compatibility
+            write_index: Write the <root>.meta.json description on close
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("Pre-tokenized output requires the 'numpy' package: pip3 install numpy")
+        if template not in TEMPLATES:
+            raise ValueError(f"Unsupported template: {template}")
+        if record_format != "sharegpt":
+            raise ValueError(f"Pre-tokenized output is rendered from sharegpt records, not {record_format}")
+        if shard_max_bytes or shard_max_records or compression:
+            raise ValueError("Pre-tokenized output cannot be sharded or compressed")
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+
+        tokenizer = _load_tokenizer(tokenizer_file)
+        self.output_file = output_file
+        self.tokenizer_file = tokenizer_file
+        self.template = template
+        self.train_reasoning = train_reasoning
+        self.batch_size = batch_size
+        self.workers = workers
+        self.write_index = write_index
+        self.vocab_size = tokenizer.get_vocab_size(with_added_tokens=True)
+        self._ids_typecode = "H" if self.vocab_size <= 1 << 16 else "I"
+        self.dtypes = {
+            "input_ids": numpy.dtype(self._ids_typecode).str,
+            "labels": numpy.dtype("i").str,
+            "offsets": numpy.dtype("q").str,
+        }
+
+        root = os.path.splitext(output_file)[0]
+        self.paths = {name: f"{root}.{name}.npy" for name in ARRAYS}
+        self.index_file = f"{root}.meta.json"
+
+        self.offsets = array("q", [0])
+        self.trained_tokens = 0
+        self._files = {}
+        for name in ("input_ids", "labels"):
+            self._files[name] = open(self.paths[name], "wb")
+            self._files[name].write(npy_header(self.dtypes[name], 0))
+
+        self._batch: List[bytes] = []
+        self._pending = deque()
+        self._tokenizer = None
+        self._executor = None
+        if workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                 initargs=(tokenizer_file,))
+        else:
+            self._tokenizer = tokenizer
+        self._closed = False
+
+    def __enter__(self) -> "TokenizedDatasetWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def output_files(self) -> List[str]:
+        return [self.paths[name] for name in ARRAYS]
+
+    @property
+    def records(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def tokens(self) -> int:
+        return self.offsets[-1]
+
+    def _submit(self) -> None:
+        """Tokenize the buffered records, in a worker if there are any."""
+        if not self._batch:
+            return
+        args = (self._batch, self.template, self.train_reasoning, self._ids_typecode)
+        self._batch = []
+        if self._executor is None:
+            self._append(tokenize_records(self._tokenizer, *args))
+            return
+        self._pending.append(self._executor.submit(_tokenize_worker, *args))
+        # Bounded read-ahead; results are written in submission order
+        while len(self._pending) > 2 * self.workers:
+            self._append(self._pending.popleft().result())
+
+    def _append(self, result: Tuple[bytes, bytes, List[int], int]) -> None:
+        input_ids, labels, lengths, trained_tokens = result
+        self._files["input_ids"].write(input_ids)
+        self._files["labels"].write(labels)
+        end = self.offsets[-1]
+        for length in lengths:
+            end += length
+            self.offsets.append(end)
+        self.trained_tokens += trained_tokens
+
+    def write(self, line: Union[str, bytes]) -> None:
+        """Write one record, a rendered {"conversations": [...]} JSON line."""
+        self._batch.append(line)
+        if len(self._batch) >= self.batch_size:
+            self._submit()
+
+    def write_chunks(self, chunks: Iterable[bytes]) -> int:
+        """Write one record given as consecutive pieces of a JSON line."""
+        line = b"".join(chunks)
+        self.write(line)
+        return len(line)
+
+    def close(self) -> None:
+        """Tokenize the remaining records, finalize the arrays and write the description."""
+        if self._closed:
+            return
+        self._closed = True
+
+        try:
+            self._submit()
+            while self._pending:
+                self._append(self._pending.popleft().result())
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+
+        # The lengths are only known now
+        for name, f in self._files.items():
+            f.seek(0)
+            f.write(npy_header(self.dtypes[name], self.tokens))
+            f.close()
+        with open(self.paths["offsets"], "wb") as f:
+            f.write(npy_header(self.dtypes["offsets"], len(self.offsets)))
+            self.offsets.tofile(f)
+
+        if self.write_index:
+            meta = {
+                "template": self.template,
+                "train_reasoning": self.train_reasoning,
+                "tokenizer": os.path.abspath(self.tokenizer_file),
+                "vocab_size": self.vocab_size,
+                "ignore_index": IGNORE_INDEX,
+                "records": self.records,
+                "tokens": self.tokens,
+                "trained_tokens": self.trained_tokens,
+                "arrays": {
+                    name: {"path": os.path.basename(path), "dtype": self.dtypes[name]}
+                    for name, path in self.paths.items()
+                },
+            }
+            with open(self.index_file, "w", encoding="utf-8") as f:
+                json.dump(meta, f, indent=2)
+
+
+def open_tokenized(output_file: str) -> Dict[str, Any]:
+    """Memory-map the arrays written by TokenizedDatasetWriter for output_file."""
+    import numpy
+
+    root = os.path.splitext(output_file)[0]
+    return {name: numpy.load(f"{root}.{name}.npy", mmap_mode="r") for name in ARRAYS}
+
+
+# Tokenizer owned by each worker process
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer_file: str) -> None:
+    global _worker_tokenizer
+    # Parallelism comes from the worker processes; keep each one single-threaded
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _worker_tokenizer = _load_tokenizer(tokenizer_file)
+
+
+def _tokenize_worker(lines: List[bytes], template_name: str, train_reasoning: bool,
+                     ids_typecode: str) -> Tuple[bytes, bytes, List[int], int]:
+    return tokenize_records(_worker_tokenizer, lines, template_name, train_reasoning, ids_typecode)
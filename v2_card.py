@@ -4,14 +4,19 @@ Tavern Cards, as defined by Character Card Spec V2:
 """
 
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Literal, Optional, Union
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
 from dataclasses_json import dataclass_json, Undefined
 
 from PIL import Image
 import base64
 import json
+import os
+import struct
+import zlib
 import dacite
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
 
 @dataclass_json
 @dataclass
@@ -90,10 +95,58 @@ class TavernCardV2:
     )
 
 
+def read_png_text_chunks(image_path: str) -> Dict[str, str]:
+    """
+    Read the tEXt/zTXt/iTXt chunks of a PNG without decoding pixel data.
+    Image data chunks are skipped with a seek, so the cost does not depend
+    on the image size.
+    """
+    chunks = {}
+    with open(image_path, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            raise ValueError(f"Not a PNG file: {image_path}")
+
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack(">I4s", header)
+
+            if chunk_type not in (b"tEXt", b"zTXt", b"iTXt"):
+                if chunk_type == b"IEND":
+                    break
+                f.seek(length + 4, os.SEEK_CUR)  # data + CRC
+                continue
+
+            data = f.read(length)
+            f.seek(4, os.SEEK_CUR)  # CRC
+            keyword, _, rest = data.partition(b"\0")
+            keyword = keyword.decode("latin-1")
+
+            if chunk_type == b"tEXt":
+                text = rest.decode("latin-1")
+            elif chunk_type == b"zTXt":
+                text = zlib.decompress(rest[1:]).decode("latin-1")
+            else:
+                compressed, rest = rest[0], rest[2:]
+                _language, _, rest = rest.partition(b"\0")
+                _translated, _, rest = rest.partition(b"\0")
+                text = (zlib.decompress(rest) if compressed else rest).decode("utf-8")
+
+            # Like PIL, the last chunk with a given keyword wins
+            chunks[keyword] = text
+
+    return chunks
+
+
 def extract_exif_data(image_path):
-    img = Image.open(image_path)
-    img.load()
-    return img.info
+    try:
+        return read_png_text_chunks(image_path)
+    except ValueError:
+        # Not a PNG; let PIL handle other image formats
+        img = Image.open(image_path)
+        img.load()
+        return img.info
 
 
 def parse(image_path: str) -> TavernCardV2:
@@ -115,3 +168,59 @@ def parse(image_path: str) -> TavernCardV2:
         raise error
 
     return ret
+
+
+class CardCache:
+    """
+    Parsed cards keyed by path, invalidated when the file's mtime or size changes.
+    Shared by all chats of a character, so each card is parsed once per run.
+    """
+
+    def __init__(self):
+        self._cards: Dict[str, Tuple[Tuple[int, int], Optional[TavernCardV2], Optional[Exception]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_path: str) -> TavernCardV2:
+        """
+        Parse a card, or return the cached result. Cards that failed to parse
+        raise the same error again until the file changes.
+        """
+        key = os.path.normpath(image_path)
+        stat = os.stat(key)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._cards.get(key)
+        if cached and cached[0] == version:
+            self.hits += 1
+        else:
+            self.misses += 1
+            try:
+                cached = (version, parse(key), None)
+            except Exception as error:
+                cached = (version, None, error)
+            self._cards[key] = cached
+
+        if cached[2] is not None:
+            raise cached[2]
+        return cached[1]
+
+    def prewarm(self, characters_dir: str) -> int:
+        """
+        Parse every card in a characters folder.
+
+        Returns:
+            Number of cards parsed successfully
+        """
+        parsed = 0
+        if not os.path.isdir(characters_dir):
+            return parsed
+
+        for file in sorted(os.listdir(characters_dir)):
+            if file.endswith(".png"):
+                try:
+                    self.get(os.path.join(characters_dir, file))
+                    parsed += 1
+                except Exception:
+                    continue
+        return parsed